@@ -0,0 +1,149 @@
+"""
+Benchmarks mandate against the local stand-in in mandate.testing:
+SRP logins per second, token verifications per second, get_users and
+scan_users streaming throughput and how long the event loop gets blocked
+meanwhile.
+
+    python -m benchmarks.bench_cognito --latency 0.005 --users 5000
+"""
+import argparse
+import asyncio
+import time
+
+from mandate import Cognito
+from mandate.metrics import Histogram
+from mandate.testing import FakeCognito
+
+PASSWORD = 'Passw0rd!'
+LAG_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+               0.25, 0.5, 1.0)
+
+
+class LoopLagMonitor(object):
+    """
+    Measures how late the event loop wakes up a task sleeping `interval`
+    seconds, i.e. for how long something blocked the loop.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.lag = Histogram(LAG_BUCKETS)
+        self.max_lag = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - start - self.interval, 0.0)
+            self.lag.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def __enter__(self):
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._task.cancel()
+
+    def summary(self):
+        return 'loop lag p50<={}s p99<={}s max={:.4f}s'.format(
+            self.lag.quantile(0.5), self.lag.quantile(0.99), self.max_lag)
+
+
+def make_cognito(backend, jwks_url, username=None):
+    return Cognito(backend.user_pool_id, backend.client_id,
+                   username=username,
+                   client_callback=backend.get_client,
+                   jwks_url=jwks_url)
+
+
+async def run_for(duration, concurrency, operation):
+    """
+    Runs `operation` back to back from `concurrency` tasks for `duration`
+    seconds
+    :return: number of completed operations per second
+    """
+    done = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(worker_id):
+        nonlocal done
+        while time.perf_counter() < deadline:
+            await operation(worker_id)
+            done += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    return done / (time.perf_counter() - start)
+
+
+async def bench_logins(backend, jwks_url, duration, concurrency):
+    async def login(worker_id):
+        cog = make_cognito(backend, jwks_url,
+                           username='user{}'.format(worker_id))
+        await cog.authenticate(PASSWORD)
+
+    with LoopLagMonitor() as monitor:
+        rate = await run_for(duration, concurrency, login)
+    print('logins: {:.1f}/s ({})'.format(rate, monitor.summary()))
+
+
+async def bench_verifications(backend, jwks_url, duration):
+    cog = make_cognito(backend, jwks_url)
+    tokens = backend.issue_tokens('user0')
+    await cog.get_keys()
+
+    async def verify(worker_id):
+        await cog.verify_token(tokens['IdToken'], 'id_token', 'id')
+
+    rate = await run_for(duration, 1, verify)
+    print('verifications: {:.1f}/s'.format(rate))
+
+
+async def bench_get_users(backend, jwks_url, concurrency):
+    cog = make_cognito(backend, jwks_url)
+    scans = [('get_users', lambda: cog.iter_users(page_size=60)),
+             ('scan_users', lambda: cog.scan_users(concurrency=concurrency))]
+    for name, scan in scans:
+        count = 0
+        with LoopLagMonitor() as monitor:
+            start = time.perf_counter()
+            async for user in scan():
+                count += 1
+            elapsed = time.perf_counter() - start
+        print('{}: {} users in {:.3f}s, {:.1f} users/s ({})'.format(
+            name, count, elapsed, count / elapsed, monitor.summary()))
+
+
+async def main(args):
+    backend = FakeCognito(latency=args.latency)
+    for i in range(args.users):
+        backend.add_user('user{}'.format(i), PASSWORD,
+                         {'email': 'user{}@example.com'.format(i),
+                          'email_verified': 'true'})
+    runner, jwks_url = await backend.serve_jwks(latency=args.latency)
+    try:
+        await bench_logins(backend, jwks_url, args.duration,
+                           min(args.concurrency, args.users))
+        await bench_verifications(backend, jwks_url, args.duration)
+        await bench_get_users(backend, jwks_url, args.concurrency)
+    finally:
+        await runner.cleanup()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--duration', type=float, default=3.0,
+                        help='seconds per throughput benchmark')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='simulated network latency per call, seconds')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='concurrent logins')
+    parser.add_argument('--users', type=int, default=1000,
+                        help='users in the fake pool')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main(parse_args()))
@@ -0,0 +1,74 @@
+"""
+Measures the cold import time of mandate with `python -X importtime` and
+checks that boto isn't loaded by `import mandate`.
+
+    python -m benchmarks.bench_import --runs 10 --max-ms 150
+
+Exits with status 1 when the median import time is over --max-ms or a
+forbidden module gets imported, so it can guard against regressions in CI.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+FORBIDDEN = ('aioboto3', 'aiobotocore', 'botocore', 'boto3', 'aiohttp')
+
+
+def import_times(module):
+    """
+    Imports `module` in a fresh interpreter
+    :return: dictionary of module name to cumulative import time in
+    microseconds
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    times = {}
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main(args):
+    totals = []
+    for _ in range(args.runs):
+        times = import_times(args.module)
+        totals.append(times[args.module] / 1000.0)
+    median = statistics.median(totals)
+    print('import {}: median {:.1f}ms, min {:.1f}ms over {} runs'.format(
+        args.module, median, min(totals), args.runs))
+
+    slowest = sorted(((value, name) for name, value in times.items()
+                      if name != args.module), reverse=True)[:args.top]
+    for value, name in slowest:
+        print('  {:>8.1f}ms  {}'.format(value / 1000.0, name))
+
+    failed = False
+    loaded = [name for name in FORBIDDEN if name in times]
+    if loaded:
+        print('FAIL: import {} loaded {}'.format(args.module,
+                                                 ', '.join(loaded)))
+        failed = True
+    if args.max_ms is not None and median > args.max_ms:
+        print('FAIL: median import time over {}ms'.format(args.max_ms))
+        failed = True
+    return 1 if failed else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--module', default='mandate')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10,
+                        help='slowest imports to list')
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='fail when the median is above this')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_args()))
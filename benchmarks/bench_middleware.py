@@ -0,0 +1,67 @@
+"""
+Requests per second through CognitoAuthMiddleware, called directly (no HTTP
+server) so only the authentication cost is measured: a steady mix of
+returning tokens, a stream of new tokens, and a storm of invalid ones.
+
+    python -m benchmarks.bench_middleware --requests 100000 --tokens 1000
+"""
+import argparse
+import asyncio
+import time
+
+from mandate.middleware import CachedVerifier, CognitoAuthMiddleware
+from mandate.multipool import MultiPoolVerifier
+from mandate.testing import FakeCognito
+
+
+async def app(scope, receive, send):
+    pass
+
+
+async def send(message):
+    pass
+
+
+async def run(middleware, authorizations, requests):
+    scopes = [{'type': 'http', 'path': '/',
+               'headers': [(b'authorization', authorization.encode())]}
+              for authorization in authorizations]
+    start = time.perf_counter()
+    for i in range(requests):
+        await middleware(dict(scopes[i % len(scopes)]), None, send)
+    return requests / (time.perf_counter() - start)
+
+
+async def main(args):
+    fake = FakeCognito()
+    tokens = []
+    for i in range(args.tokens):
+        username = 'user{}'.format(i)
+        fake.add_user(username)
+        tokens.append('Bearer ' + fake.issue_tokens(
+            username, refresh=False)['AccessToken'])
+
+    def middleware():
+        multipool = MultiPoolVerifier({fake.user_pool_id: fake.client_id})
+        multipool.jwks_cache.set_keys(fake.issuer, fake.jwks)
+        return CognitoAuthMiddleware(app, CachedVerifier(multipool))
+
+    print('new tokens (RSA each time): {:.0f} req/s'.format(
+        await run(middleware(), tokens, len(tokens))))
+    print('returning tokens (cached): {:.0f} req/s'.format(
+        await run(middleware(), tokens, args.requests)))
+    invalid = [token[:-8] + 'AAAAAAAA' for token in tokens]
+    print('invalid token storm (negative cache): {:.0f} req/s'.format(
+        await run(middleware(), invalid, args.requests)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--tokens', type=int, default=1000,
+                        help='distinct tokens in the traffic')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main(parse_args()))
@@ -0,0 +1,88 @@
+"""
+Replays a Cognito trace against a stand-in client and reports the calls per
+second and the latency percentiles of every operation.
+
+    python -m benchmarks.bench_replay --trace prod.ndjson --speed 0
+
+Without --trace, a trace of logins and profile reads against a FakeCognito
+is recorded first.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from mandate.metrics import Metrics
+from mandate.recording import Recorder, Replayer, TraceClient, load_trace
+from mandate.resilience import ResiliencePolicy
+from mandate.testing import FakeCognito
+
+
+async def record(path, calls, latency):
+    fake = FakeCognito(latency=latency, key_bits=1024)
+    for i in range(100):
+        fake.add_user('user{}'.format(i), 'Passw0rd!')
+    recorder = Recorder(path)
+    for i in range(calls):
+        cog = fake.cognito(username='user{}'.format(random.randrange(100)),
+                           recorder=recorder)
+        if i % 10 == 0:
+            await cog.authenticate('Passw0rd!')
+        else:
+            await cog.admin_get_user()
+    recorder.close()
+
+
+async def replay(records, speed, wrappers):
+    """
+    :param wrappers: whether the calls go through mandate's metrics and
+    resilience wrappers
+    """
+    metrics = Metrics()
+    cog = FakeCognito(key_bits=1024).cognito(
+        client_callback=lambda: TraceClient(records, latency=bool(speed)),
+        metrics=metrics if wrappers else None,
+        resilience=ResiliencePolicy() if wrappers else None)
+    replayer = Replayer(records, speed=speed or None)
+    start = time.perf_counter()
+    async with cog.get_client() as client:
+        await replayer.run(client)
+    elapsed = time.perf_counter() - start
+    print('{}: {} calls in {:.2f}s, {:.0f} calls/s'.format(
+        'wrapped' if wrappers else 'plain', len(records), elapsed,
+        len(records) / elapsed))
+    for (operation, phase), histogram in sorted(
+            replayer.metrics.histograms.items()):
+        print('  {:<26} {:<7} p50={:.2f}ms p99={:.2f}ms'.format(
+            operation, phase, histogram.quantile(0.5) * 1000,
+            histogram.quantile(0.99) * 1000))
+
+
+async def main(args):
+    path = args.trace
+    if path is None:
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'trace.ndjson')
+        await record(path, args.calls, args.latency)
+    records = load_trace(path)
+    await replay(records, args.speed, False)
+    await replay(records, args.speed, True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--trace', help='NDJSON trace written by a Recorder')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='1 for the original pacing, 0 for as fast as '
+                             'possible')
+    parser.add_argument('--calls', type=int, default=1000,
+                        help='calls to record without --trace')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='seconds every recorded call takes')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main(parse_args()))
@@ -0,0 +1,88 @@
+"""
+Latency percentiles of admin_get_user against a FakeCognito whose calls
+sometimes stall, with and without hedged requests.
+
+    python -m benchmarks.bench_resilience --calls 2000 --spike-rate 0.03
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from mandate.resilience import ResiliencePolicy
+from mandate.testing import FakeCognito
+from mandate.utils import ClientProxy
+
+
+class SpikyClient(ClientProxy):
+    """
+    Adds `spike` seconds to a `rate` share of the calls
+    """
+
+    def __init__(self, client, rate, spike):
+        super(SpikyClient, self).__init__(client)
+        self.rate = rate
+        self.spike = spike
+
+    async def _call(self, operation, method, args, kwargs):
+        if random.random() < self.rate:
+            await asyncio.sleep(self.spike)
+        return await method(*args, **kwargs)
+
+
+def percentile(ordered, q):
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def run(cogs, calls, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await cogs[i % len(cogs)].admin_get_user()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[one(i) for i in range(calls)])
+    latencies.sort()
+    return ' '.join('p{}={:.1f}ms'.format(int(q * 100),
+                                          percentile(latencies, q) * 1000)
+                    for q in (0.5, 0.9, 0.99))
+
+
+async def main(args):
+    fake = FakeCognito(latency=args.latency)
+    for i in range(100):
+        fake.add_user('user{}'.format(i))
+
+    def client():
+        return SpikyClient(fake.get_client(), args.spike_rate, args.spike)
+
+    def cognitos(resilience=None):
+        return [fake.cognito(username='user{}'.format(i),
+                             client_callback=client, resilience=resilience)
+                for i in range(100)]
+
+    print('plain:  ' + await run(cognitos(), args.calls, args.concurrency))
+    policy = ResiliencePolicy(hedge_quantile=args.quantile)
+    print('hedged: ' + await run(cognitos(policy), args.calls,
+                                 args.concurrency))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='seconds every call takes')
+    parser.add_argument('--spike', type=float, default=0.2,
+                        help='seconds a stalled call takes on top')
+    parser.add_argument('--spike-rate', type=float, default=0.03)
+    parser.add_argument('--quantile', type=float, default=0.95,
+                        help='hedge after this latency quantile')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main(parse_args()))
@@ -0,0 +1,72 @@
+"""
+Compares RS256 verifications per second across the JWT backends of
+mandate.crypto, both raw and through Cognito.verify_token.
+
+    python -m benchmarks.bench_verify --duration 2
+"""
+import argparse
+import asyncio
+import time
+
+from mandate.crypto import BACKENDS, get_backend
+from mandate.testing import FakeCognito
+
+
+def rate(duration, operation):
+    done = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    while time.perf_counter() < deadline:
+        operation()
+        done += 1
+    return done / (time.perf_counter() - start)
+
+
+async def async_rate(duration, operation):
+    done = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    while time.perf_counter() < deadline:
+        await operation()
+        done += 1
+    return done / (time.perf_counter() - start)
+
+
+async def main(args):
+    fake = FakeCognito(key_bits=args.key_bits)
+    fake.add_user('bob', 'Passw0rd!', {'email': 'bob@example.com'})
+    token = fake.issue_tokens('bob')['IdToken']
+    key = fake.jwks['keys'][0]
+
+    for name in BACKENDS:
+        try:
+            backend = get_backend(name)
+        except ImportError:
+            print('{}: not installed'.format(name))
+            continue
+
+        def verify():
+            backend.verify(token, key, audience=fake.client_id,
+                           issuer=fake.issuer)
+
+        cog = fake.cognito(jwt_backend=backend)
+
+        async def verify_token():
+            await cog.verify_token(token, 'id_token', 'id')
+
+        print('{}: {:.0f} verifies/s, {:.0f} verify_token/s'.format(
+            name, rate(args.duration, verify),
+            await async_rate(args.duration, verify_token)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='seconds per measurement')
+    parser.add_argument('--key-bits', type=int, default=2048,
+                        help='size of the signing key')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main(parse_args()))
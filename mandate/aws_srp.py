@@ -5,11 +5,11 @@ import hashlib
 import hmac
 import re
 
-import aioboto3
 import os
 import six
 
 from .exceptions import ForceChangePasswordException
+from .metrics import maybe_timer, timed
 
 # https://github.com/aws/amazon-cognito-identity-js/blob/master/src/AuthenticationHelper.js#L22
 n_hex = 'FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD1' + \
@@ -32,6 +32,8 @@ n_hex = 'FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD1' + \
 g_hex = '2'
 info_bits = bytearray('Caldera Derived Key', 'utf-8')
 
+_constants = None
+
 
 def hash_sha256(buf):
     """AuthenticationHelper.hash"""
@@ -51,6 +53,17 @@ def long_to_hex(long_num):
     return '%x' % long_num
 
 
+def srp_constants():
+    """
+    :return: N, g and k of the SRP group Cognito uses, computed once
+    """
+    global _constants
+    if _constants is None:
+        _constants = (hex_to_long(n_hex), hex_to_long(g_hex),
+                      hex_to_long(hex_hash('00' + n_hex + '0' + g_hex)))
+    return _constants
+
+
 def get_random(nbytes):
     random_hex = binascii.hexlify(os.urandom(nbytes))
     return hex_to_long(random_hex)
@@ -99,32 +112,68 @@ def calculate_u(big_a, big_b):
     return hex_to_long(u_hex_hash)
 
 
+def generate_hash_device(device_group_key, device_key):
+    """
+    Generates a random password for a new device, and the verifier Cognito
+    stores for it (ConfirmDevice's DeviceSecretVerifierConfig)
+    :param {String} device_group_key DeviceGroupKey of NewDeviceMetadata.
+    :param {String} device_key DeviceKey of NewDeviceMetadata.
+    :return {Tuple} (device password, DeviceSecretVerifierConfig)
+    """
+    device_password = base64.standard_b64encode(os.urandom(40)).decode('utf-8')
+    combined_string_hash = hash_sha256(('%s%s:%s' % (
+        device_group_key, device_key, device_password)).encode('utf-8'))
+    salt = pad_hex(get_random(16))
+    x_value = hex_to_long(hex_hash(salt + combined_string_hash))
+    verifier = pad_hex(pow(hex_to_long(g_hex), x_value, hex_to_long(n_hex)))
+    device_secret_verifier_config = {
+        'PasswordVerifier': base64.standard_b64encode(
+            bytearray.fromhex(verifier)).decode('utf-8'),
+        'Salt': base64.standard_b64encode(
+            bytearray.fromhex(salt)).decode('utf-8'),
+    }
+    return device_password, device_secret_verifier_config
+
+
 class AWSSRP(object):
 
     NEW_PASSWORD_REQUIRED_CHALLENGE = 'NEW_PASSWORD_REQUIRED'
     PASSWORD_VERIFIER_CHALLENGE = 'PASSWORD_VERIFIER'
+    DEVICE_SRP_AUTH_CHALLENGE = 'DEVICE_SRP_AUTH'
+    DEVICE_PASSWORD_VERIFIER_CHALLENGE = 'DEVICE_PASSWORD_VERIFIER'
 
     def __init__(self, username, password, pool_id, client_id,
-                 pool_region=None, client=None, client_secret=None):
+                 pool_region=None, client=None, client_secret=None,
+                 metrics=None, device_key=None, device_group_key=None,
+                 device_password=None):
         if pool_region is not None and client is not None:
             raise ValueError("pool_region & client shouldn't both be specified"
                              " (region should be passed to the boto3 client"
                              " instead)")
+        if device_key is not None and (device_group_key is None or
+                                       device_password is None):
+            raise ValueError('device_key needs the device_group_key and '
+                             'device_password returned by confirm_device')
 
         self.username = username
         self.password = password
         self.pool_id = pool_id
         self.client_id = client_id
         self.client_secret = client_secret
-        self.client = client if client else aioboto3.client(
-            'cognito-idp',
-            region_name=pool_region
-        )
-        self.big_n = hex_to_long(n_hex)
-        self.g = hex_to_long(g_hex)
-        self.k = hex_to_long(hex_hash('00' + n_hex + '0' + g_hex))
-        self.small_a_value = self.generate_random_small_a()
-        self.large_a_value = self.calculate_a()
+        self.metrics = metrics
+        # a remembered device, confirmed with ConfirmDevice
+        self.device_key = device_key
+        self.device_group_key = device_group_key
+        self.device_password = device_password
+        if client is None:
+            import aioboto3
+            client = aioboto3.Session().client('cognito-idp',
+                                               region_name=pool_region)
+        self.client = client
+        self.big_n, self.g, self.k = srp_constants()
+        with maybe_timer(metrics, 'srp', 'calculate_a'):
+            self.small_a_value = self.generate_random_small_a()
+            self.large_a_value = self.calculate_a()
 
     def generate_random_small_a(self):
         """
@@ -158,14 +207,33 @@ class AWSSRP(object):
         :param {Long integer} salt Generated salt.
         :return {Buffer} Computed HKDF value.
         """
+        username_password = '%s%s:%s' % (self.pool_id.split('_')[1],
+                                         username, password)
+        return self._authentication_key(username_password, server_b_value,
+                                        salt)
+
+    def get_device_authentication_key(self, device_group_key, device_key,
+                                      device_password, server_b_value, salt):
+        """
+        Same as get_password_authentication_key, for a remembered device
+        :param {String} device_group_key Device group key.
+        :param {String} device_key Device key.
+        :param {String} device_password Device password.
+        :param {Long integer} server_b_value Server B value.
+        :param {Long integer} salt Generated salt.
+        :return {Buffer} Computed HKDF value.
+        """
+        device_secret = '%s%s:%s' % (device_group_key, device_key,
+                                     device_password)
+        return self._authentication_key(device_secret, server_b_value, salt)
+
+    def _authentication_key(self, secret, server_b_value, salt):
         u_value = calculate_u(self.large_a_value, server_b_value)
         if u_value == 0:
             raise ValueError('U cannot be zero.')
-        username_password = '%s%s:%s' % (self.pool_id.split('_')[1],
-                                         username, password)
-        username_password_hash = hash_sha256(username_password.encode('utf-8'))
+        secret_hash = hash_sha256(secret.encode('utf-8'))
 
-        x_value = hex_to_long(hex_hash(pad_hex(salt) + username_password_hash))
+        x_value = hex_to_long(hex_hash(pad_hex(salt) + secret_hash))
         g_mod_pow_xn = pow(self.g, x_value, self.big_n)
         int_value2 = server_b_value - self.k * g_mod_pow_xn
         s_value = pow(int_value2, self.small_a_value + u_value * x_value,
@@ -177,6 +245,8 @@ class AWSSRP(object):
     def get_auth_params(self):
         auth_params = {'USERNAME': self.username,
                        'SRP_A': long_to_hex(self.large_a_value)}
+        if self.device_key is not None:
+            auth_params['DEVICE_KEY'] = self.device_key
         if self.client_secret is not None:
             auth_params.update({
                 "SECRET_HASH":
@@ -194,37 +264,112 @@ class AWSSRP(object):
                             hashlib.sha256)
         return base64.b64encode(hmac_obj.digest()).decode('utf-8')
 
+    @staticmethod
+    def get_timestamp():
+        # re strips leading zero from a day number (required by AWS Cognito)
+        return re.sub(r" 0(\d) ", r" \1 ",
+                      datetime.datetime.utcnow().strftime
+                      ("%a %b %d %H:%M:%S UTC %Y"))
+
+    def _password_claim(self, hkdf, prefix, secret_block_b64, timestamp):
+        secret_block_bytes = base64.standard_b64decode(secret_block_b64)
+        msg = bytearray(prefix, 'utf-8') + bytearray(secret_block_bytes) + \
+            bytearray(timestamp, 'utf-8')
+        hmac_obj = hmac.new(hkdf, msg, digestmod=hashlib.sha256)
+        return base64.standard_b64encode(hmac_obj.digest()).decode('utf-8')
+
+    def _add_challenge_extras(self, response):
+        if self.device_key is not None:
+            response['DEVICE_KEY'] = self.device_key
+        if self.client_secret is not None:
+            response.update({
+                "SECRET_HASH":
+                self.get_secret_hash(self.username, self.client_id,
+                                     self.client_secret)})
+        return response
+
     def process_challenge(self, challenge_parameters):
         user_id_for_srp = challenge_parameters['USER_ID_FOR_SRP']
         salt_hex = challenge_parameters['SALT']
         srp_b_hex = challenge_parameters['SRP_B']
         secret_block_b64 = challenge_parameters['SECRET_BLOCK']
-        # re strips leading zero from a day number (required by AWS Cognito)
-        timestamp = re.sub(r" 0(\d) ", r" \1 ",
-                           datetime.datetime.utcnow().strftime
-                           ("%a %b %d %H:%M:%S UTC %Y"))
+        timestamp = self.get_timestamp()
         hkdf = self.get_password_authentication_key(user_id_for_srp,
                                                     self.password,
                                                     hex_to_long(srp_b_hex),
                                                     salt_hex)
-        secret_block_bytes = base64.standard_b64decode(secret_block_b64)
-        msg = bytearray(self.pool_id.split('_')[1], 'utf-8') + \
-            bytearray(user_id_for_srp, 'utf-8') + \
-            bytearray(secret_block_bytes) + bytearray(timestamp, 'utf-8')
-        hmac_obj = hmac.new(hkdf, msg, digestmod=hashlib.sha256)
-        signature_string = base64.standard_b64encode(hmac_obj.digest())
+        signature = self._password_claim(
+            hkdf, self.pool_id.split('_')[1] + user_id_for_srp,
+            secret_block_b64, timestamp)
         response = {'TIMESTAMP': timestamp,
                     'USERNAME': user_id_for_srp,
                     'PASSWORD_CLAIM_SECRET_BLOCK': secret_block_b64,
-                    'PASSWORD_CLAIM_SIGNATURE':
-                        signature_string.decode('utf-8')}
-        if self.client_secret is not None:
-            response.update({
-                "SECRET_HASH":
-                self.get_secret_hash(self.username, self.client_id,
-                                     self.client_secret)})
-        return response
+                    'PASSWORD_CLAIM_SIGNATURE': signature}
+        return self._add_challenge_extras(response)
 
+    def get_device_auth_params(self, username):
+        """
+        :param username: USERNAME returned with the DEVICE_SRP_AUTH challenge
+        :return: ChallengeResponses of the DEVICE_SRP_AUTH challenge
+        """
+        # the device authentication is an SRP exchange of its own
+        self.small_a_value = self.generate_random_small_a()
+        self.large_a_value = self.calculate_a()
+        response = {'USERNAME': username,
+                    'SRP_A': long_to_hex(self.large_a_value)}
+        return self._add_challenge_extras(response)
+
+    def process_device_challenge(self, challenge_parameters):
+        """
+        :param challenge_parameters: parameters of the
+        DEVICE_PASSWORD_VERIFIER challenge
+        :return: its ChallengeResponses
+        """
+        username = challenge_parameters['USERNAME']
+        secret_block_b64 = challenge_parameters['SECRET_BLOCK']
+        timestamp = self.get_timestamp()
+        hkdf = self.get_device_authentication_key(
+            self.device_group_key, self.device_key, self.device_password,
+            hex_to_long(challenge_parameters['SRP_B']),
+            challenge_parameters['SALT'])
+        signature = self._password_claim(
+            hkdf, self.device_group_key + self.device_key, secret_block_b64,
+            timestamp)
+        response = {'TIMESTAMP': timestamp,
+                    'USERNAME': username,
+                    'PASSWORD_CLAIM_SECRET_BLOCK': secret_block_b64,
+                    'PASSWORD_CLAIM_SIGNATURE': signature}
+        return self._add_challenge_extras(response)
+
+    async def _authenticate_device(self, client, tokens):
+        """
+        Answers the DEVICE_SRP_AUTH challenge Cognito sends after the
+        password when a remembered device key was given
+        """
+        username = tokens['ChallengeParameters'].get('USERNAME',
+                                                     self.username)
+        kwargs = {}
+        if tokens.get('Session'):
+            kwargs['Session'] = tokens['Session']
+        with maybe_timer(self.metrics, 'srp', 'calculate_a'):
+            challenge_response = self.get_device_auth_params(username)
+        response = await client.respond_to_auth_challenge(
+            ClientId=self.client_id,
+            ChallengeName=self.DEVICE_SRP_AUTH_CHALLENGE,
+            ChallengeResponses=challenge_response, **kwargs)
+
+        kwargs = {}
+        if response.get('Session'):
+            kwargs['Session'] = response['Session']
+        with maybe_timer(self.metrics, 'srp', 'process_device_challenge'):
+            challenge_response = self.process_device_challenge(
+                response['ChallengeParameters'])
+        return await client.respond_to_auth_challenge(
+            ClientId=self.client_id,
+            ChallengeName=self.DEVICE_PASSWORD_VERIFIER_CHALLENGE,
+            ChallengeResponses=challenge_response, **kwargs)
+
+    @timed
     async def authenticate_user(self, client=None):
         boto_client = self.client or client
         auth_params = self.get_auth_params()
@@ -236,14 +381,19 @@ class AWSSRP(object):
                 ClientId=self.client_id
             )
             if response['ChallengeName'] == self.PASSWORD_VERIFIER_CHALLENGE:
-                challenge_response = self.process_challenge(
-                    response['ChallengeParameters'])
+                with maybe_timer(self.metrics, 'srp', 'process_challenge'):
+                    challenge_response = self.process_challenge(
+                        response['ChallengeParameters'])
 
                 tokens = await client.respond_to_auth_challenge(
                     ClientId=self.client_id,
                     ChallengeName=self.PASSWORD_VERIFIER_CHALLENGE,
                     ChallengeResponses=challenge_response)
 
+                if tokens.get('ChallengeName') == \
+                   self.DEVICE_SRP_AUTH_CHALLENGE:
+                    tokens = await self._authenticate_device(client, tokens)
+
                 if tokens.get('ChallengeName') == \
                    self.NEW_PASSWORD_REQUIRED_CHALLENGE:
                     raise ForceChangePasswordException
@@ -254,6 +404,7 @@ class AWSSRP(object):
                 raise NotImplementedError('The %s challenge is not supported'
                                           % response['ChallengeName'])
 
+    @timed
     async def set_new_password_challenge(self, new_password, client=None):
         boto_client = self.client or client
         auth_params = self.get_auth_params()
@@ -265,8 +416,9 @@ class AWSSRP(object):
                 ClientId=self.client_id
             )
             if response['ChallengeName'] == self.PASSWORD_VERIFIER_CHALLENGE:
-                challenge_response = self.process_challenge(
-                    response['ChallengeParameters'])
+                with maybe_timer(self.metrics, 'srp', 'process_challenge'):
+                    challenge_response = self.process_challenge(
+                        response['ChallengeParameters'])
                 tokens = await client.respond_to_auth_challenge(
                     ClientId=self.client_id,
                     ChallengeName=self.PASSWORD_VERIFIER_CHALLENGE,
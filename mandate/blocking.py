@@ -0,0 +1,151 @@
+"""
+Blocking API over Cognito, for threaded and WSGI code.
+
+Calls run on one event loop living in a background thread for the whole
+process, instead of a new loop per call as with asyncio.run, so the client
+(with keep_client), its connection pool and the cached JWKS are reused from
+one call to the next. Any number of threads can call at the same time.
+
+    cog = SyncCognito(user_pool_id='eu-west-2_abc', client_id='client',
+                      username='bob', timeout=10)
+    cog.authenticate('Passw0rd!')
+    user = cog.get_user(timeout=2)
+"""
+import asyncio
+import concurrent.futures
+import inspect
+import threading
+
+from .client import Cognito
+
+
+class BackgroundLoop(object):
+    """
+    An event loop running in a daemon thread, started on first use
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self._thread = threading.Thread(
+                        target=self._run, args=(loop,),
+                        name='mandate-loop', daemon=True)
+                    self._thread.start()
+                    self._loop = loop
+        return self._loop
+
+    @staticmethod
+    def _run(loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def run(self, coro, timeout=None):
+        """
+        Runs a coroutine on the loop and waits for its result
+        :param coro: the coroutine
+        :param timeout: seconds to wait; the coroutine is cancelled and
+        concurrent.futures.TimeoutError raised past it
+        :return: the result of the coroutine
+        """
+        if self._thread is not None and \
+                self._thread is threading.current_thread():
+            coro.close()
+            raise RuntimeError('Blocking call made from the background loop')
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def close(self):
+        """
+        Stops the loop and waits for its thread
+        """
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+
+_default_loop = BackgroundLoop()
+
+
+def default_loop():
+    """
+    :return: the BackgroundLoop shared by the SyncCognito instances that
+    don't set their own
+    """
+    return _default_loop
+
+
+class SyncCognito(object):
+    """
+    Exposes the coroutine methods of a Cognito as blocking methods taking an
+    extra timeout keyword argument, and its async generators (iter_users) as
+    generators. Other attributes are read from the Cognito.
+
+    The instance keeps the tokens of one user, as Cognito does: threads
+    acting for different users should use one SyncCognito each; they still
+    share the background loop.
+    """
+
+    def __init__(self, cognito=None, timeout=None, loop=None, **kwargs):
+        """
+        :param cognito: the Cognito to wrap; one is created from kwargs, with
+        keep_client, if not given
+        :param timeout: default timeout of the calls, in seconds
+        :param loop: BackgroundLoop to run on, the shared one by default
+        :param kwargs: arguments of Cognito
+        """
+        if cognito is None:
+            kwargs.setdefault('keep_client', True)
+            cognito = Cognito(**kwargs)
+        self.cognito = cognito
+        self.timeout = timeout
+        self.background_loop = loop or default_loop()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.cognito, name)
+        if inspect.isasyncgenfunction(attribute):
+            def iterate(*args, timeout=None, **kwargs):
+                return self._iterate(attribute(*args, **kwargs), timeout)
+            return iterate
+        if not inspect.iscoroutinefunction(attribute):
+            return attribute
+
+        def call(*args, timeout=None, **kwargs):
+            return self.background_loop.run(
+                attribute(*args, **kwargs),
+                self.timeout if timeout is None else timeout)
+        return call
+
+    def _iterate(self, generator, timeout):
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            while True:
+                try:
+                    yield self.background_loop.run(generator.__anext__(),
+                                                   timeout)
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.background_loop.run(generator.aclose(), timeout)
+
+    def close(self, timeout=None):
+        """
+        Closes the client kept open by the Cognito
+        """
+        self.background_loop.run(self.cognito.close(),
+                                 self.timeout if timeout is None else timeout)
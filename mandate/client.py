@@ -1,16 +1,32 @@
-import aioboto3
+import asyncio
+import contextlib
 import datetime
-import aiohttp
+import time
 import attr
 
-from envs import env
-from jose import jwt, JWTError
-
-from .aws_srp import AWSSRP
+# aioboto3, aiohttp, envs and jose are imported where they are used: they
+# take most of the import time of mandate, and a process that only verifies
+# tokens never needs boto.
+from .aws_srp import AWSSRP, generate_hash_device, srp_constants
+from .crypto import (
+    REJECTION_MESSAGES, default_backend, precheck, split_token
+)
 from .exceptions import TokenVerificationException
+from .metrics import maybe_timer, timed
 from .userobj import UserObj
-from .groupobj import GroupObj
-from .utils import dict_to_cognito
+from .groupobj import GroupObj, GroupIndex
+from .membership import MembershipIndex
+from .utils import (
+    KeptClient, RateLimiter, cognito_to_dict, dict_to_cognito
+)
+
+# Claims of Cognito tokens that aren't user attributes
+TOKEN_CLAIMS = frozenset([
+    'at_hash', 'aud', 'auth_time', 'client_id', 'cognito:groups',
+    'cognito:preferred_role', 'cognito:roles', 'cognito:username',
+    'device_key', 'event_id', 'exp', 'iat', 'iss', 'jti', 'nbf', 'nonce',
+    'origin_jti', 'scope', 'token_use', 'username', 'version',
+])
 
 
 @attr.s
@@ -31,18 +47,140 @@ class Cognito(object):
     access_key = attr.ib(default=None)
     secret_key = attr.ib(default=None)
     client_callback = attr.ib(default=None)
+    metrics = attr.ib(default=None)
+    jwks_url = attr.ib()
+    jwt_backend = attr.ib(default=None)
+    revocation_store = attr.ib(default=None)
+    device_key = attr.ib(default=None)
+    device_group_key = attr.ib(default=None)
+    device_password = attr.ib(default=None)
+    keep_client = attr.ib(default=False)
+    resilience = attr.ib(default=None)
+    membership_index = attr.ib(default=None)
+    shared_cache = attr.ib(default=None)
+    recorder = attr.ib(default=None)
+    issuer = attr.ib()
+    _kept_client = attr.ib(default=None, init=False, repr=False)
 
     @user_pool_region.default
     def generate_region_from_pool(self):
         return self.user_pool_id.split('_')[0]
 
+    @jwks_url.default
+    def generate_jwks_url(self):
+        return 'https://cognito-idp.{}.amazonaws.com/{}/.well-known/jwks.json'.format(  # noqa
+            self.user_pool_region, self.user_pool_id)
+
+    @issuer.default
+    def generate_issuer(self):
+        return 'https://cognito-idp.{}.amazonaws.com/{}'.format(
+            self.user_pool_region, self.user_pool_id)
+
     def get_session(self):
+        import aiohttp
         return aiohttp.ClientSession()
 
     def get_client(self):
+        """
+        :return: the client context manager the API calls go through; with
+        keep_client, the same client is kept open for every call until
+        close()
+        """
+        if self.keep_client:
+            if self._kept_client is None:
+                self._kept_client = KeptClient(self._new_client)
+            return self._kept_client
+        return self._new_client()
+
+    def _new_client(self):
+        with maybe_timer(self.metrics, 'get_client', 'client'):
+            client = self._create_client()
+        if self.recorder is not None:
+            client = self.recorder.wrap(client)
+        if self.metrics is not None:
+            client = self.metrics.instrument(client)
+        if self.resilience is not None:
+            client = self.resilience.wrap(client)
+        return client
+
+    async def close(self):
+        """
+        Closes the client kept open by keep_client
+        """
+        if self._kept_client is not None:
+            kept_client, self._kept_client = self._kept_client, None
+            await kept_client.close()
+
+    @timed
+    async def warmup(self, connect=True):
+        """
+        Does ahead of time, concurrently, the work the first requests would
+        otherwise pay for: fetching the JWKS and loading its keys, creating
+        the client (botocore loads the service model), opening a connection
+        to Cognito and computing the SRP constants. Meant for a Cognito with
+        keep_client, whose client and connection are then reused; without
+        it only the keys and SRP constants stay warm.
+        :param connect: whether to open the connection, with a get_user call
+        that fails harmlessly without a valid access token
+        :return: dictionary of phase ('jwks', 'keys', 'client', 'connect',
+        'srp') to the seconds it took
+        """
+        timings = {}
+
+        @contextlib.contextmanager
+        def phase(name):
+            start = time.perf_counter()
+            with maybe_timer(self.metrics, 'warmup', name):
+                yield
+            timings[name] = time.perf_counter() - start
+
+        async def load_keys():
+            with phase('jwks'):
+                jwks = await self.get_keys()
+            with phase('keys'):
+                backend = self.jwt_backend or default_backend()
+                load_key = getattr(backend, 'load_key', None)
+                if load_key is not None:
+                    for key in jwks.get('keys', ()):
+                        load_key(key)
+
+        async def open_client():
+            start = time.perf_counter()
+            async with self.get_client() as client:
+                timings['client'] = time.perf_counter() - start
+                if self.metrics is not None:
+                    self.metrics.observe('warmup', 'client',
+                                         timings['client'])
+                if not connect:
+                    return
+                with phase('connect'):
+                    try:
+                        await client.get_user(
+                            AccessToken=self.access_token or 'warmup')
+                    except Exception as e:
+                        # Cognito answered: the connection is open
+                        if not isinstance(getattr(e, 'response', None),
+                                          dict):
+                            raise
+
+        tasks = [asyncio.ensure_future(load_keys()),
+                 asyncio.ensure_future(open_client())]
+        try:
+            with phase('srp'):
+                srp_constants()
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return timings
+
+    def _create_client(self):
         if self.client_callback:
             return self.client_callback()
 
+        import aioboto3
+
         boto3_client_kwargs = {}
         if self.access_key and self.secret_key:
             boto3_client_kwargs['aws_access_key_id'] = self.access_key
@@ -56,46 +194,101 @@ class Cognito(object):
 
     async def get_keys(self):
         try:
-            return self.pool_jwk
+            pool_jwk = self.pool_jwk
         except AttributeError:
-            # Check for the dictionary in environment variables.
-            pool_jwk_env = env('COGNITO_JWKS', {}, var_type='dict')
-            if len(pool_jwk_env.keys()) > 0:
-                self.pool_jwk = pool_jwk_env
-                return self.pool_jwk
-
-            # If it is not there use the aiohttp library to get it
-            async with self.get_session() as session:
-                resp = await session.get(
-                    'https://cognito-idp.{}.amazonaws.com/{}/.well-known/jwks.json'.format( # noqa
-                        self.user_pool_region, self.user_pool_id
-                    ))
-                self.pool_jwk = await resp.json()
-                return self.pool_jwk
+            if self.metrics is not None:
+                self.metrics.incr('cache_misses', 'get_keys')
+            with maybe_timer(self.metrics, 'get_keys', 'jwks'):
+                return await self._load_keys()
+        if self.metrics is not None:
+            self.metrics.incr('cache_hits', 'get_keys')
+        return pool_jwk
+
+    async def _load_keys(self):
+        from envs import env
+
+        # Check for the dictionary in environment variables.
+        pool_jwk_env = env('COGNITO_JWKS', {}, var_type='dict')
+        if len(pool_jwk_env.keys()) > 0:
+            self.pool_jwk = pool_jwk_env
+            return self.pool_jwk
+
+        # If it is not there use the aiohttp library to get it, or take it
+        # from the processes sharing the cache
+        if self.shared_cache is not None:
+            self.pool_jwk = await self.shared_cache.get_jwks(
+                self.issuer, self._download_keys)
+        else:
+            self.pool_jwk = await self._download_keys()
+        return self.pool_jwk
+
+    async def _download_keys(self):
+        async with self.get_session() as session:
+            resp = await session.get(self.jwks_url)
+            return await resp.json()
 
     async def get_key(self, kid):
         keys = (await self.get_keys()).get('keys')
         key = list(filter(lambda x: x.get('kid') == kid, keys))
+        if not key:
+            raise TokenVerificationException(REJECTION_MESSAGES['kid'])
         return key[0]
 
+    def _reject(self, reason):
+        if self.metrics is not None:
+            self.metrics.incr('rejections', reason)
+        raise TokenVerificationException(REJECTION_MESSAGES[reason])
+
+    @timed
     async def verify_token(self, token, id_name, token_use):
-        kid = jwt.get_unverified_header(token).get('kid')
-        unverified_claims = jwt.get_unverified_claims(token)
-        token_use_verified = unverified_claims.get('token_use') == token_use
-        if not token_use_verified:
-            raise TokenVerificationException(
-                'Your {} token use could not be verified.')
-        hmac_key = await self.get_key(kid)
+        """
+        Verifies a token of this user pool and app client and sets it as
+        the id_name attribute. Tokens that are malformed, expired, of the
+        wrong token_use or issued by another pool or to another client are
+        rejected before any key lookup or signature check. Rejections are
+        counted in metrics as ('rejections', reason).
+        :param token: the JWT
+        :param id_name: attribute to set, 'id_token' or 'access_token'
+        :param token_use: expected token_use claim, 'id' or 'access'
+        :return: the verified claims
+        """
         try:
-            verified = jwt.decode(token, hmac_key, algorithms=['RS256'],
-                                  audience=unverified_claims.get('aud'),
-                                  issuer=unverified_claims.get('iss'))
-        except JWTError:
-            raise TokenVerificationException(
-                'Your {} token could not be verified.')
+            header, claims, _, _ = split_token(token)
+        except TokenVerificationException:
+            self._reject('malformed')
+        reason = precheck(header, claims, issuer=self.issuer,
+                          client_ids=(self.client_id,), token_use=token_use)
+        if reason is not None:
+            self._reject(reason)
+        verified = None
+        if self.shared_cache is not None:
+            verified = self.shared_cache.get(token)
+        if verified is None:
+            verified = await self._verify_signature(token, header)
+            if self.shared_cache is not None:
+                self.shared_cache.set(token, verified)
+        elif self.metrics is not None:
+            self.metrics.incr('cache_hits', 'verify_token')
+        if self.revocation_store is not None and \
+                self.revocation_store.is_revoked(verified):
+            self._reject('revoked')
         setattr(self, id_name, token)
         return verified
 
+    async def _verify_signature(self, token, header):
+        try:
+            hmac_key = await self.get_key(header.get('kid'))
+        except TokenVerificationException:
+            self._reject('kid')
+        backend = self.jwt_backend or default_backend()
+        try:
+            with maybe_timer(self.metrics, 'verify_token', 'verify'):
+                return backend.verify(token, hmac_key,
+                                      audience=self.client_id,
+                                      issuer=self.issuer)
+        except TokenVerificationException:
+            self._reject('verify')
+
     def get_user_obj(self, username=None, attribute_list=None, metadata=None,
                      attr_map=None):
         """
@@ -114,6 +307,27 @@ class Cognito(object):
                                cognito_obj=self,
                                metadata=metadata, attr_map=attr_map)
 
+    def user_from_claims(self, claims, attr_map=None):
+        """
+        Builds the self.user_class from the claims of a verified ID token,
+        without calling Cognito. Access tokens carry no user attributes.
+        :param claims: claims as returned by verify_token
+        :param attr_map: Dictionary map from Cognito attributes to attribute
+        names we would like to show to our users
+        :return: instance of the self.user_class
+        """
+        username = claims.get('cognito:username', claims.get('username'))
+        attribute_list = [{'Name': name, 'Value': value}
+                          for name, value in claims.items()
+                          if name not in TOKEN_CLAIMS]
+        metadata = {
+            'username': username,
+            'groups': claims.get('cognito:groups', []),
+        }
+        return self.get_user_obj(username=username,
+                                 attribute_list=attribute_list,
+                                 metadata=metadata, attr_map=attr_map)
+
     def get_group_obj(self, group_data):
         """
         Instantiates the self.group_class
@@ -131,6 +345,7 @@ class Cognito(object):
         """
         self.client = session.client('cognito-idp')
 
+    @timed
     async def check_token(self, renew=True):
         """
         Checks the exp attribute of the access_token and either refreshes
@@ -140,6 +355,8 @@ class Cognito(object):
         """
         if not self.access_token:
             raise AttributeError('Access Token Required to Check Token')
+        from jose import jwt
+
         now = datetime.datetime.now()
         dec_access_token = jwt.get_unverified_claims(self.access_token)
 
@@ -154,6 +371,7 @@ class Cognito(object):
     def add_base_attributes(self, **kwargs):
         self.base_attributes = kwargs
 
+    @timed
     async def register(self, *, username, password, email, attrs={}):
         """
         Register the user.
@@ -199,6 +417,7 @@ class Cognito(object):
             response.pop('ResponseMetadata')
             return response
 
+    @timed
     async def admin_confirm_sign_up(self, username=None):
         """
         Confirms user registration as an admin without using a confirmation
@@ -214,6 +433,7 @@ class Cognito(object):
                 Username=username,
             )
 
+    @timed
     async def confirm_sign_up(self, confirmation_code, username=None):
         """
         Using the confirmation code that is either sent via email or text
@@ -231,6 +451,7 @@ class Cognito(object):
         async with self.get_client() as client:
             await client.confirm_sign_up(**params)
 
+    @timed
     async def admin_authenticate(self, password):
         """
         Authenticate the user using admin super privileges
@@ -263,6 +484,7 @@ class Cognito(object):
                 'access')
             self.token_type = tokens['AuthenticationResult']['TokenType']
 
+    @timed
     async def authenticate(self, password):
         """
         Authenticate the user using the SRP protocol
@@ -273,7 +495,10 @@ class Cognito(object):
         aws = AWSSRP(username=self.username, password=password,
                      pool_id=self.user_pool_id,
                      client_id=self.client_id, client=self.get_client(),
-                     client_secret=self.client_secret)
+                     client_secret=self.client_secret, metrics=self.metrics,
+                     device_key=self.device_key,
+                     device_group_key=self.device_group_key,
+                     device_password=self.device_password)
         tokens = await aws.authenticate_user()
         await self.verify_token(tokens['AuthenticationResult']['IdToken'],
                                 'id_token', 'id')
@@ -281,7 +506,10 @@ class Cognito(object):
         await self.verify_token(tokens['AuthenticationResult']['AccessToken'],
                                 'access_token', 'access')
         self.token_type = tokens['AuthenticationResult']['TokenType']
+        self.new_device_metadata = tokens['AuthenticationResult'].get(
+            'NewDeviceMetadata')
 
+    @timed
     async def new_password_challenge(self, password, new_password):
         """
         Respond to the new password challenge using the SRP protocol
@@ -291,30 +519,97 @@ class Cognito(object):
         aws = AWSSRP(username=self.username, password=password,
                      pool_id=self.user_pool_id,
                      client_id=self.client_id, client=self.get_client(),
-                     client_secret=self.client_secret)
+                     client_secret=self.client_secret, metrics=self.metrics)
         tokens = await aws.set_new_password_challenge(new_password)
         self.id_token = tokens['AuthenticationResult']['IdToken']
         self.refresh_token = tokens['AuthenticationResult']['RefreshToken']
         self.access_token = tokens['AuthenticationResult']['AccessToken']
         self.token_type = tokens['AuthenticationResult']['TokenType']
 
+    @timed
+    async def confirm_device(self, device_name=None, remember=True):
+        """
+        Confirms the device Cognito tracked on the last authenticate, so the
+        next authentications go through the device SRP flow and skip MFA.
+        The device_key, device_group_key and device_password attributes are
+        set; store them to authenticate from this device later.
+        :param device_name: name of the device, shown to the user
+        :param remember: whether to mark the device as remembered when the
+        user pool lets users opt in
+        :return response: Response from Cognito
+        """
+        metadata = getattr(self, 'new_device_metadata', None)
+        if not metadata:
+            raise AttributeError('No new device to confirm, authenticate '
+                                 'with device tracking enabled first')
+        device_key = metadata['DeviceKey']
+        device_group_key = metadata['DeviceGroupKey']
+        device_password, verifier_config = generate_hash_device(
+            device_group_key, device_key)
+        params = {'AccessToken': self.access_token,
+                  'DeviceKey': device_key,
+                  'DeviceSecretVerifierConfig': verifier_config}
+        if device_name is not None:
+            params['DeviceName'] = device_name
+        async with self.get_client() as client:
+            response = await client.confirm_device(**params)
+            if remember and response.get('UserConfirmationNecessary'):
+                await client.update_device_status(
+                    AccessToken=self.access_token,
+                    DeviceKey=device_key,
+                    DeviceRememberedStatus='remembered')
+        self.device_key = device_key
+        self.device_group_key = device_group_key
+        self.device_password = device_password
+        self.new_device_metadata = None
+        response.pop('ResponseMetadata', None)
+        return response
+
+    @timed
     async def logout(self):
         """
         Logs the user out of all clients and removes the expires_in,
         expires_datetime, id_token, refresh_token, access_token, and token_type
-        attributes
+        attributes. The tokens of this authentication, and those of the
+        user's earlier sign ins, are added to the revocation_store, if any.
         :return:
         """
         async with self.get_client() as client:
             await client.global_sign_out(
                 AccessToken=self.access_token
             )
+            if self.revocation_store is not None:
+                _, claims, _, _ = split_token(self.access_token)
+                self.revocation_store.revoke_token(claims)
+                self.revocation_store.revoke_subject(claims['sub'])
 
             self.id_token = None
             self.refresh_token = None
             self.access_token = None
             self.token_type = None
 
+    @timed
+    async def admin_logout(self, username=None):
+        """
+        Logs a user out of all clients using admin super privileges, and adds
+        their tokens to the revocation_store, if any
+        :param username: User's username
+        """
+        if not username:
+            username = self.username
+        async with self.get_client() as client:
+            await client.admin_user_global_sign_out(
+                UserPoolId=self.user_pool_id,
+                Username=username
+            )
+            if self.revocation_store is not None:
+                user = await client.admin_get_user(
+                    UserPoolId=self.user_pool_id,
+                    Username=username)
+                sub = cognito_to_dict(user.get('UserAttributes'))['sub']
+                self.revocation_store.revoke_subject(sub)
+
+    @timed
     async def admin_update_profile(
             self,
             username=None,
@@ -332,6 +627,7 @@ class Cognito(object):
                 UserAttributes=user_attrs
             )
 
+    @timed
     async def update_profile(self, attrs, attr_map=None):
         """
         Updates User attributes
@@ -346,6 +642,7 @@ class Cognito(object):
                 AccessToken=self.access_token
             )
 
+    @timed
     async def get_user(self, attr_map=None):
         """
         Returns a UserObj (or whatever the self.user_class is) by using the
@@ -369,6 +666,7 @@ class Cognito(object):
                                      attribute_list=user.get('UserAttributes'),
                                      metadata=user_metadata, attr_map=attr_map)
 
+    @timed
     async def get_users(self, attr_map=None):
         """
         Returns all users for a user pool. Returns instances of the
@@ -376,17 +674,114 @@ class Cognito(object):
         :param attr_map:
         :return:
         """
+        return [user async for user in self.iter_users(attr_map=attr_map)]
+
+    async def iter_users(self, attr_map=None, page_size=None):
+        """
+        Yields all users of the user pool as instances of the
+        self.user_class, one list_users page at a time, without holding the
+        whole pool in memory.
+        :param attr_map: Dictionary map from Cognito attributes to attribute
+        names we would like to show to our users
+        :param page_size: Limit passed to list_users (Cognito allows up to 60)
+        """
         kwargs = {"UserPoolId": self.user_pool_id}
+        if page_size:
+            kwargs['Limit'] = page_size
 
         async with self.get_client() as client:
-            response = await client.list_users(**kwargs)
-            return [self.get_user_obj(user.get('Username'),
-                                      attribute_list=user.get('Attributes'),
-                                      metadata={
-                                          'username': user.get('Username')},
-                                      attr_map=attr_map)
-                    for user in response.get('Users')]
+            while True:
+                response = await client.list_users(**kwargs)
+                for user in response.get('Users'):
+                    yield self.get_user_obj(
+                        user.get('Username'),
+                        attribute_list=user.get('Attributes'),
+                        metadata={'username': user.get('Username')},
+                        attr_map=attr_map)
+                pagination_token = response.get('PaginationToken')
+                if not pagination_token:
+                    return
+                kwargs['PaginationToken'] = pagination_token
 
+    async def scan_users(self, attr_map=None, concurrency=4, rate_limit=None,
+                         shards=None, page_size=60, dedupe=None):
+        """
+        Yields all users of the user pool like iter_users, but splits the
+        pool into list_users filters (by default on the first hex digit of
+        sub) and paginates them concurrently. Users come in no particular
+        order.
+        :param attr_map: Dictionary map from Cognito attributes to attribute
+        names we would like to show to our users
+        :param concurrency: maximum number of list_users calls in flight
+        :param rate_limit: maximum number of list_users calls per second
+        :param shards: list_users Filter expressions covering the pool, e.g.
+        ['username ^= "a"', ...]
+        :param page_size: Limit passed to list_users (Cognito allows up to 60)
+        :param dedupe: whether to yield a user matching several shards once,
+        which holds every username in memory; by default only with custom
+        shards, the default ones being disjoint
+        """
+        if dedupe is None:
+            dedupe = shards is not None
+        if shards is None:
+            shards = ['sub ^= "{}"'.format(digit)
+                      for digit in '0123456789abcdef']
+        semaphore = asyncio.Semaphore(concurrency)
+        limiter = RateLimiter(rate_limit) if rate_limit else None
+        pages = asyncio.Queue(maxsize=concurrency)
+        seen = set() if dedupe else None
+
+        async with self.get_client() as client:
+            async def scan(shard):
+                kwargs = {'UserPoolId': self.user_pool_id, 'Filter': shard,
+                          'Limit': page_size}
+                try:
+                    while True:
+                        async with semaphore:
+                            if limiter is not None:
+                                await limiter.wait()
+                            response = await client.list_users(**kwargs)
+                        await pages.put(response.get('Users'))
+                        pagination_token = response.get('PaginationToken')
+                        if not pagination_token:
+                            break
+                        kwargs['PaginationToken'] = pagination_token
+                except asyncio.CancelledError:
+                    # an Exception before Python 3.8: don't queue it, nobody
+                    # reads the queue any more
+                    raise
+                except Exception as e:
+                    await pages.put(e)
+                else:
+                    await pages.put(None)
+
+            tasks = [asyncio.ensure_future(scan(shard)) for shard in shards]
+            try:
+                remaining = len(tasks)
+                while remaining:
+                    page = await pages.get()
+                    if page is None:
+                        remaining -= 1
+                        continue
+                    if isinstance(page, Exception):
+                        raise page
+                    for user in page:
+                        username = user.get('Username')
+                        if seen is not None:
+                            if username in seen:
+                                continue
+                            seen.add(username)
+                        yield self.get_user_obj(
+                            username,
+                            attribute_list=user.get('Attributes'),
+                            metadata={'username': username},
+                            attr_map=attr_map)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    @timed
     async def admin_get_user(self, attr_map=None):
         """
         Get the user's details using admin super privileges.
@@ -410,6 +805,7 @@ class Cognito(object):
                                      attribute_list=user.get('UserAttributes'),
                                      metadata=user_metadata, attr_map=attr_map)
 
+    @timed
     async def admin_create_user(self, username, temporary_password=None,
                                 attr_map=None, **kwargs):
         """
@@ -442,6 +838,7 @@ class Cognito(object):
             response.pop('ResponseMetadata')
             return response
 
+    @timed
     async def send_verification(self, attribute='email'):
         """
         Sends the user an attribute verification code for the specified
@@ -455,6 +852,7 @@ class Cognito(object):
                 AttributeName=attribute
             )
 
+    @timed
     async def validate_verification(self, confirmation_code,
                                     attribute='email'):
         """
@@ -470,11 +868,14 @@ class Cognito(object):
                 Code=confirmation_code
             )
 
+    @timed
     async def renew_access_token(self):
         """
         Sets a new access token on the User using the refresh token.
         """
         auth_params = {'REFRESH_TOKEN': self.refresh_token}
+        if self.device_key is not None:
+            auth_params['DEVICE_KEY'] = self.device_key
         self._add_secret_hash(auth_params, 'SECRET_HASH')
 
         async with self.get_client() as client:
@@ -496,6 +897,7 @@ class Cognito(object):
                 }
             )
 
+    @timed
     async def initiate_forgot_password(self):
         """
         Sends a verification code to the user to use to change their password.
@@ -508,19 +910,24 @@ class Cognito(object):
         async with self.get_client() as client:
             await client.forgot_password(**params)
 
+    @timed
     async def delete_user(self):
         async with self.get_client() as client:
             await client.delete_user(
                 AccessToken=self.access_token
             )
 
+    @timed
     async def admin_delete_user(self, username):
         async with self.get_client() as client:
             await client.admin_delete_user(
                 UserPoolId=self.user_pool_id,
                 Username=username
             )
+        if self.membership_index is not None:
+            self.membership_index.remove_user(username)
 
+    @timed
     async def confirm_forgot_password(self, confirmation_code, password):
         """
         Allows a user to enter a code provided when they reset their password
@@ -539,6 +946,7 @@ class Cognito(object):
             response = await client.confirm_forgot_password(**params)
             self._set_attributes(response, {'password': password})
 
+    @timed
     async def change_password(self, previous_password, proposed_password):
         """
         Change the User password
@@ -576,6 +984,7 @@ class Cognito(object):
             for k, v in attribute_dict.items():
                 setattr(self, k, v)
 
+    @timed
     async def get_group(self, group_name):
         """
         Get a group by a name
@@ -587,13 +996,115 @@ class Cognito(object):
                                               UserPoolId=self.user_pool_id)
             return self.get_group_obj(response.get('Group'))
 
+    @timed
     async def get_groups(self):
         """
         Returns all groups for a user pool. Returns instances of the
         self.group_class.
         :return: list of instances
         """
+        return [self.get_group_obj(group_data)
+                for group_data in await self._list_groups()]
+
+    @timed
+    async def get_group_index(self):
+        """
+        Builds a GroupIndex with every group of the user pool, for repeated
+        lookups by name, precedence or role ARN without going to Cognito.
+        :return: instance of GroupIndex
+        """
+        return GroupIndex(self.get_group_obj(group_data)
+                          for group_data in await self._list_groups())
+
+    async def _list_groups(self):
+        """
+        Follows the list_groups pagination
+        :return: list of group dictionaries as returned by Cognito
+        """
+        kwargs = {'UserPoolId': self.user_pool_id}
+        groups = []
+        async with self.get_client() as client:
+            while True:
+                response = await client.list_groups(**kwargs)
+                groups.extend(response.get('Groups'))
+                next_token = response.get('NextToken')
+                if not next_token:
+                    return groups
+                kwargs['NextToken'] = next_token
+
+    @timed
+    async def admin_add_user_to_group(self, username, group_name):
+        """
+        Adds a user to a group, and to the membership_index if there is one
+        :param username: User's username
+        :param group_name: name of the group
+        """
+        async with self.get_client() as client:
+            await client.admin_add_user_to_group(
+                UserPoolId=self.user_pool_id,
+                Username=username,
+                GroupName=group_name
+            )
+        if self.membership_index is not None:
+            self.membership_index.add(username, group_name)
+
+    @timed
+    async def admin_remove_user_from_group(self, username, group_name):
+        """
+        Removes a user from a group, and from the membership_index if there
+        is one
+        :param username: User's username
+        :param group_name: name of the group
+        """
+        async with self.get_client() as client:
+            await client.admin_remove_user_from_group(
+                UserPoolId=self.user_pool_id,
+                Username=username,
+                GroupName=group_name
+            )
+        if self.membership_index is not None:
+            self.membership_index.remove(username, group_name)
+
+    @timed
+    async def get_membership_index(self, concurrency=4, page_size=60):
+        """
+        Builds a MembershipIndex of every group of the user pool, listing
+        the members of several groups at once. Set it as membership_index
+        to have admin_add_user_to_group, admin_remove_user_from_group and
+        admin_delete_user keep it up to date.
+        :param concurrency: maximum number of list_users_in_group calls in
+        flight
+        :param page_size: Limit passed to list_users_in_group (Cognito allows
+        up to 60)
+        :return: instance of MembershipIndex
+        """
+        index = MembershipIndex()
+        group_names = [group['GroupName']
+                       for group in await self._list_groups()]
+        for group_name in group_names:
+            index.add_group(group_name)
+        semaphore = asyncio.Semaphore(concurrency)
+
         async with self.get_client() as client:
-            response = await client.list_groups(UserPoolId=self.user_pool_id)
-            return [self.get_group_obj(group_data)
-                    for group_data in response.get('Groups')]
+            async def list_members(group_name):
+                kwargs = {'UserPoolId': self.user_pool_id,
+                          'GroupName': group_name, 'Limit': page_size}
+                while True:
+                    async with semaphore:
+                        response = await client.list_users_in_group(**kwargs)
+                    for user in response.get('Users'):
+                        index.add(user['Username'], group_name)
+                    next_token = response.get('NextToken')
+                    if not next_token:
+                        return
+                    kwargs['NextToken'] = next_token
+
+            tasks = [asyncio.ensure_future(list_members(group_name))
+                     for group_name in group_names]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        return index
@@ -0,0 +1,251 @@
+"""
+RS256 verification backends for Cognito tokens.
+
+The cryptography backend verifies signatures with OpenSSL and keeps the
+loaded public keys around; the jose backend goes through python-jose, which
+is pure Python unless cryptography is installed. Both apply the same claims
+checks as jose.jwt.decode: exp, nbf, iat, aud and iss.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import time
+
+from .exceptions import TokenVerificationException
+
+
+def _b64decode(segment):
+    segment = segment.encode('ascii') if isinstance(segment, str) \
+        else segment
+    return base64.urlsafe_b64decode(segment + b'=' * (-len(segment) % 4))
+
+
+def token_digest(token):
+    """
+    :return: 16 bytes digest of a token, to key caches of tokens without
+    holding the tokens themselves
+    """
+    return hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+
+
+def split_token(token):
+    """
+    Decodes a JWT without verifying it
+    :param token: the JWT
+    :return: (header, claims, signing input, signature)
+    """
+    try:
+        signing_input, signature = token.encode('ascii').rsplit(b'.', 1)
+        header_segment, claims_segment = signing_input.split(b'.', 1)
+        header = json.loads(_b64decode(header_segment))
+        claims = json.loads(_b64decode(claims_segment))
+        signature = _b64decode(signature)
+    except (ValueError, UnicodeError, binascii.Error, AttributeError):
+        raise TokenVerificationException('Malformed token.')
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise TokenVerificationException('Malformed token.')
+    return header, claims, signing_input, signature
+
+
+def _int_claim(claims, name):
+    try:
+        return int(claims[name])
+    except (TypeError, ValueError):
+        raise TokenVerificationException(
+            'The {} claim must be an integer.'.format(name))
+
+
+def check_claims(claims, audience=None, issuer=None, leeway=0, now=None):
+    """
+    Validates the registered claims the way jose.jwt.decode does
+    :param claims: the decoded claims
+    :param audience: expected audience; checked when the token has one
+    :param issuer: expected issuer, None to skip the check
+    :param leeway: allowed clock skew, in seconds
+    :param now: current time, as a timestamp
+    """
+    now = int(time.time()) if now is None else now
+    if 'iat' in claims:
+        _int_claim(claims, 'iat')
+    if 'nbf' in claims and _int_claim(claims, 'nbf') > now + leeway:
+        raise TokenVerificationException('The token is not yet valid.')
+    if 'exp' in claims and _int_claim(claims, 'exp') < now - leeway:
+        raise TokenVerificationException('Signature has expired.')
+    if 'aud' in claims:
+        audience_claims = claims['aud']
+        if isinstance(audience_claims, str):
+            audience_claims = [audience_claims]
+        if not isinstance(audience_claims, list) or \
+                audience not in audience_claims:
+            raise TokenVerificationException('Invalid audience.')
+    if issuer is not None and claims.get('iss') != issuer:
+        raise TokenVerificationException('Invalid issuer.')
+
+
+REJECTION_MESSAGES = {
+    'malformed': 'Malformed token.',
+    'alg': 'The specified alg value is not allowed.',
+    'issuer': 'Invalid issuer.',
+    'token_use': 'Unexpected token use.',
+    'audience': 'Invalid audience.',
+    'expired': 'Signature has expired.',
+    'kid': 'Unknown key id.',
+    'verify': 'Signature verification failed.',
+    'revoked': 'The token has been revoked.',
+}
+
+
+def precheck(header, claims, issuer=None, client_ids=None, token_use=None,
+             now=None):
+    """
+    Checks of an unverified token that need neither its key nor any crypto,
+    to reject expired, foreign and misdirected tokens cheaply before the
+    signature is checked
+    :param header: the token header, from split_token
+    :param claims: the token claims, from split_token
+    :param issuer: expected iss, None to skip the check
+    :param client_ids: accepted app client ids (aud of id tokens, client_id
+    of access tokens), None to skip the check
+    :param token_use: 'id' or 'access', None for any
+    :param now: current time, as a timestamp
+    :return: the reason to reject the token, a key of REJECTION_MESSAGES,
+    or None
+    """
+    if header.get('alg') != 'RS256':
+        return 'alg'
+    if issuer is not None and claims.get('iss') != issuer:
+        return 'issuer'
+    use = claims.get('token_use')
+    if token_use is not None and use != token_use:
+        return 'token_use'
+    if client_ids is not None:
+        audience = claims.get('aud') if use == 'id' \
+            else claims.get('client_id')
+        if audience not in client_ids:
+            return 'audience'
+    try:
+        expires_at = int(claims['exp'])
+    except (KeyError, TypeError, ValueError):
+        return 'malformed'
+    if expires_at < (time.time() if now is None else now):
+        return 'expired'
+    return None
+
+
+class JoseBackend(object):
+    """
+    Verifies tokens with python-jose
+    """
+
+    name = 'jose'
+
+    def verify(self, token, key, audience=None, issuer=None):
+        """
+        :param token: the JWT
+        :param key: the JWK of the key that signed it
+        :param audience: expected audience
+        :param issuer: expected issuer
+        :return: the verified claims
+        """
+        from jose import jwt, JWTError
+
+        try:
+            return jwt.decode(token, key, algorithms=['RS256'],
+                              audience=audience, issuer=issuer)
+        except JWTError as e:
+            raise TokenVerificationException(str(e))
+
+
+class CryptographyBackend(object):
+    """
+    Verifies tokens with cryptography (OpenSSL). Loaded public keys are
+    cached, so a JWK is only parsed once.
+    """
+
+    name = 'cryptography'
+
+    def __init__(self):
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+        self._invalid_signature = InvalidSignature
+        self._padding = padding.PKCS1v15()
+        self._hash = hashes.SHA256()
+        self._rsa = rsa
+        self._keys = {}
+
+    def load_key(self, key):
+        """
+        :param key: RSA JWK
+        :return: the cryptography public key
+        """
+        cache_key = (key.get('n'), key.get('e'))
+        public_key = self._keys.get(cache_key)
+        if public_key is None:
+            if key.get('kty') != 'RSA':
+                raise TokenVerificationException('Unsupported key type.')
+            try:
+                numbers = self._rsa.RSAPublicNumbers(
+                    int.from_bytes(_b64decode(key['e']), 'big'),
+                    int.from_bytes(_b64decode(key['n']), 'big'))
+                public_key = numbers.public_key()
+            except (KeyError, ValueError, binascii.Error):
+                raise TokenVerificationException('Invalid key.')
+            self._keys[cache_key] = public_key
+        return public_key
+
+    def verify(self, token, key, audience=None, issuer=None):
+        """
+        :param token: the JWT
+        :param key: the JWK of the key that signed it
+        :param audience: expected audience
+        :param issuer: expected issuer
+        :return: the verified claims
+        """
+        header, claims, signing_input, signature = split_token(token)
+        if header.get('alg') != 'RS256':
+            raise TokenVerificationException('The specified alg value is '
+                                             'not allowed.')
+        try:
+            self.load_key(key).verify(signature, signing_input,
+                                      self._padding, self._hash)
+        except self._invalid_signature:
+            raise TokenVerificationException('Signature verification '
+                                             'failed.')
+        check_claims(claims, audience, issuer)
+        return claims
+
+
+BACKENDS = {
+    JoseBackend.name: JoseBackend,
+    CryptographyBackend.name: CryptographyBackend,
+}
+
+_default_backend = None
+
+
+def get_backend(name=None):
+    """
+    :param name: 'cryptography' or 'jose'; None picks cryptography if it is
+    installed and jose otherwise
+    :return: a new backend instance
+    """
+    if name is not None:
+        return BACKENDS[name]()
+    try:
+        return CryptographyBackend()
+    except ImportError:
+        return JoseBackend()
+
+
+def default_backend():
+    """
+    :return: the backend shared by the Cognito instances that don't set
+    their own, so they also share its key cache
+    """
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = get_backend()
+    return _default_backend
@@ -8,3 +8,26 @@ class ForceChangePasswordException(WarrantException):
 
 class TokenVerificationException(WarrantException):
     """Raised when token verification fails."""
+
+
+class DeadlineExceededException(WarrantException):
+    """Raised when a Cognito call takes longer than its deadline."""
+
+
+class CircuitOpenException(WarrantException):
+    """Raised when the circuit breaker rejects a call to Cognito."""
+
+
+class ProfileWriteException(WarrantException):
+    """Raised when buffered profile updates could not be written."""
+
+    def __init__(self, failures):
+        """
+        :param failures: list of (username, attributes, error) of the
+        writes that failed
+        """
+        super(ProfileWriteException, self).__init__(
+            '{} profile write(s) failed: {}'.format(
+                len(failures), ', '.join(sorted(
+                    {username for username, _, _ in failures}))))
+        self.failures = failures
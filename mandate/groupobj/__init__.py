@@ -1,18 +1,26 @@
+import bisect
+
+
 class GroupObj(object):
 
+    __slots__ = ('_data', '_cognito', 'group_name', 'description',
+                 'creation_date', 'last_modified_date', 'role_arn',
+                 'precedence')
+
     def __init__(self, group_data, cognito_obj):
         """
-        :param group_data: a dictionary with information about a group
+        :param group_data: a dictionary with information about a group. It is
+        kept as is: neither copied nor modified.
         :param cognito_obj: an instance of the Cognito class
         """
         self._data = group_data
         self._cognito = cognito_obj
-        self.group_name = self._data.pop('GroupName', None)
-        self.description = self._data.pop('Description', None)
-        self.creation_date = self._data.pop('CreationDate', None)
-        self.last_modified_date = self._data.pop('LastModifiedDate', None)
-        self.role_arn = self._data.pop('RoleArn', None)
-        self.precedence = self._data.pop('Precedence', None)
+        self.group_name = group_data.get('GroupName')
+        self.description = group_data.get('Description')
+        self.creation_date = group_data.get('CreationDate')
+        self.last_modified_date = group_data.get('LastModifiedDate')
+        self.role_arn = group_data.get('RoleArn')
+        self.precedence = group_data.get('Precedence')
 
     def __unicode__(self):
         return self.group_name
@@ -20,3 +28,113 @@ class GroupObj(object):
     def __repr__(self):
         return '<{class_name}: {uni}>'.format(
             class_name=self.__class__.__name__, uni=self.__unicode__())
+
+
+def _precedence_key(group):
+    # Cognito gives priority to the lowest precedence; groups without one
+    # come last
+    if group.precedence is None:
+        return (1, 0, group.group_name)
+    return (0, group.precedence, group.group_name)
+
+
+class GroupIndex(object):
+    """
+    In-memory index of the groups of a user pool, with constant time lookups
+    by name and by role ARN and the groups kept ordered by precedence.
+    """
+
+    def __init__(self, groups=()):
+        """
+        :param groups: iterable of GroupObj (or whatever the group_class is)
+        """
+        self._by_name = {}
+        self._by_role_arn = {}
+        self._ordered = []
+        self._keys = []
+        for group in groups:
+            self.add(group)
+
+    def add(self, group):
+        """
+        Adds a group to the index, replacing any group with the same name
+        :param group: instance of GroupObj
+        """
+        self.remove(group.group_name)
+        self._by_name[group.group_name] = group
+        if group.role_arn is not None:
+            self._by_role_arn.setdefault(group.role_arn, []).append(group)
+        key = _precedence_key(group)
+        position = bisect.bisect_right(self._keys, key)
+        self._keys.insert(position, key)
+        self._ordered.insert(position, group)
+
+    def remove(self, group_name):
+        """
+        Removes a group from the index. Does nothing if it is not there.
+        :param group_name: name of the group
+        """
+        group = self._by_name.pop(group_name, None)
+        if group is None:
+            return
+        if group.role_arn is not None:
+            same_role = self._by_role_arn[group.role_arn]
+            same_role.remove(group)
+            if not same_role:
+                del self._by_role_arn[group.role_arn]
+        position = bisect.bisect_left(self._keys, _precedence_key(group))
+        del self._keys[position]
+        del self._ordered[position]
+
+    def get(self, group_name, default=None):
+        return self._by_name.get(group_name, default)
+
+    def by_role_arn(self, role_arn):
+        """
+        :param role_arn: IAM role ARN
+        :return: list of the groups with that role, ordered by precedence
+        """
+        return sorted(self._by_role_arn.get(role_arn, ()),
+                      key=_precedence_key)
+
+    def by_precedence(self):
+        """
+        :return: list of all groups, highest priority (lowest precedence)
+        first
+        """
+        return list(self._ordered)
+
+    def effective_group(self, group_names):
+        """
+        Resolves the group that decides a user's role, the same way Cognito
+        does: the one with the lowest precedence.
+        :param group_names: names of the groups the user belongs to, e.g. the
+        cognito:groups claim of a token
+        :return: the winning group or None if none of them is indexed
+        """
+        best = None
+        best_key = None
+        for name in group_names:
+            group = self._by_name.get(name)
+            if group is None:
+                continue
+            key = _precedence_key(group)
+            if best_key is None or key < best_key:
+                best, best_key = group, key
+        return best
+
+    def effective_role_arn(self, group_names):
+        group = self.effective_group(group_names)
+        return group.role_arn if group is not None else None
+
+    def __getitem__(self, group_name):
+        return self._by_name[group_name]
+
+    def __contains__(self, group_name):
+        return group_name in self._by_name
+
+    def __iter__(self):
+        return iter(self.by_precedence())
+
+    def __len__(self):
+        return len(self._by_name)
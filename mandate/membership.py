@@ -0,0 +1,265 @@
+"""
+Group membership of a whole user pool, in memory.
+
+A MembershipIndex gives users and groups dense integer ids and keeps, for
+every group, a bitmap of its members (one bit per user id) and, for every
+user, a bitmap of its groups. Questions that take one Cognito call per group
+or per user, like "users in A and B but not in C" or "every group of bob",
+become a few bitwise operations on Python ints.
+
+    index = await cog.get_membership_index()
+    cog.membership_index = index  # kept up to date by cog's group calls
+    index.groups_of('bob')
+    index.query(all_of=['staff', 'eu'], none_of=['contractors'])
+
+Memory is predictable: each group takes one bit per user id (125KB per
+million users), twice that once queried as the int form is kept until the
+group changes; each user takes one small int plus its entries in two dicts.
+Freed ids are reused, so the bitmaps don't grow with churn.
+"""
+import re
+
+_NONZERO = re.compile(b'[^\x00]')
+
+# positions of the set bits of every byte value
+_BYTE_BITS = tuple(tuple(bit for bit in range(8) if value >> bit & 1)
+                   for value in range(256))
+
+
+def _positions(bitmap):
+    """
+    :param bitmap: non-negative int
+    :return: generator of the positions of its set bits, in order
+    """
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for match in _NONZERO.finditer(data):
+        position = match.start()
+        base = position << 3
+        for bit in _BYTE_BITS[data[position]]:
+            yield base + bit
+
+
+if hasattr(int, 'bit_count'):
+    # Python 3.10+
+    _popcount = int.bit_count
+else:
+    def _popcount(bitmap):
+        return bin(bitmap).count('1')
+
+
+def _set_bit(bitmap, position):
+    byte = position >> 3
+    if byte >= len(bitmap):
+        bitmap.extend(bytes(byte + 1 - len(bitmap)))
+    bitmap[byte] |= 1 << (position & 7)
+
+
+def _clear_bit(bitmap, position):
+    byte = position >> 3
+    if byte < len(bitmap):
+        bitmap[byte] &= ~(1 << (position & 7)) & 0xff
+
+
+class MembershipIndex(object):
+    """
+    Users and groups with dense integer ids, membership held as bitmaps.
+    Only users belonging to at least one group are indexed.
+    """
+
+    def __init__(self):
+        # username -> user id, and user id -> username (None when free)
+        self._user_ids = {}
+        self._usernames = []
+        self._free_users = []
+        # group name -> group id, and group id -> name (None when free)
+        self._group_ids = {}
+        self._group_names = []
+        self._free_groups = []
+        # group id -> bytearray with the bits of its members' user ids
+        self._members = []
+        # group id -> int of its members' bits, for the groups not changed
+        # since they were last queried
+        self._bitmaps = {}
+        # user id -> int with the bits of its groups' ids
+        self._user_groups = []
+        # bits of the user ids in use
+        self._users = bytearray()
+
+    def __len__(self):
+        return len(self._user_ids)
+
+    def __contains__(self, username):
+        return username in self._user_ids
+
+    def group_names(self):
+        return sorted(self._group_ids)
+
+    def add_group(self, group_name):
+        """
+        Indexes a group, without members if it is new
+        :param group_name: name of the group
+        :return: id of the group
+        """
+        group_id = self._group_ids.get(group_name)
+        if group_id is not None:
+            return group_id
+        if self._free_groups:
+            group_id = self._free_groups.pop()
+            self._group_names[group_id] = group_name
+        else:
+            group_id = len(self._group_names)
+            self._group_names.append(group_name)
+            self._members.append(bytearray())
+        self._group_ids[group_name] = group_id
+        return group_id
+
+    def _add_user(self, username):
+        user_id = self._user_ids.get(username)
+        if user_id is not None:
+            return user_id
+        if self._free_users:
+            user_id = self._free_users.pop()
+            self._usernames[user_id] = username
+        else:
+            user_id = len(self._usernames)
+            self._usernames.append(username)
+            self._user_groups.append(0)
+        self._user_ids[username] = user_id
+        _set_bit(self._users, user_id)
+        return user_id
+
+    def _free_user(self, user_id):
+        del self._user_ids[self._usernames[user_id]]
+        self._usernames[user_id] = None
+        self._user_groups[user_id] = 0
+        _clear_bit(self._users, user_id)
+        self._free_users.append(user_id)
+
+    def add(self, username, group_name):
+        """
+        Records that a user belongs to a group
+        :param username: User's username
+        :param group_name: name of the group
+        """
+        group_id = self.add_group(group_name)
+        user_id = self._add_user(username)
+        _set_bit(self._members[group_id], user_id)
+        self._bitmaps.pop(group_id, None)
+        self._user_groups[user_id] |= 1 << group_id
+
+    def remove(self, username, group_name):
+        """
+        Records that a user left a group. Does nothing if it wasn't in it.
+        :param username: User's username
+        :param group_name: name of the group
+        """
+        user_id = self._user_ids.get(username)
+        group_id = self._group_ids.get(group_name)
+        if user_id is None or group_id is None:
+            return
+        _clear_bit(self._members[group_id], user_id)
+        self._bitmaps.pop(group_id, None)
+        self._user_groups[user_id] &= ~(1 << group_id)
+        if not self._user_groups[user_id]:
+            self._free_user(user_id)
+
+    def remove_user(self, username):
+        """
+        Removes a user from all its groups, e.g. once deleted
+        :param username: User's username
+        """
+        user_id = self._user_ids.get(username)
+        if user_id is None:
+            return
+        for group_id in _positions(self._user_groups[user_id]):
+            _clear_bit(self._members[group_id], user_id)
+            self._bitmaps.pop(group_id, None)
+        self._free_user(user_id)
+
+    def remove_group(self, group_name):
+        """
+        Removes a group and its memberships
+        :param group_name: name of the group
+        """
+        group_id = self._group_ids.pop(group_name, None)
+        if group_id is None:
+            return
+        mask = ~(1 << group_id)
+        for user_id in _positions(self._bitmap(group_id)):
+            self._user_groups[user_id] &= mask
+            if not self._user_groups[user_id]:
+                self._free_user(user_id)
+        self._group_names[group_id] = None
+        self._members[group_id] = bytearray()
+        self._bitmaps.pop(group_id, None)
+        self._free_groups.append(group_id)
+
+    def _bitmap(self, group_id):
+        bitmap = self._bitmaps.get(group_id)
+        if bitmap is None:
+            bitmap = self._bitmaps[group_id] = int.from_bytes(
+                self._members[group_id], 'little')
+        return bitmap
+
+    def _group_bitmap(self, group_name):
+        group_id = self._group_ids.get(group_name)
+        return 0 if group_id is None else self._bitmap(group_id)
+
+    def is_member(self, username, group_name):
+        user_id = self._user_ids.get(username)
+        group_id = self._group_ids.get(group_name)
+        if user_id is None or group_id is None:
+            return False
+        return bool(self._user_groups[user_id] >> group_id & 1)
+
+    def groups_of(self, username):
+        """
+        :param username: User's username
+        :return: sorted list of the names of the user's groups
+        """
+        user_id = self._user_ids.get(username)
+        if user_id is None:
+            return []
+        return sorted(self._group_names[group_id] for group_id in
+                      _positions(self._user_groups[user_id]))
+
+    def users_in(self, group_name):
+        """
+        :param group_name: name of the group
+        :return: list of the usernames of its members
+        """
+        return self.query(all_of=[group_name])
+
+    def _select(self, all_of, any_of, none_of):
+        selected = None
+        for group_name in all_of:
+            bitmap = self._group_bitmap(group_name)
+            selected = bitmap if selected is None else selected & bitmap
+        if any_of:
+            union = 0
+            for group_name in any_of:
+                union |= self._group_bitmap(group_name)
+            selected = union if selected is None else selected & union
+        if selected is None:
+            selected = int.from_bytes(self._users, 'little')
+        for group_name in none_of:
+            selected &= ~self._group_bitmap(group_name)
+        return selected
+
+    def query(self, all_of=(), any_of=(), none_of=()):
+        """
+        Users by group membership. Unknown groups have no members.
+        :param all_of: names of groups the users must all belong to
+        :param any_of: names of groups the users must belong to one of
+        :param none_of: names of groups the users must not belong to
+        :return: list of usernames, every indexed user if no group is given
+        """
+        usernames = self._usernames
+        return [usernames[user_id] for user_id in
+                _positions(self._select(all_of, any_of, none_of))]
+
+    def count(self, all_of=(), any_of=(), none_of=()):
+        """
+        :return: number of users query would return, without listing them
+        """
+        return _popcount(self._select(all_of, any_of, none_of))
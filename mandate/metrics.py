@@ -0,0 +1,221 @@
+import bisect
+import contextlib
+import functools
+import os
+import time
+
+from .utils import ClientProxy
+
+# seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+THROTTLE_ERROR_CODES = frozenset([
+    'TooManyRequestsException',
+    'ThrottlingException',
+    'LimitExceededException',
+])
+
+
+class Histogram(object):
+    """
+    Fixed-bucket latency histogram, cumulative the way Prometheus expects
+    when exported.
+    """
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # one extra slot for +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimates a quantile from the buckets
+        :param q: quantile between 0 and 1, e.g. 0.99
+        :return: upper bound of the bucket the quantile falls in, None if
+        nothing was observed
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics(object):
+    """
+    Latency histograms per operation and phase, plus counters (cache hits,
+    throttles, retries, errors...). Pass an instance as the `metrics`
+    argument of Cognito to instrument it; hooks added with add_hook get
+    every event as it happens, e.g. to forward them to OpenTelemetry or
+    statsd.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.histograms = {}
+        self.counters = {}
+        self.hooks = []
+
+    def add_hook(self, hook):
+        """
+        :param hook: callable(event, operation, phase, value, error) where
+        event is 'timing' (value in seconds) or 'counter' (value is the
+        increment, phase the counter name)
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def observe(self, operation, phase, duration, error=None):
+        key = (operation, phase)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(duration)
+        for hook in self.hooks:
+            hook('timing', operation, phase, duration, error)
+
+    def incr(self, name, operation='', amount=1):
+        key = (name, operation)
+        self.counters[key] = self.counters.get(key, 0) + amount
+        for hook in self.hooks:
+            hook('counter', operation, name, amount, None)
+
+    @contextlib.contextmanager
+    def timer(self, operation, phase):
+        error = None
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.observe(operation, phase, time.perf_counter() - start, error)
+
+    def instrument(self, client):
+        """
+        :param client: client as returned by Cognito.get_client
+        :return: the client, with every API call timed
+        """
+        return InstrumentedClient(client, self)
+
+    def reset(self):
+        self.histograms.clear()
+        self.counters.clear()
+
+    def to_prometheus(self, prefix='mandate'):
+        """
+        :param prefix: metric name prefix
+        :return: the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        name = '{}_duration_seconds'.format(prefix)
+        lines.append('# TYPE {} histogram'.format(name))
+        for (operation, phase), histogram in sorted(self.histograms.items()):
+            labels = 'operation="{}",phase="{}"'.format(operation, phase)
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets,
+                                           histogram.counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    name, labels, bound, cumulative))
+            lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(
+                name, labels, histogram.count))
+            lines.append('{}_sum{{{}}} {}'.format(
+                name, labels, histogram.sum))
+            lines.append('{}_count{{{}}} {}'.format(
+                name, labels, histogram.count))
+        for counter in sorted(set(key[0] for key in self.counters)):
+            name = '{}_{}_total'.format(prefix, counter)
+            lines.append('# TYPE {} counter'.format(name))
+            for (other, operation), value in sorted(self.counters.items()):
+                if other == counter:
+                    lines.append('{}{{operation="{}"}} {}'.format(
+                        name, operation, value))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='mandate'):
+        """
+        Atomically writes the metrics to a file, e.g. for the node_exporter
+        textfile collector
+        :param path: destination file
+        :param prefix: metric name prefix
+        """
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus(prefix))
+        os.replace(tmp_path, path)
+
+
+class InstrumentedClient(ClientProxy):
+    """
+    Times every Cognito API call (phase 'request') and counts throttles and
+    botocore retries.
+    """
+
+    def __init__(self, client, metrics):
+        super(InstrumentedClient, self).__init__(client)
+        self._metrics = metrics
+
+    async def _call(self, operation, method, args, kwargs):
+        metrics = self._metrics
+        response = None
+        try:
+            with metrics.timer(operation, 'request'):
+                response = await method(*args, **kwargs)
+        except Exception as e:
+            metrics.incr('errors', operation)
+            response = getattr(e, 'response', None)
+            if isinstance(response, dict) and response.get(
+                    'Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+                metrics.incr('throttles', operation)
+            raise
+        finally:
+            if isinstance(response, dict):
+                retries = response.get(
+                    'ResponseMetadata', {}).get('RetryAttempts')
+                if retries:
+                    metrics.incr('retries', operation, retries)
+        return response
+
+
+def maybe_timer(metrics, operation, phase):
+    """
+    :return: metrics.timer(operation, phase), or a no-op context manager if
+    metrics is None
+    """
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.timer(operation, phase)
+
+
+def timed(method):
+    """
+    Decorator timing a coroutine method (phase 'total') with the metrics of
+    its instance, if it has any
+    """
+    operation = method.__name__
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if self.metrics is None:
+            return await method(self, *args, **kwargs)
+        with self.metrics.timer(operation, 'total'):
+            return await method(self, *args, **kwargs)
+    return wrapper
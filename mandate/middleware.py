@@ -0,0 +1,290 @@
+"""
+Bearer token authentication for ASGI and aiohttp applications.
+
+Both middlewares take a verifier with a `verify_token(token, token_use)`
+coroutine, typically a MultiPoolVerifier wrapped in a CachedVerifier, which
+is meant to be created once per process and shared: a token's signature is
+checked once and its claims are then served from memory until it expires,
+and invalid tokens are remembered for a few seconds so replaying them costs
+no RSA work either.
+
+    verifier = CachedVerifier(MultiPoolVerifier({'eu-west-2_abc': 'client'}))
+    app = CognitoAuthMiddleware(app, verifier)
+"""
+import asyncio
+import time
+
+from .crypto import token_digest
+from .exceptions import TokenVerificationException
+
+SCOPE_KEY = 'cognito_claims'
+
+_request_key = None
+
+
+def claims_request_key():
+    """
+    :return: key of the claims aiohttp_middleware puts in requests by
+    default: a web.RequestKey with aiohttp 3.11+, 'cognito_claims' before
+    """
+    global _request_key
+    if _request_key is None:
+        from aiohttp import web
+        request_key = getattr(web, 'RequestKey', None)
+        _request_key = SCOPE_KEY if request_key is None \
+            else request_key(SCOPE_KEY, dict)
+    return _request_key
+
+
+class TokenCache(object):
+    """
+    Claims of verified tokens, kept until the tokens expire. Holds at most
+    max_size tokens, dropping the oldest ones first. Tokens are keyed by
+    their digest, not kept themselves.
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self._claims = {}
+
+    def get(self, token, now=None):
+        """
+        :return: the claims of the token, None if it isn't cached or expired
+        """
+        digest = token_digest(token)
+        claims = self._claims.get(digest)
+        if claims is None:
+            return None
+        if claims.get('exp', 0) <= (time.time() if now is None else now):
+            self._claims.pop(digest, None)
+            return None
+        return claims
+
+    def set(self, token, claims):
+        if len(self._claims) >= self.max_size:
+            self._claims.pop(next(iter(self._claims)))
+        self._claims[token_digest(token)] = claims
+
+    def discard(self, token):
+        self._claims.pop(token_digest(token), None)
+
+    def __len__(self):
+        return len(self._claims)
+
+
+class CachedVerifier(object):
+    """
+    Puts a TokenCache and a short-lived cache of rejections in front of a
+    verifier, and verifies a token only once when it arrives on several
+    requests at the same time.
+    """
+
+    def __init__(self, verifier, cache=None, negative_ttl=5.0,
+                 negative_max_size=10000, metrics=None,
+                 revocation_store=None):
+        """
+        :param verifier: object with a verify_token(token, token_use)
+        coroutine, e.g. a MultiPoolVerifier, with run_in_executor to keep
+        the RSA work of cache misses off the event loop
+        :param cache: TokenCache for the verified tokens
+        :param negative_ttl: seconds a rejected token stays rejected without
+        being verified again, 0 to disable
+        :param negative_max_size: maximum number of remembered rejections
+        :param metrics: optional mandate.metrics.Metrics
+        :param revocation_store: store checked on every cache hit, the
+        verifier's by default, so signed out tokens aren't served from the
+        cache
+        """
+        self.verifier = verifier
+        self.revocation_store = revocation_store if revocation_store \
+            is not None else getattr(verifier, 'revocation_store', None)
+        self.cache = cache if cache is not None else TokenCache()
+        self.negative_ttl = negative_ttl
+        self.negative_max_size = negative_max_size
+        self.metrics = metrics
+        # (token digest, token_use) -> (time until which it is rejected,
+        # message)
+        self._rejected = {}
+        self._pending = {}
+
+    def _count(self, name):
+        if self.metrics is not None:
+            self.metrics.incr(name, 'verify_token')
+
+    async def verify_token(self, token, token_use=None):
+        """
+        :param token: id or access token
+        :param token_use: 'id' or 'access' to only accept that kind of token
+        :return: the verified claims
+        """
+        now = time.time()
+        claims = self.cache.get(token, now)
+        if claims is not None:
+            self._count('cache_hits')
+            if self.revocation_store is not None and \
+                    self.revocation_store.is_revoked(claims):
+                self.cache.discard(token)
+                raise TokenVerificationException(
+                    'The token has been revoked.')
+            if token_use is not None and \
+                    claims.get('token_use') != token_use:
+                raise TokenVerificationException('Unexpected token use.')
+            return claims
+
+        key = (token_digest(token), token_use)
+        rejected = self._rejected.get(key)
+        if rejected is not None:
+            if rejected[0] > now:
+                self._count('negative_cache_hits')
+                raise TokenVerificationException(rejected[1])
+            del self._rejected[key]
+
+        self._count('cache_misses')
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = asyncio.ensure_future(
+                self._verify(token, token_use, key))
+            pending.add_done_callback(
+                lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _verify(self, token, token_use, key):
+        try:
+            claims = await self.verifier.verify_token(token, token_use)
+        except TokenVerificationException as e:
+            if self.negative_ttl:
+                if len(self._rejected) >= self.negative_max_size:
+                    self._rejected.pop(next(iter(self._rejected)))
+                self._rejected[key] = (time.time() + self.negative_ttl,
+                                       str(e))
+            raise
+        self.cache.set(token, claims)
+        return claims
+
+    async def close(self):
+        close = getattr(self.verifier, 'close', None)
+        if close is not None:
+            await close()
+
+
+def bearer_token(authorization):
+    """
+    :param authorization: value of the Authorization header
+    :return: the bearer token, None if there isn't one
+    """
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+    return token.strip() or None
+
+
+class CognitoAuthMiddleware(object):
+    """
+    ASGI middleware verifying the bearer token of every HTTP and websocket
+    connection. The claims are put in scope['cognito_claims'] (None for
+    anonymous requests when authentication is optional); requests with an
+    invalid token, or without one when it is required, get a 401.
+    """
+
+    def __init__(self, app, verifier, token_use='access', required=True,
+                 scope_key=SCOPE_KEY, exclude_paths=()):
+        """
+        :param app: the ASGI application
+        :param verifier: e.g. a CachedVerifier
+        :param token_use: 'access' or 'id', None for any
+        :param required: whether to reject requests without a token
+        :param scope_key: scope key for the claims
+        :param exclude_paths: paths served without authentication, e.g.
+        health checks
+        """
+        self.app = app
+        self.verifier = verifier
+        self.token_use = token_use
+        self.required = required
+        self.scope_key = scope_key
+        self.exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] not in ('http', 'websocket') or \
+                scope.get('path') in self.exclude_paths:
+            return await self.app(scope, receive, send)
+
+        authorization = None
+        for name, value in scope.get('headers', ()):
+            if name == b'authorization':
+                authorization = value.decode('latin-1')
+                break
+        token = bearer_token(authorization)
+
+        if token is None:
+            if self.required:
+                return await self._unauthorized(scope, send, None)
+            claims = None
+        else:
+            try:
+                claims = await self.verifier.verify_token(token,
+                                                          self.token_use)
+            except TokenVerificationException:
+                return await self._unauthorized(scope, send,
+                                                'invalid_token')
+        scope[self.scope_key] = claims
+        return await self.app(scope, receive, send)
+
+    async def _unauthorized(self, scope, send, error):
+        if scope['type'] == 'websocket':
+            await send({'type': 'websocket.close', 'code': 1008})
+            return
+        challenge = b'Bearer'
+        if error is not None:
+            challenge += b' error="' + error.encode('ascii') + b'"'
+        await send({
+            'type': 'http.response.start',
+            'status': 401,
+            'headers': [(b'www-authenticate', challenge),
+                        (b'content-type', b'text/plain; charset=utf-8'),
+                        (b'content-length', b'12')],
+        })
+        await send({'type': 'http.response.body', 'body': b'Unauthorized'})
+
+
+def aiohttp_middleware(verifier, token_use='access', required=True,
+                       request_key=None, exclude_paths=()):
+    """
+    :param verifier: e.g. a CachedVerifier
+    :param token_use: 'access' or 'id', None for any
+    :param required: whether to reject requests without a token
+    :param request_key: key of the claims in the request,
+    claims_request_key() by default
+    :param exclude_paths: paths served without authentication
+    :return: an aiohttp middleware putting the claims in
+    request[claims_request_key()] and raising HTTPUnauthorized for invalid or
+    (when required) missing tokens
+    """
+    from aiohttp import web
+
+    if request_key is None:
+        request_key = claims_request_key()
+    exclude_paths = frozenset(exclude_paths)
+
+    @web.middleware
+    async def cognito_auth(request, handler):
+        if request.path in exclude_paths:
+            return await handler(request)
+        token = bearer_token(request.headers.get('Authorization'))
+        if token is None:
+            if required:
+                raise web.HTTPUnauthorized(
+                    headers={'WWW-Authenticate': 'Bearer'})
+            claims = None
+        else:
+            try:
+                claims = await verifier.verify_token(token, token_use)
+            except TokenVerificationException:
+                raise web.HTTPUnauthorized(headers={
+                    'WWW-Authenticate': 'Bearer error="invalid_token"'})
+        request[request_key] = claims
+        return await handler(request)
+
+    return cognito_auth
@@ -0,0 +1,264 @@
+"""
+Token verification for services accepting tokens from many user pools.
+
+A MultiPoolVerifier routes each token by its (unverified) iss claim to an
+allowlisted pool; anything else is rejected before any key lookup. The pools
+share one JWKSCache, which loads each pool's keys the first time one of its
+tokens is seen, over a single HTTP session.
+"""
+import asyncio
+import functools
+import time
+
+from .crypto import (
+    REJECTION_MESSAGES, default_backend, precheck, split_token
+)
+from .exceptions import TokenVerificationException
+from .metrics import maybe_timer
+
+ISSUER_TEMPLATE = 'https://cognito-idp.{}.amazonaws.com/{}'
+
+
+def pool_issuer(user_pool_id):
+    """
+    :param user_pool_id: e.g. eu-west-2_abcdef
+    :return: the iss claim of the tokens of that pool
+    """
+    return ISSUER_TEMPLATE.format(user_pool_id.split('_')[0], user_pool_id)
+
+
+class JWKSCache(object):
+    """
+    Public keys of any number of user pools, by issuer. Each JWKS is fetched
+    once, on first use, however many coroutines ask for it at the same time,
+    and again when a token names an unknown kid (key rotation), at most once
+    every min_refresh_interval seconds.
+    """
+
+    def __init__(self, session=None, metrics=None, min_refresh_interval=60,
+                 jwks_url=None, shared=None):
+        """
+        :param session: aiohttp.ClientSession to use; one is created (and
+        closed by close()) if not given
+        :param metrics: optional mandate.metrics.Metrics
+        :param min_refresh_interval: seconds between two fetches of the same
+        JWKS
+        :param jwks_url: callable returning the JWKS URL of an issuer, the
+        Cognito location by default
+        :param shared: mandate.sharedcache.SharedCache to take the JWKS from,
+        so that only one process of the host fetches each
+        """
+        self._session = session
+        self._own_session = session is None
+        self.metrics = metrics
+        self.min_refresh_interval = min_refresh_interval
+        self.shared = shared
+        self.jwks_url = jwks_url or (
+            lambda issuer: issuer + '/.well-known/jwks.json')
+        # issuer -> {kid: jwk}
+        self._keys = {}
+        self._fetched_at = {}
+        self._pending = {}
+
+    def set_keys(self, issuer, jwks):
+        """
+        Loads a JWKS without fetching it
+        :param issuer: iss of the pool
+        :param jwks: the JWKS dictionary
+        """
+        self._keys[issuer] = {key.get('kid'): key
+                              for key in jwks.get('keys', ())}
+        self._fetched_at[issuer] = time.monotonic()
+
+    async def get_key(self, issuer, kid):
+        """
+        :return: the JWK of the issuer with that kid
+        """
+        keys = self._keys.get(issuer)
+        if keys is not None:
+            key = keys.get(kid)
+            if key is not None:
+                if self.metrics is not None:
+                    self.metrics.incr('cache_hits', 'jwks')
+                return key
+            fetched_at = self._fetched_at.get(issuer, 0)
+            if time.monotonic() - fetched_at < self.min_refresh_interval:
+                raise TokenVerificationException('Unknown key id.')
+        if self.metrics is not None:
+            self.metrics.incr('cache_misses', 'jwks')
+        await self._fetch(issuer)
+        key = self._keys[issuer].get(kid)
+        if key is None:
+            raise TokenVerificationException('Unknown key id.')
+        return key
+
+    async def _fetch(self, issuer):
+        pending = self._pending.get(issuer)
+        if pending is None:
+            pending = self._pending[issuer] = asyncio.ensure_future(
+                self._download(issuer))
+            pending.add_done_callback(
+                lambda _: self._pending.pop(issuer, None))
+        await asyncio.shield(pending)
+
+    async def _download(self, issuer):
+        if self.shared is None:
+            self.set_keys(issuer, await self._request(issuer))
+            return
+        # a refresh needs a JWKS more recent than the one we have
+        max_age = self.min_refresh_interval \
+            if issuer in self._fetched_at else None
+        self.set_keys(issuer, await self.shared.get_jwks(
+            issuer, lambda: self._request(issuer), max_age=max_age))
+
+    async def _request(self, issuer):
+        with maybe_timer(self.metrics, 'get_keys', 'jwks'):
+            resp = await self.get_session().get(self.jwks_url(issuer))
+            async with resp:
+                resp.raise_for_status()
+                return await resp.json()
+
+    def get_session(self):
+        if self._session is None:
+            import aiohttp
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    def forget(self, issuer):
+        self._keys.pop(issuer, None)
+        self._fetched_at.pop(issuer, None)
+
+    async def close(self):
+        if self._own_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class _Pool(object):
+
+    __slots__ = ('user_pool_id', 'client_ids')
+
+    def __init__(self, user_pool_id, client_ids):
+        self.user_pool_id = user_pool_id
+        self.client_ids = client_ids
+
+
+class MultiPoolVerifier(object):
+    """
+    Verifies tokens of an allowlist of user pools. A pool costs one small
+    entry until one of its tokens shows up, so hundreds of pools are fine.
+
+        verifier = MultiPoolVerifier({
+            'eu-west-2_abcdef': ['client-a', 'client-b'],
+            'us-east-1_ghijkl': 'client-c',
+        })
+        claims = await verifier.verify_token(token, 'access')
+    """
+
+    def __init__(self, pools=(), jwt_backend=None, metrics=None,
+                 jwks_cache=None, revocation_store=None,
+                 run_in_executor=False, executor=None):
+        """
+        :param pools: dictionary of user pool id to the allowed app client
+        id(s), or a list of user pool ids to accept tokens of any client
+        :param jwt_backend: mandate.crypto backend, the shared default if
+        not given
+        :param metrics: optional mandate.metrics.Metrics, shared with the
+        JWKS cache
+        :param jwks_cache: JWKSCache, e.g. to share it with other verifiers
+        :param revocation_store: optional mandate.revocation store of signed
+        out tokens
+        :param run_in_executor: whether to check signatures in an executor
+        rather than on the event loop; OpenSSL releases the GIL, so with the
+        cryptography backend threads verify in parallel
+        :param executor: concurrent.futures executor for run_in_executor,
+        the loop's default one if None
+        """
+        self.jwt_backend = jwt_backend
+        self.revocation_store = revocation_store
+        self.metrics = metrics
+        self.run_in_executor = run_in_executor
+        self.executor = executor
+        self.jwks_cache = jwks_cache or JWKSCache(metrics=metrics)
+        self._pools = {}
+        if isinstance(pools, dict):
+            for user_pool_id, client_ids in pools.items():
+                self.add_pool(user_pool_id, client_ids)
+        else:
+            for user_pool_id in pools:
+                self.add_pool(user_pool_id)
+
+    def add_pool(self, user_pool_id, client_ids=None):
+        """
+        :param user_pool_id: id of the pool to accept
+        :param client_ids: app client id or list of ids to accept, None for
+        any
+        """
+        if isinstance(client_ids, str):
+            client_ids = [client_ids]
+        if client_ids is not None:
+            client_ids = frozenset(client_ids)
+        self._pools[pool_issuer(user_pool_id)] = _Pool(user_pool_id,
+                                                       client_ids)
+
+    def remove_pool(self, user_pool_id):
+        issuer = pool_issuer(user_pool_id)
+        self._pools.pop(issuer, None)
+        self.jwks_cache.forget(issuer)
+
+    def __contains__(self, user_pool_id):
+        return pool_issuer(user_pool_id) in self._pools
+
+    def __len__(self):
+        return len(self._pools)
+
+    def _reject(self, reason, message):
+        if self.metrics is not None:
+            self.metrics.incr('rejections', reason)
+        raise TokenVerificationException(message)
+
+    async def verify_token(self, token, token_use=None):
+        """
+        :param token: id or access token
+        :param token_use: 'id' or 'access' to only accept that kind of token
+        :return: the verified claims; claims['iss'] tells the pool
+        """
+        try:
+            header, claims, _, _ = split_token(token)
+        except TokenVerificationException as e:
+            self._reject('malformed', str(e))
+        issuer = claims.get('iss')
+        pool = self._pools.get(issuer)
+        if pool is None:
+            self._reject('issuer', 'Token issued by an unknown user pool.')
+        reason = precheck(header, claims, client_ids=pool.client_ids,
+                          token_use=token_use)
+        if reason == 'audience':
+            self._reject(reason, 'Token issued to an unknown client.')
+        if reason is not None:
+            self._reject(reason, REJECTION_MESSAGES[reason])
+        try:
+            key = await self.jwks_cache.get_key(issuer, header.get('kid'))
+        except TokenVerificationException as e:
+            self._reject('kid', str(e))
+        backend = self.jwt_backend or default_backend()
+        try:
+            with maybe_timer(self.metrics, 'verify_token', 'verify'):
+                if self.run_in_executor:
+                    claims = await asyncio.get_event_loop().run_in_executor(
+                        self.executor, functools.partial(
+                            backend.verify, token, key,
+                            audience=claims.get('aud'), issuer=issuer))
+                else:
+                    claims = backend.verify(token, key,
+                                            audience=claims.get('aud'),
+                                            issuer=issuer)
+        except TokenVerificationException as e:
+            self._reject('verify', str(e))
+        if self.revocation_store is not None and \
+                self.revocation_store.is_revoked(claims):
+            self._reject('revoked', REJECTION_MESSAGES['revoked'])
+        return claims
+
+    async def close(self):
+        await self.jwks_cache.close()
@@ -0,0 +1,179 @@
+"""
+Incremental export of a user pool.
+
+UserPoolSync keeps a snapshot of the pool in a SQLite file: one row per user
+with a hash of its attributes, Enabled and UserStatus. Each run pages through
+list_users and yields only the users added, changed or removed since the
+previous run, so whatever mirrors the pool only writes what changed.
+
+    sync = UserPoolSync(cog, 'users.sqlite3')
+    async for change in sync.changes():
+        if change.kind == REMOVED:
+            directory.delete(change.username)
+        else:
+            directory.put(change.username, change.user)
+
+The snapshot is committed when a run completes. A run that is interrupted
+(or whose generator is closed with aclose() before the end) leaves it as it
+was, and the next run yields those changes again. Starting a run abandons
+the previous one if it is still open: its generator can't be resumed.
+"""
+import collections
+import hashlib
+import json
+import sqlite3
+
+from .utils import cognito_to_dict
+
+ADDED = 'added'
+CHANGED = 'changed'
+REMOVED = 'removed'
+
+UserChange = collections.namedtuple('UserChange', ['kind', 'username',
+                                                   'user'])
+UserChange.__doc__ = """
+A difference between the pool and the snapshot. user is an instance of the
+Cognito user_class, None for removed users.
+"""
+
+
+def user_hash(user):
+    """
+    :param user: user as returned by list_users
+    :return: digest of its attributes, Enabled and UserStatus
+    """
+    content = [cognito_to_dict(user.get('Attributes', ())),
+               user.get('Enabled'), user.get('UserStatus')]
+    return hashlib.blake2b(
+        json.dumps(content, sort_keys=True, default=str).encode('utf-8'),
+        digest_size=16).digest()
+
+
+class UserPoolSync(object):
+    """
+    Diffs a user pool against its snapshot of the previous run
+    """
+
+    def __init__(self, cognito, path, attr_map=None, page_size=60):
+        """
+        :param cognito: Cognito of the user pool
+        :param path: SQLite file of the snapshot, created if missing
+        :param attr_map: Dictionary map from Cognito attributes to attribute
+        names we would like to show to our users
+        :param page_size: Limit passed to list_users (Cognito allows up to 60)
+        """
+        self.cognito = cognito
+        self.attr_map = attr_map
+        self.page_size = page_size
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY,
+                hash BLOB NOT NULL
+            ) WITHOUT ROWID;
+        ''')
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE key = 'user_pool_id'").fetchone()
+        if row is None:
+            self._db.execute(
+                "INSERT INTO meta VALUES ('user_pool_id', ?)",
+                (cognito.user_pool_id,))
+        elif row[0] != cognito.user_pool_id:
+            self._db.close()
+            raise ValueError('{} is the snapshot of {}'.format(path, row[0]))
+        # marker of the run holding the transaction
+        self._run = None
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    async def changes(self):
+        """
+        Pages through the user pool and yields a UserChange for every user
+        added, changed or removed since the last complete run
+        """
+        db = self._db
+        if db.in_transaction:
+            # a run left without being closed, not finalized yet
+            db.execute('ROLLBACK')
+        run = self._run = object()
+        db.execute('BEGIN')
+        db.execute('CREATE TEMP TABLE IF NOT EXISTS seen '
+                   '(username TEXT PRIMARY KEY) WITHOUT ROWID')
+        db.execute('DELETE FROM seen')
+        try:
+            kwargs = {'UserPoolId': self.cognito.user_pool_id,
+                      'Limit': self.page_size}
+            async with self.cognito.get_client() as client:
+                while True:
+                    response = await client.list_users(**kwargs)
+                    for change in self._diff_page(response.get('Users')):
+                        yield change
+                        self._check_run(run)
+                    pagination_token = response.get('PaginationToken')
+                    if not pagination_token:
+                        break
+                    kwargs['PaginationToken'] = pagination_token
+
+            removed = [row[0] for row in db.execute(
+                'SELECT username FROM users WHERE username NOT IN '
+                '(SELECT username FROM seen)')]
+            db.executemany('DELETE FROM users WHERE username = ?',
+                           [(username,) for username in removed])
+            for username in removed:
+                yield UserChange(REMOVED, username, None)
+                self._check_run(run)
+        except BaseException:
+            # unless a newer run took over the transaction
+            if self._run is run:
+                self._run = None
+                db.execute('ROLLBACK')
+            raise
+        self._run = None
+        db.execute('COMMIT')
+
+    def _check_run(self, run):
+        if self._run is not run:
+            raise RuntimeError('A newer run of changes() was started.')
+
+    def _diff_page(self, users):
+        db = self._db
+        usernames = [user['Username'] for user in users]
+        db.executemany('INSERT OR IGNORE INTO seen VALUES (?)',
+                       [(username,) for username in usernames])
+        known = dict(db.execute(
+            'SELECT username, hash FROM users WHERE username IN ({})'.format(
+                ','.join('?' * len(usernames))), usernames))
+
+        changes = []
+        rows = []
+        for user in users:
+            username = user['Username']
+            digest = user_hash(user)
+            previous = known.get(username)
+            if previous == digest:
+                continue
+            rows.append((username, digest))
+            changes.append(UserChange(
+                ADDED if previous is None else CHANGED, username,
+                self.cognito.get_user_obj(
+                    username, attribute_list=user.get('Attributes'),
+                    metadata={
+                        'username': username,
+                        'enabled': user.get('Enabled'),
+                        'user_status': user.get('UserStatus'),
+                        'last_modified': user.get('UserLastModifiedDate'),
+                    },
+                    attr_map=self.attr_map)))
+        # snapshots of older versions have a last_modified column, left null
+        db.executemany(
+            'INSERT OR REPLACE INTO users (username, hash) VALUES (?, ?)',
+            rows)
+        return changes
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,345 @@
+"""
+Record and replay of Cognito traffic.
+
+A Recorder passed as the `recorder` argument of Cognito writes every call
+made by its clients to an NDJSON trace, one line per call:
+
+    {"at": 12.53, "operation": "admin_get_user",
+     "params": {"UserPoolId": "eu-west-2_abc", "Username": "~3f9c0e6b1a2d"},
+     "latency": 0.041, "response": {"Username": "str", ...}, "error": null}
+
+`at` is the time of the call since the recorder started. Parameters are
+redacted: strings under keys other than SAFE_KEYS are replaced by a keyed
+hash, the same for the same value within a trace, so the workload keeps its
+shape (the same user looked up again) without its secrets and personal
+data. Responses are reduced to their shape: keys, value types and list
+lengths.
+
+A Replayer plays a trace against any client, at its original pacing or as
+fast as possible, and measures the latency of every call. TraceClient is a
+stand-in client answering from the trace itself, after the recorded latency
+or at once, so mandate's own overhead can be measured offline:
+
+    records = load_trace('prod.ndjson')
+    cog = Cognito('eu-west-2_abc', 'client', metrics=Metrics(),
+                  client_callback=lambda: TraceClient(records))
+    async with cog.get_client() as client:
+        metrics = await Replayer(records, speed=None).run(client)
+    metrics.histograms[('admin_get_user', 'replay')].quantile(0.99)
+"""
+import asyncio
+import collections
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import time
+
+from .metrics import Metrics
+from .utils import ClientProxy
+
+# parameters recorded as they are; any other string is redacted
+SAFE_KEYS = frozenset([
+    'AttributesToGet', 'AuthFlow', 'ChallengeName', 'ClientId',
+    'DeviceRememberedStatus', 'GroupName', 'Limit', 'Name', 'Precedence',
+    'UserPoolId',
+])
+
+REDACTED_PREFIX = '~'
+
+
+class Redactor(object):
+    """
+    Replaces the strings of request parameters by keyed hashes, stable
+    within a Redactor
+    """
+
+    def __init__(self, safe_keys=SAFE_KEYS, key=None):
+        """
+        :param safe_keys: parameter names whose values are kept
+        :param key: bytes keying the hashes, random by default; reuse one to
+        get the same hashes across traces
+        """
+        self.safe_keys = frozenset(safe_keys)
+        self.key = os.urandom(16) if key is None else key
+
+    def pseudonym(self, value):
+        digest = hmac.new(self.key, value.encode('utf-8'),
+                          hashlib.blake2b).hexdigest()
+        return REDACTED_PREFIX + digest[:12]
+
+    def redact(self, value, name=None):
+        if isinstance(value, dict):
+            return {key: self.redact(item, key)
+                    for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.redact(item, name) for item in value]
+        if isinstance(value, (bytes, bytearray)):
+            value = value.decode('latin-1')
+        if isinstance(value, str) and name not in self.safe_keys:
+            return self.pseudonym(value)
+        return value
+
+
+def shape(value):
+    """
+    :param value: response of a Cognito call
+    :return: its shape: dictionaries keep their keys, lists become
+    {'[]': length, 'item': shape of the first item}, other values the name
+    of their type
+    """
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()
+                if key != 'ResponseMetadata'}
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return {'[]': 0}
+        return {'[]': len(value), 'item': shape(value[0])}
+    if value is None:
+        return 'null'
+    if isinstance(value, datetime.datetime):
+        return 'datetime'
+    return type(value).__name__
+
+
+_SAMPLES = {
+    'str': 'x',
+    'int': 0,
+    'float': 0.0,
+    'bool': False,
+    'null': None,
+}
+
+
+def from_shape(value):
+    """
+    :param value: shape of a response
+    :return: a response with that shape and placeholder values
+    """
+    if isinstance(value, dict):
+        if '[]' in value:
+            if not value['[]']:
+                return []
+            return [from_shape(value['item']) for _ in range(value['[]'])]
+        return {key: from_shape(item) for key, item in value.items()}
+    if value == 'datetime':
+        return datetime.datetime.now(datetime.timezone.utc)
+    return _SAMPLES.get(value)
+
+
+def error_code(error):
+    """
+    :return: the Cognito error code of an exception, its class name if it
+    has none
+    """
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        code = response.get('Error', {}).get('Code')
+        if code:
+            return code
+    return type(error).__name__
+
+
+class Recorder(object):
+    """
+    Writes the calls of the clients it wraps to an NDJSON trace
+    """
+
+    def __init__(self, path, redactor=None, responses=True):
+        """
+        :param path: trace file, appended to
+        :param redactor: Redactor of the parameters, a new one by default
+        :param responses: whether to record the shape of the responses
+        """
+        self.path = path
+        self.redactor = redactor or Redactor()
+        self.responses = responses
+        self._file = open(path, 'a', buffering=1)
+        self._start = time.monotonic()
+
+    def wrap(self, client):
+        """
+        :param client: client as returned by Cognito.get_client
+        :return: the client, with its calls recorded
+        """
+        return RecordingClient(client, self)
+
+    def record(self, operation, params, started, latency, response=None,
+               error=None):
+        """
+        Writes one call to the trace
+        :param started: time.monotonic() when the call started
+        """
+        if self._file is None:
+            return
+        self._file.write(json.dumps({
+            'at': round(started - self._start, 6),
+            'operation': operation,
+            'params': self.redactor.redact(params),
+            'latency': round(latency, 6),
+            'response': shape(response)
+            if self.responses and error is None else None,
+            'error': None if error is None else error_code(error),
+        }, default=str) + '\n')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class RecordingClient(ClientProxy):
+    """
+    Client whose calls are written to a Recorder
+    """
+
+    def __init__(self, client, recorder):
+        super(RecordingClient, self).__init__(client)
+        self._recorder = recorder
+
+    async def _call(self, operation, method, args, kwargs):
+        started = time.monotonic()
+        try:
+            response = await method(*args, **kwargs)
+        except Exception as e:
+            self._recorder.record(operation, kwargs, started,
+                                  time.monotonic() - started, error=e)
+            raise
+        self._recorder.record(operation, kwargs, started,
+                              time.monotonic() - started, response)
+        return response
+
+
+def load_trace(path):
+    """
+    :param path: NDJSON trace written by a Recorder
+    :return: list of its records, by time of call
+    """
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record['at'])
+    return records
+
+
+def trace_usernames(records):
+    """
+    :return: set of the (redacted) usernames of a trace, e.g. to create
+    them in a FakeCognito before replaying it
+    """
+    return {record['params']['Username'] for record in records
+            if isinstance(record['params'].get('Username'), str)}
+
+
+class TraceClient(object):
+    """
+    Stand-in client answering each operation with the responses (or the
+    errors) recorded for it, in order, after their recorded latency
+    """
+
+    def __init__(self, records, latency=True):
+        """
+        :param records: records of a trace, from load_trace
+        :param latency: whether to wait for the recorded latency of a call
+        before answering it
+        """
+        self.latency = latency
+        # operation -> its records, and the next one to answer with
+        self._records = collections.defaultdict(list)
+        for record in records:
+            self._records[record['operation']].append(record)
+        self._next = collections.Counter()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def __getattr__(self, operation):
+        records = self.__dict__['_records'].get(operation)
+        if not records:
+            raise AttributeError(operation)
+
+        async def call(**kwargs):
+            position = self._next[operation]
+            self._next[operation] += 1
+            record = records[position % len(records)]
+            if self.latency and record['latency']:
+                await asyncio.sleep(record['latency'])
+            if record['error'] is not None:
+                from botocore.exceptions import ClientError
+                raise ClientError({'Error': {'Code': record['error'],
+                                             'Message': record['error']}},
+                                  operation)
+            return from_shape(record['response'] or {})
+        return call
+
+
+class Replayer(object):
+    """
+    Plays the calls of a trace against a client and measures them
+    """
+
+    def __init__(self, records, speed=1.0, concurrency=10, metrics=None):
+        """
+        :param records: records of a trace, from load_trace
+        :param speed: 1.0 for the original pacing, 2.0 for twice as fast...
+        None to send the calls as fast as possible
+        :param concurrency: calls in flight at most when replaying as fast as
+        possible; with a pacing they are sent on time, however many are in
+        flight
+        :param metrics: Metrics to record into, a new one by default
+        """
+        self.records = records
+        self.speed = speed
+        self.concurrency = concurrency
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    async def run(self, client):
+        """
+        :param client: client to send the calls to, e.g. a TraceClient, a
+        FakeCognito client or the one of Cognito.get_client
+        :return: the Metrics, with the latency of each call as (operation,
+        'replay'), the delay of the calls sent late as ('replay', 'lag'),
+        and the 'errors' counted by operation
+        """
+        if self.speed is None:
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def limited(record):
+                async with semaphore:
+                    await self._call(client, record)
+            await asyncio.gather(*[limited(record)
+                                   for record in self.records])
+            return self.metrics
+
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        first = self.records[0]['at'] if self.records else 0
+        tasks = []
+        try:
+            for record in self.records:
+                due = start + (record['at'] - first) / self.speed
+                delay = due - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.metrics.observe('replay', 'lag', -delay)
+                tasks.append(asyncio.ensure_future(
+                    self._call(client, record)))
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return self.metrics
+
+    async def _call(self, client, record):
+        operation = record['operation']
+        method = getattr(client, operation)
+        try:
+            with self.metrics.timer(operation, 'replay'):
+                await method(**record['params'])
+        except Exception:
+            self.metrics.incr('errors', operation)
@@ -0,0 +1,376 @@
+"""
+Deadlines, hedged reads and a circuit breaker around Cognito calls.
+
+A ResiliencePolicy passed as the `resilience` argument of Cognito guards
+every API call made through get_client:
+
+- each call gets a deadline (per operation, or a default one), past which it
+  is cancelled and DeadlineExceededException raised;
+- idempotent reads slower than the recent `hedge_quantile` of their latency
+  get a duplicate request, and the first response wins;
+- a circuit breaker opens after `failure_threshold` consecutive failures
+  showing Cognito degraded (timeouts, throttling, 5xx, connection errors).
+  While it is open calls fail fast with CircuitOpenException, or get the
+  last response seen for the same read if it is at most `stale_ttl` seconds
+  old. After `reset_timeout` seconds one call is let through to probe
+  Cognito, and closes the breaker if it succeeds.
+
+    policy = ResiliencePolicy(deadlines={'admin_get_user': 0.5},
+                              default_deadline=5, stale_ttl=300)
+    cog = Cognito('eu-west-2_abc', 'client', resilience=policy)
+    ...
+    policy.breaker.state  # 'closed', 'open' or 'half_open'
+"""
+import asyncio
+import collections
+import json
+import time
+
+from botocore.exceptions import BotoCoreError
+
+from .exceptions import CircuitOpenException, DeadlineExceededException
+from .metrics import THROTTLE_ERROR_CODES
+from .utils import ClientProxy
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# calls that don't change anything, safe to send twice
+READ_OPERATIONS = frozenset([
+    'admin_get_user',
+    'admin_list_groups_for_user',
+    'describe_user_pool',
+    'describe_user_pool_client',
+    'get_group',
+    'get_user',
+    'list_groups',
+    'list_users',
+    'list_users_in_group',
+])
+
+
+def is_degraded(error):
+    """
+    :param error: exception raised by a Cognito call
+    :return: whether it shows Cognito unavailable or overloaded, rather
+    than a bad request
+    """
+    if isinstance(error, (asyncio.TimeoutError, DeadlineExceededException,
+                          BotoCoreError, OSError)):
+        return True
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    if response.get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+        return True
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return status is not None and status >= 500
+
+
+class CircuitBreaker(object):
+    """
+    Counts consecutive failures; opens after `failure_threshold` of them and
+    lets one probe call through every `reset_timeout` seconds while open
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0,
+                 on_state_change=None, clock=time.monotonic):
+        """
+        :param failure_threshold: consecutive failures opening the breaker
+        :param reset_timeout: seconds the breaker stays open before a probe
+        :param on_state_change: callable called with the old and new state
+        :param clock: monotonic time function
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._state = CLOSED
+        self._probing = False
+
+    @property
+    def state(self):
+        if self._state == OPEN and \
+                self.clock() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return self._state
+
+    def _set_state(self, state):
+        old, self._state = self._state, state
+        if old != state and self.on_state_change is not None:
+            self.on_state_change(old, state)
+
+    def allow(self):
+        """
+        :return: whether a call may go through; when it returns True the
+        caller must report the outcome with record_success, record_failure
+        or release
+        """
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == OPEN or self._probing:
+            return False
+        self._set_state(HALF_OPEN)
+        self._probing = True
+        return True
+
+    def record_success(self):
+        self._probing = False
+        self.failures = 0
+        self._set_state(CLOSED)
+
+    def record_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self._state == HALF_OPEN or \
+                self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+            self._set_state(OPEN)
+
+    def release(self):
+        """
+        Reports a call that ended without telling anything about Cognito,
+        e.g. cancelled
+        """
+        self._probing = False
+
+    def stats(self):
+        return {'state': self.state, 'failures': self.failures,
+                'opened_at': self.opened_at}
+
+
+class ResiliencePolicy(object):
+    """
+    Settings and state shared by every client a Cognito creates: latencies
+    seen, the circuit breaker and the stale responses
+    """
+
+    def __init__(self, deadlines=None, default_deadline=None,
+                 hedged_operations=READ_OPERATIONS, hedge_quantile=0.95,
+                 hedge_delay=0.1, min_hedge_delay=0.001, min_samples=20,
+                 window=200, failure_threshold=5, reset_timeout=30.0,
+                 stale_ttl=None, max_stale_entries=10000, metrics=None):
+        """
+        :param deadlines: dictionary of operation name (e.g.
+        'admin_get_user') to seconds
+        :param default_deadline: seconds allowed to the other operations,
+        None for no deadline
+        :param hedged_operations: operations a duplicate request may be sent
+        for; only include idempotent ones
+        :param hedge_quantile: latency quantile of an operation past which a
+        duplicate request is sent
+        :param hedge_delay: seconds before the duplicate request until
+        min_samples latencies of the operation have been seen
+        :param min_hedge_delay: lower bound of the delay before the
+        duplicate request
+        :param min_samples: latencies needed to use hedge_quantile
+        :param window: number of recent latencies kept per operation
+        :param failure_threshold: consecutive failures opening the breaker,
+        None for no breaker
+        :param reset_timeout: seconds the breaker stays open before a probe
+        :param stale_ttl: seconds a response of a hedged operation may be
+        served when Cognito is degraded, None to never serve stale responses
+        :param max_stale_entries: responses kept for that
+        :param metrics: optional mandate.metrics.Metrics, counting 'hedges',
+        'hedge_wins', 'deadline_exceeded', 'short_circuits',
+        'stale_responses' and 'breaker_opened'
+        """
+        self.deadlines = {} if deadlines is None else dict(deadlines)
+        self.default_deadline = default_deadline
+        self.hedged_operations = frozenset(hedged_operations)
+        self.hedge_quantile = hedge_quantile
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.stale_ttl = stale_ttl
+        self.max_stale_entries = max_stale_entries
+        self.metrics = metrics
+        self.breaker = None
+        if failure_threshold is not None:
+            self.breaker = CircuitBreaker(failure_threshold, reset_timeout,
+                                          on_state_change=self._state_changed)
+        # operation -> recent latencies of successful attempts
+        self._latencies = {}
+        # (operation, arguments) -> (time, response), least recent first
+        self._stale = collections.OrderedDict()
+
+    def wrap(self, client):
+        """
+        :param client: client as returned by Cognito.get_client
+        :return: the client, with its calls guarded by the policy
+        """
+        return ResilientClient(client, self)
+
+    def _incr(self, name, operation):
+        if self.metrics is not None:
+            self.metrics.incr(name, operation)
+
+    def _state_changed(self, old, new):
+        if new == OPEN:
+            self._incr('breaker_opened', 'cognito')
+
+    def deadline(self, operation):
+        return self.deadlines.get(operation, self.default_deadline)
+
+    def hedge_after(self, operation):
+        """
+        :return: seconds before sending a duplicate request, None if the
+        operation isn't hedged
+        """
+        if operation not in self.hedged_operations:
+            return None
+        latencies = self._latencies.get(operation)
+        if latencies is None or len(latencies) < self.min_samples:
+            return self.hedge_delay
+        ordered = sorted(latencies)
+        return max(ordered[min(int(self.hedge_quantile * len(ordered)),
+                               len(ordered) - 1)], self.min_hedge_delay)
+
+    def observe(self, operation, latency):
+        latencies = self._latencies.get(operation)
+        if latencies is None:
+            latencies = self._latencies[operation] = collections.deque(
+                maxlen=self.window)
+        latencies.append(latency)
+
+    def _stale_key(self, operation, kwargs):
+        return operation, json.dumps(kwargs, sort_keys=True, default=str)
+
+    def remember(self, operation, kwargs, response):
+        if self.stale_ttl is None or \
+                operation not in self.hedged_operations:
+            return
+        key = self._stale_key(operation, kwargs)
+        self._stale.pop(key, None)
+        self._stale[key] = (time.monotonic(), response)
+        while len(self._stale) > self.max_stale_entries:
+            self._stale.popitem(last=False)
+
+    def stale_response(self, operation, kwargs):
+        """
+        :return: the last response seen for the same call if it is recent
+        enough, None otherwise
+        """
+        if self.stale_ttl is None:
+            return None
+        entry = self._stale.get(self._stale_key(operation, kwargs))
+        if entry is None or time.monotonic() - entry[0] > self.stale_ttl:
+            return None
+        self._incr('stale_responses', operation)
+        return entry[1]
+
+    def stats(self):
+        """
+        :return: dictionary describing the breaker and the caches, for
+        monitoring
+        """
+        return {
+            'breaker': None if self.breaker is None else self.breaker.stats(),
+            'stale_entries': len(self._stale),
+            'hedge_after': {operation: self.hedge_after(operation)
+                            for operation in sorted(self._latencies)},
+        }
+
+
+class ResilientClient(ClientProxy):
+    """
+    Client guarded by a ResiliencePolicy
+    """
+
+    def __init__(self, client, policy):
+        super(ResilientClient, self).__init__(client)
+        self._policy = policy
+
+    async def _call(self, operation, method, args, kwargs):
+        policy = self._policy
+        breaker = policy.breaker
+        if breaker is not None and not breaker.allow():
+            policy._incr('short_circuits', operation)
+            response = policy.stale_response(operation, kwargs)
+            if response is None:
+                raise CircuitOpenException(
+                    'Cognito is unavailable, not calling {}'.format(
+                        operation))
+            return response
+
+        try:
+            response = await self._hedged(operation, method, args, kwargs)
+        except asyncio.CancelledError:
+            if breaker is not None:
+                breaker.release()
+            raise
+        except Exception as e:
+            degraded = is_degraded(e)
+            if breaker is not None:
+                if degraded:
+                    breaker.record_failure()
+                else:
+                    # Cognito answered: it is up
+                    breaker.record_success()
+            response = policy.stale_response(operation, kwargs) \
+                if degraded else None
+            if response is None:
+                raise
+            return response
+        if breaker is not None:
+            breaker.record_success()
+        policy.remember(operation, kwargs, response)
+        return response
+
+    async def _hedged(self, operation, method, args, kwargs):
+        policy = self._policy
+        deadline = policy.deadline(operation)
+        race = self._race(operation, method, args, kwargs)
+        if deadline is None:
+            return await race
+        try:
+            return await asyncio.wait_for(race, deadline)
+        except asyncio.TimeoutError:
+            policy._incr('deadline_exceeded', operation)
+            raise DeadlineExceededException(
+                '{} took more than {}s'.format(operation, deadline))
+
+    async def _attempt(self, operation, method, args, kwargs):
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        response = await method(*args, **kwargs)
+        self._policy.observe(operation, loop.time() - start)
+        return response
+
+    async def _race(self, operation, method, args, kwargs):
+        policy = self._policy
+        hedge_after = policy.hedge_after(operation)
+        first = asyncio.ensure_future(
+            self._attempt(operation, method, args, kwargs))
+        pending = {first}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=hedge_after,
+                    return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # slower than usual: send the same request again
+                    policy._incr('hedges', operation)
+                    pending.add(asyncio.ensure_future(
+                        self._attempt(operation, method, args, kwargs)))
+                    hedge_after = None
+                    continue
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            policy._incr('hedge_wins', operation)
+                        return task.result()
+                    if error is None:
+                        error = task.exception()
+                # a failure doesn't trigger a hedge, botocore retries
+                hedge_after = None
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,239 @@
+"""
+Local revocation of tokens that Cognito has signed out.
+
+A global sign out revokes the refresh tokens of a user, but the access and id
+tokens already handed out stay valid, as far as their signature goes, until
+they expire. A revocation store remembers what was signed out so that
+verify_token can reject those tokens without asking Cognito:
+
+- a token, by its origin_jti (every token obtained from the same
+  authentication, refreshes included) or jti: tokens with that id issued
+  until the revocation are rejected;
+- a user, by sub: tokens of that user authenticated (auth_time) before the
+  revocation are rejected.
+
+Revocations are compared to the time the tokens were issued, at one second
+resolution. A token revoked by id is rejected if it was issued in the very
+second of the revocation, since a new sign in gets a new origin_jti anyway. A
+user is only cut off from the tokens authenticated in an earlier second, so
+that signing in again right after a sign out works.
+
+RevocationStore keeps the revocations in a dictionary and forgets them once
+every token they cover has expired. BloomRevocationStore keeps them in a
+fixed-size filter, optionally in a file shared by every process of a host.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import time
+
+# Cognito access and id tokens are valid for one day at most
+MAX_TOKEN_LIFETIME = 24 * 60 * 60
+
+
+class BaseRevocationStore(object):
+
+    max_token_lifetime = MAX_TOKEN_LIFETIME
+
+    def revoke_token(self, claims, now=None):
+        """
+        Revokes a token and, through its origin_jti, the tokens issued so far
+        from the same authentication
+        :param claims: claims of the token
+        :param now: time of the revocation, as a timestamp
+        """
+        now = int(time.time() if now is None else now)
+        jti = claims.get('origin_jti') or claims.get('jti')
+        if jti is None:
+            raise ValueError('The token has no jti claim.')
+        try:
+            lifetime = int(claims['exp']) - int(claims['iat'])
+        except (KeyError, TypeError, ValueError):
+            lifetime = self.max_token_lifetime
+        self._add('jti', jti, now, now + lifetime)
+
+    def revoke_subject(self, sub, cutoff=None):
+        """
+        Revokes the tokens of a user, e.g. after a global sign out
+        :param sub: sub claim of the user
+        :param cutoff: tokens authenticated in an earlier second are
+        revoked, now by default
+        """
+        cutoff = int(time.time() if cutoff is None else cutoff)
+        self._add('sub', sub, cutoff, cutoff + self.max_token_lifetime)
+
+    def is_revoked(self, claims):
+        """
+        :param claims: verified claims of a token
+        :return: whether the token has been revoked
+        """
+        issued_at = claims.get('iat', 0)
+        for jti in (claims.get('origin_jti'), claims.get('jti')):
+            if jti is not None and self._revoked('jti', jti, issued_at):
+                return True
+        sub = claims.get('sub')
+        # strictly before the cutoff: a sign in in the same second as the
+        # revocation may well have followed it
+        return sub is not None and \
+            self._revoked('sub', sub, claims.get('auth_time', issued_at) + 1)
+
+    def _add(self, kind, key, cutoff, expires_at):
+        raise NotImplementedError
+
+    def _revoked(self, kind, key, issued_at):
+        raise NotImplementedError
+
+
+class RevocationStore(BaseRevocationStore):
+    """
+    Exact revocations in memory. Each one is dropped once the tokens it
+    covers have expired.
+    """
+
+    def __init__(self, max_token_lifetime=MAX_TOKEN_LIFETIME,
+                 purge_interval=60):
+        """
+        :param max_token_lifetime: validity of the id and access tokens of
+        the pools, in seconds
+        :param purge_interval: seconds between two purges of the expired
+        revocations
+        """
+        self.max_token_lifetime = max_token_lifetime
+        self.purge_interval = purge_interval
+        # (kind, key) -> (cutoff, expires_at)
+        self._entries = {}
+        self._next_purge = 0
+
+    def _add(self, kind, key, cutoff, expires_at):
+        entry = self._entries.get((kind, key))
+        if entry is not None:
+            cutoff = max(cutoff, entry[0])
+            expires_at = max(expires_at, entry[1])
+        self._entries[(kind, key)] = (cutoff, expires_at)
+        now = time.time()
+        if now >= self._next_purge:
+            self.purge(now)
+
+    def _revoked(self, kind, key, issued_at):
+        entry = self._entries.get((kind, key))
+        if entry is None:
+            return False
+        if entry[1] <= time.time():
+            self._entries.pop((kind, key), None)
+            return False
+        return issued_at <= entry[0]
+
+    def purge(self, now=None):
+        """
+        Drops the revocations whose tokens have all expired
+        """
+        now = time.time() if now is None else now
+        self._entries = {key: entry for key, entry in self._entries.items()
+                         if entry[1] > now}
+        self._next_purge = now + self.purge_interval
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class BloomRevocationStore(BaseRevocationStore):
+    """
+    Revocations in a bloom filter of timestamps: each revocation raises the
+    slots of its key to its cutoff, and a token is revoked when every slot of
+    its key is at or past the time it was issued. Collisions can only revoke
+    a token wrongly, never let a revoked one through, and a revocation stops
+    mattering by itself once the tokens it covers have expired, since newer
+    tokens are issued after it: the filter never needs clearing.
+
+    With a path, the filter lives in that file, memory mapped, and every
+    process opening it shares the revocations.
+    """
+
+    _header = struct.Struct('=4sII')
+    _magic = b'MRV1'
+
+    def __init__(self, path=None, slots=1 << 18, hashes=4):
+        """
+        :param path: file to share the filter through, created if missing;
+        an existing file keeps its own size
+        :param slots: number of 4 bytes slots
+        :param hashes: number of slots per key
+        """
+        self.path = path
+        self._fd = None
+        size = self._header.size + 4 * slots
+        if path is None:
+            self._mmap = mmap.mmap(-1, size)
+            self._header.pack_into(self._mmap, 0, self._magic, slots, hashes)
+        else:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            with self._locked():
+                if os.fstat(self._fd).st_size == 0:
+                    os.ftruncate(self._fd, size)
+                    os.write(self._fd, self._header.pack(self._magic, slots,
+                                                         hashes))
+                self._mmap = mmap.mmap(self._fd, 0)
+            magic, slots, hashes = self._header.unpack_from(self._mmap, 0)
+            if magic != self._magic:
+                self.close()
+                raise ValueError('{} is not a revocation filter.'.format(
+                    path))
+        self.slots = slots
+        self.hashes = hashes
+        self._slots = memoryview(self._mmap)[self._header.size:].cast('I')
+
+    def _locked(self):
+        return _FileLock(self._fd)
+
+    def _indexes(self, kind, key):
+        digest = hashlib.blake2b('{}:{}'.format(kind, key).encode('utf-8'),
+                                 digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.slots for i in range(self.hashes)]
+
+    def _add(self, kind, key, cutoff, expires_at):
+        slots = self._slots
+        with self._locked():
+            for index in self._indexes(kind, key):
+                if slots[index] < cutoff:
+                    slots[index] = cutoff
+
+    def _revoked(self, kind, key, issued_at):
+        slots = self._slots
+        for index in self._indexes(kind, key):
+            cutoff = slots[index]
+            if not cutoff or cutoff < issued_at:
+                return False
+        return True
+
+    def close(self):
+        if self._mmap is not None:
+            if getattr(self, '_slots', None) is not None:
+                self._slots.release()
+                self._slots = None
+            self._mmap.close()
+            self._mmap = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class _FileLock(object):
+    """
+    Exclusive lock on a file between processes; does nothing without a file
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def __enter__(self):
+        if self.fd is not None:
+            import fcntl
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.fd is not None:
+            import fcntl
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
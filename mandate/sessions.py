@@ -0,0 +1,196 @@
+"""
+Keeps the tokens of many Cognito sessions fresh.
+
+A SessionManager tracks the access token expiry of every Cognito added to it
+in a heap and calls renew_access_token on each some time before the token
+expires, so requests never find an expired token. Refresh times are spread
+with random jitter and at most `concurrency` refreshes run at once, so
+sessions created together don't all refresh together.
+
+    async with SessionManager(refresh_margin=300) as sessions:
+        for cog in service_accounts:
+            await cog.authenticate(passwords[cog.username])
+            sessions.add(cog)
+        ...
+"""
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+from .crypto import split_token
+from .exceptions import TokenVerificationException
+
+
+class SessionManager(object):
+    """
+    Refreshes the tokens of the Cognito instances added to it ahead of
+    their expiry
+    """
+
+    def __init__(self, refresh_margin=300, jitter=60, concurrency=10,
+                 retry_interval=5, metrics=None, on_error=None,
+                 max_margin_fraction=0.5):
+        """
+        :param refresh_margin: seconds before expiry a token is refreshed
+        :param jitter: refreshes happen up to that many more seconds early,
+        at random, to spread them out
+        :param max_margin_fraction: share of a token's remaining lifetime the
+        margin is capped to, for tokens shorter lived than the margin; the
+        jitter is then capped to half of what is left, so a new token is
+        never refreshed straight away
+        :param concurrency: maximum number of refreshes running at once
+        :param retry_interval: seconds before retrying a failed refresh,
+        doubled on each new failure
+        :param metrics: optional mandate.metrics.Metrics
+        :param on_error: callable called with the Cognito and the exception
+        when a refresh fails
+        """
+        self.refresh_margin = refresh_margin
+        self.jitter = jitter
+        self.concurrency = concurrency
+        self.retry_interval = retry_interval
+        self.metrics = metrics
+        self.on_error = on_error
+        self.max_margin_fraction = max_margin_fraction
+        # (refresh at, sequence number, key)
+        self._heap = []
+        # key -> [cognito, sequence number of its heap entry, failures]
+        self._sessions = {}
+        self._sequence = itertools.count()
+        self._refreshing = set()
+        self._semaphore = None
+        self._wakeup = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, cognito):
+        return id(cognito) in self._sessions
+
+    def add(self, cognito):
+        """
+        Manages a Cognito holding a refresh token and an access token
+        """
+        if not cognito.refresh_token:
+            raise AttributeError('Refresh Token Required to Manage Session')
+        self._sessions[id(cognito)] = [cognito, None, 0]
+        self._schedule(cognito, self._refresh_time(cognito))
+
+    def remove(self, cognito):
+        self._sessions.pop(id(cognito), None)
+
+    def _refresh_time(self, cognito):
+        try:
+            _, claims, _, _ = split_token(cognito.access_token)
+            expires_at = float(claims['exp'])
+        except (TokenVerificationException, AttributeError, KeyError,
+                TypeError, ValueError):
+            # no usable access token: get one now
+            return time.time()
+        remaining = max(expires_at - time.time(), 0)
+        margin = min(self.refresh_margin,
+                     self.max_margin_fraction * remaining)
+        jitter = min(self.jitter,
+                     (1 - self.max_margin_fraction) * remaining / 2)
+        return expires_at - margin - random.uniform(0, jitter)
+
+    def _schedule(self, cognito, when):
+        session = self._sessions[id(cognito)]
+        session[1] = sequence = next(self._sequence)
+        heapq.heappush(self._heap, (when, sequence, id(cognito)))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def next_refresh(self):
+        """
+        :return: time of the next refresh, None if there is none
+        """
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def _drop_stale(self):
+        heap = self._heap
+        while heap:
+            _, sequence, key = heap[0]
+            session = self._sessions.get(key)
+            if session is not None and session[1] == sequence:
+                return
+            heapq.heappop(heap)
+
+    def start(self):
+        """
+        Starts refreshing in the background, on the running event loop
+        """
+        if self._task is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while self._task is not None:
+            now = time.time()
+            self._drop_stale()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, key = heapq.heappop(self._heap)
+                session = self._sessions[key]
+                # the session is rescheduled once refreshed
+                session[1] = None
+                task = asyncio.ensure_future(self._refresh(session[0]))
+                self._refreshing.add(task)
+                task.add_done_callback(self._refreshing.discard)
+                self._drop_stale()
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _refresh(self, cognito):
+        async with self._semaphore:
+            try:
+                await cognito.renew_access_token()
+            except Exception as e:
+                session = self._sessions.get(id(cognito))
+                if session is None:
+                    return
+                session[2] += 1
+                if self.metrics is not None:
+                    self.metrics.incr('refresh_failures', 'session_manager')
+                if self.on_error is not None:
+                    self.on_error(cognito, e)
+                self._schedule(cognito, time.time() + self.retry_interval *
+                               2 ** min(session[2] - 1, 10))
+                return
+        session = self._sessions.get(id(cognito))
+        if session is None:
+            return
+        session[2] = 0
+        if self.metrics is not None:
+            self.metrics.incr('refreshes', 'session_manager')
+        self._schedule(cognito, self._refresh_time(cognito))
+
+    async def close(self):
+        """
+        Stops refreshing; running refreshes are cancelled
+        """
+        tasks = list(self._refreshing)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+            # wait_for may swallow the cancellation of _run when its wait
+            # ends at the same time; then it sees _task unset and returns
+            self._wakeup.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
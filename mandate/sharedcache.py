@@ -0,0 +1,324 @@
+"""
+JWKS and verified tokens shared by the processes of a host.
+
+A SharedCache lives in a memory mapped file. It holds:
+
+- the JWKS of the user pools, as one JSON document: the first process
+  needing a JWKS takes a lease on its issuer and fetches it, the others wait
+  for it to be published instead of fetching it too, or keep using the
+  previous one while it is refreshed;
+- a fixed-size hash table of the digests of verified tokens with their exp:
+  a token verified by one process is a cache hit in every other, which only
+  decodes its claims instead of checking its signature again.
+
+Readers take no lock: every entry has a sequence number, odd while it is
+being written, read before and after the entry, and a read that races a
+write is a miss. Writers serialize with flock.
+
+    shared = SharedCache('/dev/shm/mandate-cache')
+    cog = Cognito('eu-west-2_abc', 'client', shared_cache=shared)
+    # or, in front of a MultiPoolVerifier
+    verifier = CachedVerifier(
+        MultiPoolVerifier(pools, jwks_cache=JWKSCache(shared=shared)),
+        cache=shared)
+
+Processes sharing a file should verify tokens the same way (same pools and
+client ids): a token verified by one is trusted by all.
+"""
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+
+from .crypto import split_token, token_digest
+from .exceptions import TokenVerificationException
+from .revocation import _FileLock
+
+# slots looked at for a token, from the one its digest points to
+PROBES = 4
+
+# issuers whose JWKS can be fetched at the same time, each under a lease
+LEASES = 16
+
+
+class SharedCache(object):
+    """
+    JWKS and verified token digests in shared memory. Implements the
+    TokenCache interface, for CachedVerifier.
+    """
+
+    _header = struct.Struct('=4sII')
+    _magic = b'MSC2'
+    # issuer digest and end of a JWKS fetch lease
+    _lease = struct.Struct('=8sd')
+    _leases_offset = 16
+    # sequence number and length of the JWKS document
+    _jwks_header = struct.Struct('=II')
+    _jwks_offset = _leases_offset + _lease.size * LEASES
+    # sequence number, exp and digest of a token
+    _slot = struct.Struct('=II16s')
+    _seq = struct.Struct('=I')
+    _entry = struct.Struct('=I16s')
+
+    def __init__(self, path=None, slots=1 << 16, jwks_size=1 << 16,
+                 poll_interval=0.05):
+        """
+        :param path: file to share the cache through, created if missing
+        (e.g. on /dev/shm); an existing file keeps its own sizes. Without
+        one, the cache is private to the process.
+        :param slots: number of verified tokens held
+        :param jwks_size: bytes for the JWKS document
+        :param poll_interval: seconds between two looks for a JWKS another
+        process is fetching
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self._fd = None
+        size = self._table_offset(jwks_size) + self._slot.size * slots
+        if path is None:
+            self._mmap = mmap.mmap(-1, size)
+            self._header.pack_into(self._mmap, 0, self._magic, slots,
+                                   jwks_size)
+        else:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            with self._locked():
+                if os.fstat(self._fd).st_size == 0:
+                    os.ftruncate(self._fd, size)
+                    os.write(self._fd, self._header.pack(
+                        self._magic, slots, jwks_size))
+                self._mmap = mmap.mmap(self._fd, 0)
+            magic, slots, jwks_size = self._header.unpack_from(self._mmap, 0)
+            if magic != self._magic:
+                self.close()
+                raise ValueError('{} is not a mandate cache.'.format(path))
+        self.slots = slots
+        self.jwks_size = jwks_size
+        self._table = self._table_offset(jwks_size)
+        # parsed JWKS document, and the sequence number it was read at
+        self._jwks = {}
+        self._jwks_seq = 0
+
+    def _table_offset(self, jwks_size):
+        end = self._jwks_offset + self._jwks_header.size + jwks_size
+        return (end + 7) // 8 * 8
+
+    def _locked(self):
+        return _FileLock(self._fd)
+
+    # Verified tokens
+
+    def _probes(self, digest):
+        start = int.from_bytes(digest[:8], 'little')
+        return [(start + i) % self.slots for i in range(PROBES)]
+
+    def _read_slot(self, index):
+        """
+        :return: (exp, digest) of a slot, None if it is being written
+        """
+        offset = self._table + index * self._slot.size
+        mm = self._mmap
+        seq = self._seq.unpack_from(mm, offset)[0]
+        if seq & 1:
+            return None
+        entry = self._entry.unpack_from(mm, offset + 4)
+        if self._seq.unpack_from(mm, offset)[0] != seq:
+            return None
+        return entry
+
+    def _write_slot(self, index, exp, digest):
+        # with the lock held
+        offset = self._table + index * self._slot.size
+        mm = self._mmap
+        seq = self._seq.unpack_from(mm, offset)[0]
+        self._seq.pack_into(mm, offset, (seq + 1) & 0xffffffff)
+        self._entry.pack_into(mm, offset + 4, exp, digest)
+        self._seq.pack_into(mm, offset, (seq + 2) & 0xffffffff)
+
+    def get(self, token, now=None):
+        """
+        :return: the claims of the token if a process verified it and it
+        hasn't expired, None otherwise
+        """
+        digest = token_digest(token)
+        now = time.time() if now is None else now
+        for index in self._probes(digest):
+            entry = self._read_slot(index)
+            if entry is not None and entry[1] == digest:
+                if entry[0] <= now:
+                    return None
+                try:
+                    return split_token(token)[1]
+                except TokenVerificationException:
+                    return None
+        return None
+
+    def set(self, token, claims):
+        """
+        Records a verified token until its exp
+        """
+        exp = int(claims.get('exp', 0))
+        now = time.time()
+        if exp <= now:
+            return
+        digest = token_digest(token)
+        with self._locked():
+            chosen = None
+            chosen_exp = None
+            for index in self._probes(digest):
+                offset = self._table + index * self._slot.size
+                slot_exp, slot_digest = self._entry.unpack_from(
+                    self._mmap, offset + 4)
+                if slot_digest == digest:
+                    chosen = index
+                    break
+                # a free slot, or else the one expiring first
+                if chosen is None or slot_exp < chosen_exp:
+                    chosen, chosen_exp = index, slot_exp
+            self._write_slot(chosen, exp, digest)
+
+    def discard(self, token):
+        digest = token_digest(token)
+        with self._locked():
+            for index in self._probes(digest):
+                offset = self._table + index * self._slot.size
+                if self._entry.unpack_from(self._mmap,
+                                           offset + 4)[1] == digest:
+                    self._write_slot(index, 0, bytes(16))
+
+    def __len__(self):
+        now = time.time()
+        table = self._mmap[self._table:]
+        return sum(1 for _, exp, _ in self._slot.iter_unpack(table)
+                   if exp > now)
+
+    # JWKS
+
+    def _read_jwks(self):
+        """
+        :return: the JWKS document, {issuer: {'fetched_at': time, 'jwks':
+        jwks}}, None if it is being written
+        """
+        mm = self._mmap
+        seq, length = self._jwks_header.unpack_from(mm, self._jwks_offset)
+        if seq & 1:
+            return None
+        if seq == self._jwks_seq:
+            return self._jwks
+        start = self._jwks_offset + self._jwks_header.size
+        data = mm[start:start + length]
+        if self._seq.unpack_from(mm, self._jwks_offset)[0] != seq:
+            return None
+        self._jwks = json.loads(data.decode('utf-8')) if length else {}
+        self._jwks_seq = seq
+        return self._jwks
+
+    def jwks_entry(self, issuer):
+        """
+        :return: {'fetched_at': time, 'jwks': jwks} for the issuer, None if
+        no process published its JWKS
+        """
+        document = self._read_jwks()
+        if document is None:
+            with self._locked():
+                document = self._read_jwks() or {}
+        return document.get(issuer)
+
+    def publish_jwks(self, issuer, jwks, fetched_at=None):
+        """
+        Shares the JWKS of an issuer and ends its fetch lease. A JWKS not
+        fitting in jwks_size isn't shared.
+        """
+        with self._locked():
+            document = dict(self._read_jwks() or {})
+            document[issuer] = {'fetched_at': fetched_at or time.time(),
+                                'jwks': jwks}
+            data = json.dumps(document).encode('utf-8')
+            mm = self._mmap
+            offset = self._jwks_offset
+            seq, length = self._jwks_header.unpack_from(mm, offset)
+            if len(data) <= self.jwks_size:
+                self._seq.pack_into(mm, offset, (seq + 1) & 0xffffffff)
+                start = offset + self._jwks_header.size
+                mm[start:start + len(data)] = data
+                self._jwks_header.pack_into(mm, offset,
+                                            (seq + 2) & 0xffffffff, len(data))
+            self._clear_lease(issuer)
+
+    def _lease_offsets(self):
+        return range(self._leases_offset, self._jwks_offset, self._lease.size)
+
+    def _issuer_digest(self, issuer):
+        return hashlib.blake2b(issuer.encode('utf-8'), digest_size=8).digest()
+
+    def _take_lease(self, issuer, duration):
+        """
+        :return: whether the caller may fetch the JWKS of the issuer, False
+        while another process holds its lease
+        """
+        digest = self._issuer_digest(issuer)
+        mm = self._mmap
+        with self._locked():
+            now = time.time()
+            free = None
+            for offset in self._lease_offsets():
+                slot_digest, until = self._lease.unpack_from(mm, offset)
+                if slot_digest == digest and until > now:
+                    return False
+                if free is None and (slot_digest == digest or until <= now):
+                    free = offset
+            # with every slot taken, fetch without a lease
+            if free is not None:
+                self._lease.pack_into(mm, free, digest, now + duration)
+            return True
+
+    def _clear_lease(self, issuer):
+        # with the lock held
+        digest = self._issuer_digest(issuer)
+        for offset in self._lease_offsets():
+            if self._lease.unpack_from(self._mmap, offset)[0] == digest:
+                self._lease.pack_into(self._mmap, offset, bytes(8), 0.0)
+
+    def _end_lease(self, issuer):
+        with self._locked():
+            self._clear_lease(issuer)
+
+    async def get_jwks(self, issuer, fetch, max_age=None, lease=10.0):
+        """
+        :param issuer: iss of the pool
+        :param fetch: coroutine function downloading the JWKS, called by
+        one process at a time
+        :param max_age: seconds since the shared JWKS was fetched past which
+        it is fetched again, None to take it whatever its age; while another
+        process fetches it, the older one is returned
+        :param lease: seconds a process may take to fetch before another
+        one tries
+        :return: the JWKS of the issuer
+        """
+        while True:
+            entry = self.jwks_entry(issuer)
+            if entry is not None and (
+                    max_age is None or
+                    time.time() - entry['fetched_at'] <= max_age):
+                return entry['jwks']
+            if self._take_lease(issuer, lease):
+                try:
+                    jwks = await fetch()
+                except BaseException:
+                    self._end_lease(issuer)
+                    raise
+                self.publish_jwks(issuer, jwks)
+                return jwks
+            if entry is not None:
+                return entry['jwks']
+            await asyncio.sleep(self.poll_interval)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
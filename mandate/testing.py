@@ -0,0 +1,1160 @@
+"""
+In-memory stand-in for the cognito-idp API, for tests and load tests of code
+built on mandate without an AWS account.
+
+    fake = FakeCognito()
+    fake.add_user('bob', 'Passw0rd!', {'email': 'bob@example.com'})
+    cog = fake.cognito(username='bob')
+    await cog.authenticate('Passw0rd!')
+
+FakeCognito stores users and groups, paginates its listings, runs the server
+side of SRP and issues RS256 tokens signed with a local key whose JWKS is in
+FakeCognito.jwks (and can be served over HTTP with serve_jwks). Errors are
+raised as botocore ClientErrors with the codes Cognito uses.
+"""
+import asyncio
+import base64
+import bisect
+import datetime
+import hashlib
+import heapq
+import hmac
+import os
+import random
+import shlex
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+from jose import jwt
+
+from .aws_srp import (
+    AWSSRP, calculate_u, compute_hkdf, g_hex, get_random, hash_sha256,
+    hex_hash, hex_to_long, long_to_hex, n_hex, pad_hex
+)
+from .utils import cognito_to_dict
+
+BIG_N = hex_to_long(n_hex)
+G = hex_to_long(g_hex)
+K = hex_to_long(hex_hash('00' + n_hex + '0' + g_hex))
+
+MAX_PAGE_SIZE = 60
+
+# Cognito's default refresh token validity
+REFRESH_TOKEN_VALIDITY = 30 * 24 * 60 * 60
+
+
+def _b64url_uint(value):
+    raw = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def generate_rsa_key(kid, bits=2048):
+    """
+    Generates an RS256 signing key, with cryptography if it is installed and
+    the pure Python rsa package otherwise
+    :return: (private key PEM, public JWK)
+    """
+    try:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+    except ImportError:
+        import rsa as pure_rsa
+        public_key, private_key = pure_rsa.newkeys(bits)
+        pem = private_key.save_pkcs1().decode('ascii')
+        n, e = public_key.n, public_key.e
+    else:
+        private_key = rsa.generate_private_key(65537, bits)
+        pem = private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption()).decode('ascii')
+        numbers = private_key.public_key().public_numbers()
+        n, e = numbers.n, numbers.e
+    jwk = {'kid': kid, 'alg': 'RS256', 'kty': 'RSA', 'use': 'sig',
+           'n': _b64url_uint(n), 'e': _b64url_uint(e)}
+    return pem, jwk
+
+
+def client_error(code, message, operation):
+    return ClientError({'Error': {'Code': code, 'Message': message},
+                        'ResponseMetadata': {'HTTPStatusCode': 400}},
+                       operation)
+
+
+def _response(**kwargs):
+    kwargs['ResponseMetadata'] = {'HTTPStatusCode': 200, 'RetryAttempts': 0}
+    return kwargs
+
+
+class SortedKeys(dict):
+    """
+    dict that also keeps its keys in a sorted list, so listings can resume
+    after the last key returned: pages don't shift when entries are added or
+    removed between two calls, and a full listing is linear
+    """
+
+    def __init__(self):
+        super(SortedKeys, self).__init__()
+        self.sorted_keys = []
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            bisect.insort(self.sorted_keys, key)
+        super(SortedKeys, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super(SortedKeys, self).__delitem__(key)
+        keys = self.sorted_keys
+        del keys[bisect.bisect_left(keys, key)]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return super(SortedKeys, self).pop(key, *default)
+
+    def clear(self):
+        super(SortedKeys, self).clear()
+        self.sorted_keys = []
+
+    # sets of keys
+
+    def add(self, key):
+        self[key] = None
+
+    def discard(self, key):
+        self.pop(key, None)
+
+
+def _paginate(keys, limit, token, token_key, accept=None):
+    """
+    :param keys: sorted list of keys
+    :param token: pagination token of the previous page, None for the first
+    :param accept: optional predicate the keys of the page must satisfy
+    :return: (keys of the page, response fields with the next token)
+    """
+    limit = min(limit or MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+    start = 0
+    if token:
+        after = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8')
+        start = bisect.bisect_right(keys, after)
+    page = []
+    position = start
+    while position < len(keys) and len(page) < limit:
+        key = keys[position]
+        if accept is None or accept(key):
+            page.append(key)
+        position += 1
+    extra = {}
+    if page and position < len(keys):
+        extra[token_key] = base64.urlsafe_b64encode(
+            page[-1].encode('utf-8')).decode('ascii')
+    return page, extra
+
+
+def parse_filter(expression):
+    """
+    Parses a list_users Filter such as `email ^= "bob"`
+    :return: (attribute name, operator, value)
+    """
+    try:
+        name, operator, value = shlex.split(expression)
+    except ValueError:
+        name = operator = value = None
+    if operator not in ('=', '^='):
+        raise client_error('InvalidParameterException',
+                           'Error while parsing filter.', 'ListUsers')
+    return name, operator, value
+
+
+class FakeUser(object):
+
+    __slots__ = ('username', 'password', 'attributes', 'enabled', 'status',
+                 'created', 'modified', 'groups', 'tokens', 'codes',
+                 'devices', '_salt', '_verifier')
+
+    def __init__(self, username, password, attributes, status):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.username = username
+        self.password = password
+        self.attributes = attributes
+        self.enabled = True
+        self.status = status
+        self.created = now
+        self.modified = now
+        self.groups = SortedKeys()
+        # access and refresh tokens currently valid
+        self.tokens = set()
+        self.codes = {}
+        # DeviceKey -> FakeDevice
+        self.devices = {}
+        self._salt = None
+        self._verifier = None
+
+    @property
+    def sub(self):
+        return self.attributes['sub']
+
+    def set_password(self, password):
+        self.password = password
+        self._verifier = None
+
+    def srp_verifier(self, pool_name):
+        """
+        :return: (salt, verifier) as stored by Cognito for SRP
+        """
+        if self._verifier is None:
+            self._salt = pad_hex(get_random(16))
+            password_hash = hash_sha256('{}{}:{}'.format(
+                pool_name, self.username, self.password).encode('utf-8'))
+            x_value = hex_to_long(hex_hash(self._salt + password_hash))
+            self._verifier = pow(G, x_value, BIG_N)
+        return self._salt, self._verifier
+
+    def touch(self):
+        self.modified = datetime.datetime.now(datetime.timezone.utc)
+
+    def attribute_list(self):
+        return [{'Name': name, 'Value': value}
+                for name, value in self.attributes.items()]
+
+    def describe(self, attributes_key='Attributes'):
+        return {
+            'Username': self.username,
+            attributes_key: self.attribute_list(),
+            'UserCreateDate': self.created,
+            'UserLastModifiedDate': self.modified,
+            'Enabled': self.enabled,
+            'UserStatus': self.status,
+        }
+
+    def filter_value(self, name):
+        if name == 'username':
+            return self.username
+        if name == 'cognito:user_status':
+            return self.status
+        if name == 'status':
+            return 'Enabled' if self.enabled else 'Disabled'
+        return self.attributes.get(name)
+
+
+class FakeDevice(object):
+
+    __slots__ = ('key', 'group_key', 'name', 'salt', 'verifier', 'remembered')
+
+    def __init__(self, key, group_key):
+        self.key = key
+        self.group_key = group_key
+        self.name = None
+        # set by ConfirmDevice
+        self.salt = None
+        self.verifier = None
+        self.remembered = False
+
+
+class FakeGroup(object):
+
+    __slots__ = ('name', 'description', 'role_arn', 'precedence', 'created',
+                 'modified', 'members')
+
+    def __init__(self, name, description=None, role_arn=None,
+                 precedence=None):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.name = name
+        self.description = description
+        self.role_arn = role_arn
+        self.precedence = precedence
+        self.created = now
+        self.modified = now
+        # usernames, as a sorted set
+        self.members = SortedKeys()
+
+    def describe(self, user_pool_id):
+        group = {'GroupName': self.name, 'UserPoolId': user_pool_id,
+                 'CreationDate': self.created,
+                 'LastModifiedDate': self.modified}
+        if self.description is not None:
+            group['Description'] = self.description
+        if self.role_arn is not None:
+            group['RoleArn'] = self.role_arn
+        if self.precedence is not None:
+            group['Precedence'] = self.precedence
+        return group
+
+
+class FakeCognito(object):
+    """
+    An in-memory user pool with one app client. Use get_client as the
+    client_callback of Cognito, or cognito() to get a Cognito instance wired
+    to it.
+    """
+
+    def __init__(self, user_pool_id='eu-west-2_fakepool',
+                 client_id='fakeclient', client_secret=None, latency=0.0,
+                 token_validity=3600, key_bits=2048, device_tracking=False,
+                 refresh_token_validity=REFRESH_TOKEN_VALIDITY):
+        """
+        :param user_pool_id: id of the fake user pool
+        :param client_id: id of its app client
+        :param client_secret: app client secret; SECRET_HASH is checked when
+        it is set
+        :param latency: seconds every API call sleeps for, to emulate the
+        network
+        :param token_validity: lifetime of issued id and access tokens
+        :param key_bits: size of the RSA signing key
+        :param device_tracking: whether SRP authentications return
+        NewDeviceMetadata, to confirm with ConfirmDevice
+        :param refresh_token_validity: lifetime of issued refresh tokens;
+        load tests logging in many times can lower it to bound memory
+        """
+        self.user_pool_id = user_pool_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.latency = latency
+        self.token_validity = token_validity
+        self.refresh_token_validity = refresh_token_validity
+        self.device_tracking = device_tracking
+        self.region = user_pool_id.split('_')[0]
+        self.pool_name = user_pool_id.split('_')[1]
+        self.issuer = 'https://cognito-idp.{}.amazonaws.com/{}'.format(
+            self.region, user_pool_id)
+        self.kid = uuid.uuid4().hex
+        self.private_key, public_jwk = generate_rsa_key(self.kid, key_bits)
+        self.jwks = {'keys': [public_jwk]}
+        self.users = SortedKeys()
+        self.groups = SortedKeys()
+        # token -> (username, exp)
+        self._access_tokens = {}
+        self._refresh_tokens = {}
+        # heap of (exp, token), to forget the tokens once expired
+        self._expiries = []
+        # SECRET_BLOCK or Session -> challenge state
+        self._sessions = {}
+
+    # Pool management, without latency or authentication
+
+    def add_user(self, username, password=None, attributes=None,
+                 status='CONFIRMED'):
+        """
+        :param username: username
+        :param password: password, None for users who can't log in
+        :param attributes: dictionary of user attributes; sub is generated
+        unless given
+        :param status: UserStatus
+        :return: the FakeUser
+        """
+        self._check_username_free(username, 'AdminCreateUser')
+        attributes = dict(attributes or {})
+        attributes.setdefault('sub', str(uuid.uuid4()))
+        user = self.users[username] = FakeUser(username, password,
+                                               attributes, status)
+        return user
+
+    def add_group(self, group_name, description=None, role_arn=None,
+                  precedence=None):
+        if group_name in self.groups:
+            raise client_error('GroupExistsException',
+                               'A group with the name already exists.',
+                               'CreateGroup')
+        group = self.groups[group_name] = FakeGroup(
+            group_name, description, role_arn, precedence)
+        return group
+
+    def add_user_to_group(self, username, group_name):
+        user = self._user(username, 'AdminAddUserToGroup')
+        group = self._group(group_name, 'AdminAddUserToGroup')
+        group.members[username] = None
+        user.groups.add(group_name)
+
+    def remove_user_from_group(self, username, group_name):
+        user = self._user(username, 'AdminRemoveUserFromGroup')
+        group = self._group(group_name, 'AdminRemoveUserFromGroup')
+        group.members.pop(username, None)
+        user.groups.discard(group_name)
+
+    def last_code(self, username, purpose):
+        """
+        :param purpose: 'sign_up', 'forgot_password' or the name of the
+        attribute being verified
+        :return: the confirmation code last "sent" to the user
+        """
+        return self.users[username].codes.get(purpose)
+
+    def issue_tokens(self, username, refresh=True, issued_at=None):
+        """
+        :param issued_at: auth_time and iat of the tokens, now by default
+        :return: an AuthenticationResult for the user
+        """
+        user = self.users[username]
+        now = int(time.time() if issued_at is None else issued_at)
+        common = {
+            'sub': user.sub,
+            'iss': self.issuer,
+            'auth_time': now,
+            'iat': now,
+            'exp': now + self.token_validity,
+            'origin_jti': str(uuid.uuid4()),
+            'event_id': str(uuid.uuid4()),
+        }
+        if user.groups:
+            common['cognito:groups'] = list(user.groups.sorted_keys)
+        id_claims = cognito_to_dict(user.attribute_list())
+        id_claims.update(common)
+        id_claims.update({'aud': self.client_id, 'token_use': 'id',
+                          'cognito:username': username,
+                          'jti': str(uuid.uuid4())})
+        access_claims = dict(common, client_id=self.client_id,
+                             token_use='access', username=username,
+                             scope='aws.cognito.signin.user.admin',
+                             jti=str(uuid.uuid4()))
+        headers = {'kid': self.kid}
+        access_token = jwt.encode(access_claims, self.private_key, 'RS256',
+                                  headers=headers)
+        self._purge_tokens(time.time())
+        self._access_tokens[access_token] = (username, common['exp'])
+        heapq.heappush(self._expiries, (common['exp'], access_token))
+        user.tokens.add(access_token)
+        result = {
+            'IdToken': jwt.encode(id_claims, self.private_key, 'RS256',
+                                  headers=headers),
+            'AccessToken': access_token,
+            'ExpiresIn': self.token_validity,
+            'TokenType': 'Bearer',
+        }
+        if refresh:
+            refresh_token = base64.b64encode(os.urandom(48)).decode('ascii')
+            expires_at = now + self.refresh_token_validity
+            self._refresh_tokens[refresh_token] = (username, expires_at)
+            heapq.heappush(self._expiries, (expires_at, refresh_token))
+            user.tokens.add(refresh_token)
+            result['RefreshToken'] = refresh_token
+        return result
+
+    def sign_out(self, username):
+        """
+        Revokes every access and refresh token of the user
+        """
+        user = self.users[username]
+        for token in user.tokens:
+            self._access_tokens.pop(token, None)
+            self._refresh_tokens.pop(token, None)
+        user.tokens.clear()
+        # drop the heap entries of signed out tokens once they are most of it
+        live = len(self._access_tokens) + len(self._refresh_tokens)
+        if len(self._expiries) > 2 * live + 1024:
+            self._expiries = [(exp, token) for exp, token in self._expiries
+                              if token in self._access_tokens or
+                              token in self._refresh_tokens]
+            heapq.heapify(self._expiries)
+
+    def _purge_tokens(self, now):
+        expiries = self._expiries
+        while expiries and expiries[0][0] <= now:
+            _, token = heapq.heappop(expiries)
+            entry = self._access_tokens.pop(token, None) or \
+                self._refresh_tokens.pop(token, None)
+            if entry is not None:
+                user = self.users.get(entry[0])
+                if user is not None:
+                    user.tokens.discard(token)
+
+    def get_client(self):
+        """
+        :return: a client for the fake pool, to use as client_callback
+        """
+        return FakeCognitoClient(self)
+
+    def cognito(self, cognito_class=None, **kwargs):
+        """
+        :param cognito_class: class to instantiate, mandate.Cognito by default
+        :param kwargs: other arguments for the Cognito class
+        :return: a Cognito bound to the fake pool, with its JWKS preloaded
+        """
+        if cognito_class is None:
+            from .client import Cognito as cognito_class
+        kwargs.setdefault('client_secret', self.client_secret)
+        kwargs.setdefault('client_callback', self.get_client)
+        cog = cognito_class(self.user_pool_id, self.client_id, **kwargs)
+        cog.pool_jwk = self.jwks
+        return cog
+
+    async def serve_jwks(self, host='127.0.0.1', port=0, latency=0.0):
+        """
+        Serves the JWKS over HTTP
+        :return: (aiohttp AppRunner, URL of the JWKS), to use as the
+        jwks_url of Cognito. Call `await runner.cleanup()` to stop it
+        """
+        from aiohttp import web
+
+        async def handler(request):
+            if latency:
+                await asyncio.sleep(latency)
+            return web.json_response(self.jwks)
+
+        app = web.Application()
+        app.router.add_get(
+            '/{}/.well-known/jwks.json'.format(self.user_pool_id), handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return runner, 'http://{}:{}/{}/.well-known/jwks.json'.format(
+            host, port, self.user_pool_id)
+
+    # Helpers for the client
+
+    def _user(self, username, operation):
+        user = self.users.get(username)
+        if user is None:
+            raise client_error('UserNotFoundException',
+                               'User does not exist.', operation)
+        return user
+
+    def _check_username_free(self, username, operation):
+        if username in self.users:
+            raise client_error('UsernameExistsException',
+                               'User account already exists', operation)
+
+    def _group(self, group_name, operation):
+        group = self.groups.get(group_name)
+        if group is None:
+            raise client_error('ResourceNotFoundException',
+                               'Group not found.', operation)
+        return group
+
+    def _user_for_token(self, access_token, operation):
+        username, exp = self._access_tokens.get(access_token, (None, 0))
+        if username is None or exp < time.time():
+            raise client_error('NotAuthorizedException',
+                               'Invalid Access Token', operation)
+        return self.users[username]
+
+    def _check_pool(self, user_pool_id, operation):
+        if user_pool_id != self.user_pool_id:
+            raise client_error('ResourceNotFoundException',
+                               'User pool {} does not exist.'.format(
+                                   user_pool_id), operation)
+
+    def _check_client(self, client_id, operation, username=None,
+                      secret_hash=None, check_secret=True):
+        if client_id != self.client_id:
+            raise client_error('ResourceNotFoundException',
+                               'User pool client {} does not exist.'.format(
+                                   client_id), operation)
+        if check_secret and self.client_secret is not None and \
+                secret_hash != AWSSRP.get_secret_hash(
+                    username, client_id, self.client_secret):
+            raise client_error('NotAuthorizedException',
+                               'Unable to verify secret hash for client '
+                               '{}'.format(client_id), operation)
+
+    def _new_code(self, user, purpose):
+        code = '{:06d}'.format(random.randrange(10 ** 6))
+        user.codes[purpose] = code
+        return code
+
+    def _check_code(self, user, purpose, code, operation):
+        if code is None or user.codes.get(purpose) != code:
+            raise client_error('CodeMismatchException',
+                               'Invalid verification code provided, please '
+                               'try again.', operation)
+        del user.codes[purpose]
+
+    def _check_password(self, user, password, operation):
+        if user.password is None or user.password != password:
+            raise client_error('NotAuthorizedException',
+                               'Incorrect username or password.', operation)
+        self._check_can_log_in(user, operation)
+
+    def _check_can_log_in(self, user, operation):
+        if not user.enabled:
+            raise client_error('NotAuthorizedException',
+                               'User is disabled.', operation)
+        if user.status == 'UNCONFIRMED':
+            raise client_error('UserNotConfirmedException',
+                               'User is not confirmed.', operation)
+
+    def _authentication_result(self, user, operation, new_device=False):
+        if user.status == 'FORCE_CHANGE_PASSWORD':
+            session = base64.b64encode(os.urandom(48)).decode('ascii')
+            self._sessions[session] = ('NEW_PASSWORD_REQUIRED', user.username)
+            return _response(
+                ChallengeName='NEW_PASSWORD_REQUIRED', Session=session,
+                ChallengeParameters={'USER_ID_FOR_SRP': user.username,
+                                     'requiredAttributes': '[]',
+                                     'userAttributes': '{}'})
+        result = self.issue_tokens(user.username)
+        if new_device and self.device_tracking:
+            device = FakeDevice(
+                '{}_{}'.format(self.region, uuid.uuid4()),
+                '-' + base64.b32encode(os.urandom(5)).decode('ascii'))
+            user.devices[device.key] = device
+            result['NewDeviceMetadata'] = {
+                'DeviceKey': device.key, 'DeviceGroupKey': device.group_key}
+        return _response(ChallengeParameters={},
+                         AuthenticationResult=result)
+
+    def _refresh(self, auth_parameters, operation):
+        username, exp = self._refresh_tokens.get(
+            auth_parameters.get('REFRESH_TOKEN'), (None, 0))
+        if username is None or exp < time.time():
+            raise client_error('NotAuthorizedException',
+                               'Invalid Refresh Token', operation)
+        return _response(ChallengeParameters={},
+                         AuthenticationResult=self.issue_tokens(
+                             username, refresh=False))
+
+    def _srp_challenge(self, challenge, username, verifier, srp_a,
+                       device_key=None):
+        """
+        Server side of the first SRP step
+        :return: (B as hex, SECRET_BLOCK)
+        """
+        small_b = get_random(128) % BIG_N
+        big_b = (K * verifier + pow(G, small_b, BIG_N)) % BIG_N
+        secret_block = base64.standard_b64encode(os.urandom(64)).decode()
+        self._sessions[secret_block] = (challenge, username,
+                                        hex_to_long(srp_a), big_b, small_b,
+                                        device_key)
+        return long_to_hex(big_b), secret_block
+
+    def _check_srp_claim(self, challenge, responses, operation):
+        """
+        Server side of the second SRP step
+        :return: the session of the challenge
+        """
+        secret_block = responses.get('PASSWORD_CLAIM_SECRET_BLOCK')
+        session = self._sessions.pop(secret_block, None)
+        if session is None or session[0] != challenge:
+            raise client_error('NotAuthorizedException', 'Invalid session',
+                               operation)
+        _, username, big_a, big_b, small_b, device_key = session
+        user = self.users[username]
+        if challenge == 'PASSWORD_VERIFIER':
+            _, verifier = user.srp_verifier(self.pool_name)
+            prefix = self.pool_name + username
+        else:
+            device = user.devices[device_key]
+            verifier = device.verifier
+            prefix = device.group_key + device_key
+        u_value = calculate_u(big_a, big_b)
+        s_value = pow(big_a * pow(verifier, u_value, BIG_N), small_b, BIG_N)
+        hkdf = compute_hkdf(bytearray.fromhex(pad_hex(s_value)),
+                            bytearray.fromhex(pad_hex(long_to_hex(u_value))))
+        msg = bytearray(prefix, 'utf-8') + \
+            bytearray(base64.standard_b64decode(secret_block)) + \
+            bytearray(responses['TIMESTAMP'], 'utf-8')
+        expected = base64.standard_b64encode(
+            hmac.new(hkdf, msg, digestmod=hashlib.sha256).digest()).decode()
+        if not hmac.compare_digest(
+                expected, responses.get('PASSWORD_CLAIM_SIGNATURE', '')):
+            raise client_error('NotAuthorizedException',
+                               'Incorrect username or password.', operation)
+        return session
+
+    def _confirmed_device(self, user, device_key):
+        device = user.devices.get(device_key)
+        if device is None or device.verifier is None:
+            return None
+        return device
+
+    def _start_srp(self, auth_parameters, operation):
+        user = self._user(auth_parameters['USERNAME'], operation)
+        self._check_can_log_in(user, operation)
+        salt, verifier = user.srp_verifier(self.pool_name)
+        srp_b, secret_block = self._srp_challenge(
+            'PASSWORD_VERIFIER', user.username, verifier,
+            auth_parameters['SRP_A'], auth_parameters.get('DEVICE_KEY'))
+        return _response(
+            ChallengeName='PASSWORD_VERIFIER',
+            ChallengeParameters={
+                'SALT': salt,
+                'SRP_B': srp_b,
+                'SECRET_BLOCK': secret_block,
+                'USER_ID_FOR_SRP': user.username,
+                'USERNAME': user.username,
+            })
+
+    def _verify_srp(self, responses, operation):
+        session = self._check_srp_claim('PASSWORD_VERIFIER', responses,
+                                        operation)
+        user = self.users[session[1]]
+        device_key = session[5] or responses.get('DEVICE_KEY')
+        if device_key is not None and \
+                self._confirmed_device(user, device_key) is not None:
+            session_id = base64.b64encode(os.urandom(48)).decode('ascii')
+            self._sessions[session_id] = ('DEVICE_SRP_AUTH', user.username,
+                                          device_key)
+            return _response(ChallengeName='DEVICE_SRP_AUTH',
+                             Session=session_id,
+                             ChallengeParameters={'USERNAME': user.username})
+        return self._authentication_result(user, operation, new_device=True)
+
+    def _start_device_srp(self, session_id, responses, operation):
+        session = self._sessions.pop(session_id, None)
+        if session is None or session[0] != 'DEVICE_SRP_AUTH' or \
+                session[2] != responses.get('DEVICE_KEY'):
+            raise client_error('NotAuthorizedException', 'Invalid session',
+                               operation)
+        user = self.users[session[1]]
+        device = self._confirmed_device(user, session[2])
+        if device is None:
+            raise client_error('ResourceNotFoundException',
+                               'Device does not exist.', operation)
+        srp_b, secret_block = self._srp_challenge(
+            'DEVICE_PASSWORD_VERIFIER', user.username, device.verifier,
+            responses['SRP_A'], device.key)
+        return _response(
+            ChallengeName='DEVICE_PASSWORD_VERIFIER',
+            ChallengeParameters={
+                'SALT': device.salt,
+                'SRP_B': srp_b,
+                'SECRET_BLOCK': secret_block,
+                'USERNAME': user.username,
+                'DEVICE_KEY': device.key,
+            })
+
+    def _verify_device_srp(self, responses, operation):
+        session = self._check_srp_claim('DEVICE_PASSWORD_VERIFIER',
+                                        responses, operation)
+        return self._authentication_result(self.users[session[1]],
+                                           operation)
+
+    def _set_new_password(self, session_id, responses, operation):
+        session = self._sessions.pop(session_id, None)
+        if session is None or session[0] != 'NEW_PASSWORD_REQUIRED':
+            raise client_error('NotAuthorizedException', 'Invalid session',
+                               operation)
+        user = self.users[session[1]]
+        user.set_password(responses['NEW_PASSWORD'])
+        user.status = 'CONFIRMED'
+        return self._authentication_result(user, operation)
+
+    def _update_attributes(self, user, attributes):
+        for attribute in attributes:
+            user.attributes[attribute['Name']] = attribute['Value']
+        user.touch()
+
+    def _delete_user(self, user):
+        self.sign_out(user.username)
+        for group_name in list(user.groups):
+            self.groups[group_name].members.pop(user.username, None)
+        del self.users[user.username]
+
+
+class FakeCognitoClient(object):
+    """
+    Implements the subset of the cognito-idp client API mandate uses, and a
+    few more admin calls, on top of a FakeCognito.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def _network(self):
+        if self.backend.latency:
+            await asyncio.sleep(self.backend.latency)
+
+    # Sign up
+
+    async def sign_up(self, ClientId, Username, Password, UserAttributes=(),
+                      SecretHash=None, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_client(ClientId, 'SignUp', Username, SecretHash)
+        backend._check_username_free(Username, 'SignUp')
+        user = backend.add_user(Username, Password,
+                                cognito_to_dict(UserAttributes),
+                                status='UNCONFIRMED')
+        backend._new_code(user, 'sign_up')
+        return _response(UserConfirmed=False, UserSub=user.sub,
+                         CodeDeliveryDetails={
+                             'Destination': user.attributes.get('email'),
+                             'DeliveryMedium': 'EMAIL',
+                             'AttributeName': 'email'})
+
+    async def confirm_sign_up(self, ClientId, Username, ConfirmationCode,
+                              SecretHash=None, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_client(ClientId, 'ConfirmSignUp', Username,
+                              SecretHash)
+        user = backend._user(Username, 'ConfirmSignUp')
+        backend._check_code(user, 'sign_up', ConfirmationCode,
+                            'ConfirmSignUp')
+        user.status = 'CONFIRMED'
+        return _response()
+
+    async def admin_confirm_sign_up(self, UserPoolId, Username, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'AdminConfirmSignUp')
+        backend._user(Username, 'AdminConfirmSignUp').status = 'CONFIRMED'
+        return _response()
+
+    async def admin_create_user(self, UserPoolId, Username,
+                                UserAttributes=(), TemporaryPassword=None,
+                                **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'AdminCreateUser')
+        backend._check_username_free(Username, 'AdminCreateUser')
+        if TemporaryPassword is None:
+            TemporaryPassword = base64.b64encode(os.urandom(12)).decode()
+        user = backend.add_user(Username, TemporaryPassword,
+                                cognito_to_dict(UserAttributes),
+                                status='FORCE_CHANGE_PASSWORD')
+        return _response(User=user.describe())
+
+    # Authentication
+
+    async def initiate_auth(self, AuthFlow, AuthParameters, ClientId,
+                            **kwargs):
+        await self._network()
+        backend = self.backend
+        operation = 'InitiateAuth'
+        username = AuthParameters.get('USERNAME')
+        if AuthFlow in ('REFRESH_TOKEN', 'REFRESH_TOKEN_AUTH'):
+            backend._check_client(ClientId, operation, check_secret=False)
+            return backend._refresh(AuthParameters, operation)
+        backend._check_client(ClientId, operation, username,
+                              AuthParameters.get('SECRET_HASH'))
+        if AuthFlow == 'USER_SRP_AUTH':
+            return backend._start_srp(AuthParameters, operation)
+        if AuthFlow == 'USER_PASSWORD_AUTH':
+            user = backend._user(username, operation)
+            backend._check_password(user, AuthParameters.get('PASSWORD'),
+                                    operation)
+            return backend._authentication_result(user, operation)
+        raise client_error('InvalidParameterException',
+                           'Unsupported auth flow {}'.format(AuthFlow),
+                           operation)
+
+    async def admin_initiate_auth(self, UserPoolId, ClientId, AuthFlow,
+                                  AuthParameters, **kwargs):
+        await self._network()
+        backend = self.backend
+        operation = 'AdminInitiateAuth'
+        backend._check_pool(UserPoolId, operation)
+        if AuthFlow in ('REFRESH_TOKEN', 'REFRESH_TOKEN_AUTH'):
+            backend._check_client(ClientId, operation, check_secret=False)
+            return backend._refresh(AuthParameters, operation)
+        username = AuthParameters.get('USERNAME')
+        backend._check_client(ClientId, operation, username,
+                              AuthParameters.get('SECRET_HASH'))
+        if AuthFlow not in ('ADMIN_NO_SRP_AUTH', 'ADMIN_USER_PASSWORD_AUTH'):
+            raise client_error('InvalidParameterException',
+                               'Unsupported auth flow {}'.format(AuthFlow),
+                               operation)
+        user = backend._user(username, operation)
+        backend._check_password(user, AuthParameters.get('PASSWORD'),
+                                operation)
+        return backend._authentication_result(user, operation)
+
+    async def respond_to_auth_challenge(self, ClientId, ChallengeName,
+                                        ChallengeResponses, Session=None,
+                                        **kwargs):
+        await self._network()
+        backend = self.backend
+        operation = 'RespondToAuthChallenge'
+        backend._check_client(ClientId, operation,
+                              ChallengeResponses.get('USERNAME'),
+                              ChallengeResponses.get('SECRET_HASH'))
+        if ChallengeName == 'PASSWORD_VERIFIER':
+            return backend._verify_srp(ChallengeResponses, operation)
+        if ChallengeName == 'DEVICE_SRP_AUTH':
+            return backend._start_device_srp(Session, ChallengeResponses,
+                                             operation)
+        if ChallengeName == 'DEVICE_PASSWORD_VERIFIER':
+            return backend._verify_device_srp(ChallengeResponses, operation)
+        if ChallengeName == 'NEW_PASSWORD_REQUIRED':
+            return backend._set_new_password(Session, ChallengeResponses,
+                                             operation)
+        raise client_error('InvalidParameterException',
+                           'Unsupported challenge {}'.format(ChallengeName),
+                           operation)
+
+    async def global_sign_out(self, AccessToken, **kwargs):
+        await self._network()
+        backend = self.backend
+        user = backend._user_for_token(AccessToken, 'GlobalSignOut')
+        backend.sign_out(user.username)
+        return _response()
+
+    async def admin_user_global_sign_out(self, UserPoolId, Username,
+                                         **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'AdminUserGlobalSignOut')
+        backend._user(Username, 'AdminUserGlobalSignOut')
+        backend.sign_out(Username)
+        return _response()
+
+    # Devices
+
+    async def confirm_device(self, AccessToken, DeviceKey,
+                             DeviceSecretVerifierConfig, DeviceName=None,
+                             **kwargs):
+        await self._network()
+        backend = self.backend
+        user = backend._user_for_token(AccessToken, 'ConfirmDevice')
+        device = user.devices.get(DeviceKey)
+        if device is None:
+            raise client_error('ResourceNotFoundException',
+                               'Device does not exist.', 'ConfirmDevice')
+        device.name = DeviceName
+        device.salt = base64.standard_b64decode(
+            DeviceSecretVerifierConfig['Salt']).hex()
+        device.verifier = int.from_bytes(base64.standard_b64decode(
+            DeviceSecretVerifierConfig['PasswordVerifier']), 'big')
+        device.remembered = True
+        return _response(UserConfirmationNecessary=False)
+
+    async def update_device_status(self, AccessToken, DeviceKey,
+                                   DeviceRememberedStatus=None, **kwargs):
+        await self._network()
+        backend = self.backend
+        user = backend._user_for_token(AccessToken, 'UpdateDeviceStatus')
+        device = user.devices.get(DeviceKey)
+        if device is None:
+            raise client_error('ResourceNotFoundException',
+                               'Device does not exist.', 'UpdateDeviceStatus')
+        device.remembered = DeviceRememberedStatus == 'remembered'
+        return _response()
+
+    # Passwords
+
+    async def forgot_password(self, ClientId, Username, SecretHash=None,
+                              **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_client(ClientId, 'ForgotPassword', Username,
+                              SecretHash)
+        user = backend._user(Username, 'ForgotPassword')
+        backend._new_code(user, 'forgot_password')
+        return _response(CodeDeliveryDetails={
+            'Destination': user.attributes.get('email'),
+            'DeliveryMedium': 'EMAIL',
+            'AttributeName': 'email'})
+
+    async def confirm_forgot_password(self, ClientId, Username,
+                                      ConfirmationCode, Password,
+                                      SecretHash=None, **kwargs):
+        await self._network()
+        backend = self.backend
+        operation = 'ConfirmForgotPassword'
+        backend._check_client(ClientId, operation, Username, SecretHash)
+        user = backend._user(Username, operation)
+        backend._check_code(user, 'forgot_password', ConfirmationCode,
+                            operation)
+        user.set_password(Password)
+        return _response()
+
+    async def change_password(self, PreviousPassword, ProposedPassword,
+                              AccessToken, **kwargs):
+        await self._network()
+        backend = self.backend
+        user = backend._user_for_token(AccessToken, 'ChangePassword')
+        backend._check_password(user, PreviousPassword, 'ChangePassword')
+        user.set_password(ProposedPassword)
+        return _response()
+
+    # Users
+
+    async def get_user(self, AccessToken, **kwargs):
+        await self._network()
+        user = self.backend._user_for_token(AccessToken, 'GetUser')
+        return _response(Username=user.username,
+                         UserAttributes=user.attribute_list())
+
+    async def admin_get_user(self, UserPoolId, Username, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'AdminGetUser')
+        user = backend._user(Username, 'AdminGetUser')
+        return _response(**user.describe('UserAttributes'))
+
+    async def update_user_attributes(self, UserAttributes, AccessToken,
+                                     **kwargs):
+        await self._network()
+        backend = self.backend
+        user = backend._user_for_token(AccessToken, 'UpdateUserAttributes')
+        backend._update_attributes(user, UserAttributes)
+        return _response(CodeDeliveryDetailsList=[])
+
+    async def admin_update_user_attributes(self, UserPoolId, Username,
+                                           UserAttributes, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'AdminUpdateUserAttributes')
+        user = backend._user(Username, 'AdminUpdateUserAttributes')
+        backend._update_attributes(user, UserAttributes)
+        return _response()
+
+    async def get_user_attribute_verification_code(self, AccessToken,
+                                                   AttributeName, **kwargs):
+        await self._network()
+        backend = self.backend
+        user = backend._user_for_token(
+            AccessToken, 'GetUserAttributeVerificationCode')
+        backend._new_code(user, AttributeName)
+        return _response(CodeDeliveryDetails={
+            'Destination': user.attributes.get(AttributeName),
+            'DeliveryMedium': 'SMS' if AttributeName == 'phone_number'
+            else 'EMAIL',
+            'AttributeName': AttributeName})
+
+    async def verify_user_attribute(self, AccessToken, AttributeName, Code,
+                                    **kwargs):
+        await self._network()
+        backend = self.backend
+        user = backend._user_for_token(AccessToken, 'VerifyUserAttribute')
+        backend._check_code(user, AttributeName, Code, 'VerifyUserAttribute')
+        user.attributes['{}_verified'.format(AttributeName)] = 'true'
+        user.touch()
+        return _response()
+
+    async def delete_user(self, AccessToken, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._delete_user(backend._user_for_token(AccessToken,
+                                                     'DeleteUser'))
+        return _response()
+
+    async def admin_delete_user(self, UserPoolId, Username, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'AdminDeleteUser')
+        backend._delete_user(backend._user(Username, 'AdminDeleteUser'))
+        return _response()
+
+    async def admin_disable_user(self, UserPoolId, Username, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'AdminDisableUser')
+        user = backend._user(Username, 'AdminDisableUser')
+        user.enabled = False
+        backend.sign_out(Username)
+        user.touch()
+        return _response()
+
+    async def admin_enable_user(self, UserPoolId, Username, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'AdminEnableUser')
+        user = backend._user(Username, 'AdminEnableUser')
+        user.enabled = True
+        user.touch()
+        return _response()
+
+    async def list_users(self, UserPoolId, Limit=None, PaginationToken=None,
+                         Filter=None, AttributesToGet=None, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'ListUsers')
+        users = backend.users
+        accept = None
+        if Filter:
+            name, operator, value = parse_filter(Filter)
+
+            def matches(username):
+                found = users[username].filter_value(name)
+                if operator == '=':
+                    return found == value
+                return (found or '').startswith(value)
+            accept = matches
+        page, extra = _paginate(users.sorted_keys, Limit, PaginationToken,
+                                'PaginationToken', accept)
+        described = [users[username].describe() for username in page]
+        if AttributesToGet is not None:
+            for user in described:
+                user['Attributes'] = [
+                    attribute for attribute in user['Attributes']
+                    if attribute['Name'] in AttributesToGet]
+        return _response(Users=described, **extra)
+
+    # Groups
+
+    async def create_group(self, GroupName, UserPoolId, Description=None,
+                           RoleArn=None, Precedence=None, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'CreateGroup')
+        group = backend.add_group(GroupName, Description, RoleArn,
+                                  Precedence)
+        return _response(Group=group.describe(UserPoolId))
+
+    async def delete_group(self, GroupName, UserPoolId, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'DeleteGroup')
+        group = backend._group(GroupName, 'DeleteGroup')
+        for username in group.members:
+            backend.users[username].groups.discard(GroupName)
+        del backend.groups[GroupName]
+        return _response()
+
+    async def get_group(self, GroupName, UserPoolId, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'GetGroup')
+        group = backend._group(GroupName, 'GetGroup')
+        return _response(Group=group.describe(UserPoolId))
+
+    async def list_groups(self, UserPoolId, Limit=None, NextToken=None,
+                          **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'ListGroups')
+        page, extra = _paginate(backend.groups.sorted_keys, Limit,
+                                NextToken, 'NextToken')
+        return _response(Groups=[backend.groups[name].describe(UserPoolId)
+                                 for name in page], **extra)
+
+    async def admin_add_user_to_group(self, UserPoolId, Username, GroupName,
+                                      **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'AdminAddUserToGroup')
+        backend.add_user_to_group(Username, GroupName)
+        return _response()
+
+    async def admin_remove_user_from_group(self, UserPoolId, Username,
+                                           GroupName, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'AdminRemoveUserFromGroup')
+        backend.remove_user_from_group(Username, GroupName)
+        return _response()
+
+    async def list_users_in_group(self, UserPoolId, GroupName, Limit=None,
+                                  NextToken=None, **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'ListUsersInGroup')
+        group = backend._group(GroupName, 'ListUsersInGroup')
+        page, extra = _paginate(group.members.sorted_keys, Limit, NextToken,
+                                'NextToken')
+        return _response(Users=[backend.users[username].describe()
+                                for username in page], **extra)
+
+    async def admin_list_groups_for_user(self, Username, UserPoolId,
+                                         Limit=None, NextToken=None,
+                                         **kwargs):
+        await self._network()
+        backend = self.backend
+        backend._check_pool(UserPoolId, 'AdminListGroupsForUser')
+        user = backend._user(Username, 'AdminListGroupsForUser')
+        page, extra = _paginate(user.groups.sorted_keys, Limit, NextToken,
+                                'NextToken')
+        return _response(Groups=[backend.groups[name].describe(UserPoolId)
+                                 for name in page], **extra)
@@ -20,6 +20,8 @@ class UserObj(object):
         self.phone_number_verified = self._data.pop(
             'phone_number_verified', None)
         self._metadata = {} if metadata is None else metadata
+        # names of the attributes changed since the last save
+        self._dirty = set()
 
     def __repr__(self):
         return '<{class_name}: {uni}>'.format(
@@ -35,19 +37,51 @@ class UserObj(object):
             return self._metadata.get(name)
 
     def __setattr__(self, name, value):
-        if name in list(self.__dict__.get('_data', {}).keys()):
-            self._data[name] = value
+        if name in self.__dict__.get('_data', ()):
+            if self._data[name] != value:
+                self._data[name] = value
+                self._dirty.add(name)
         else:
             super(UserObj, self).__setattr__(name, value)
 
-    def save(self, admin=False):
-        if admin:
-            self._cognito.admin_update_profile(self._data, self._attr_map)
+    def changed_attributes(self):
+        """
+        :return: dictionary of the attributes changed since the object was
+        created or last saved
+        """
+        return {name: self._data[name] for name in self._dirty}
+
+    def mark_saved(self, attrs=None):
+        """
+        :param attrs: dictionary of the attributes written, as returned by
+        changed_attributes; those changed again since stay changed. Every
+        attribute if None.
+        """
+        if attrs is None:
+            self._dirty.clear()
             return
-        self._cognito.update_profile(self._data, self._attr_map)
+        for name, value in attrs.items():
+            if self._data.get(name) == value:
+                self._dirty.discard(name)
+
+    async def save(self, admin=False):
+        """
+        Sends the changed attributes, if any, to Cognito
+        :param admin: whether to use admin_update_profile rather than the
+        user's access token
+        """
+        attrs = self.changed_attributes()
+        if not attrs:
+            return
+        if admin:
+            await self._cognito.admin_update_profile(
+                self.username, dict(attrs), self._attr_map)
+        else:
+            await self._cognito.update_profile(dict(attrs), self._attr_map)
+        self.mark_saved(attrs)
 
-    def delete(self, admin=False):
+    async def delete(self, admin=False):
         if admin:
-            self._cognito.admin_delete_user()
+            await self._cognito.admin_delete_user(self.username)
             return
-        self._cognito.delete_user()
+        await self._cognito.delete_user()
@@ -1,4 +1,7 @@
 import ast
+import asyncio
+import inspect
+import time
 
 
 def cognito_to_dict(attr_list, attr_map=None):
@@ -28,3 +31,98 @@ def dict_to_cognito(attributes, attr_map=None):
             attributes[k] = attributes.pop(v)
 
     return [{'Name': key, 'Value': value} for key, value in attributes.items()]
+
+
+class ClientProxy(object):
+    """
+    Wraps the client returned by Cognito.get_client (the async context
+    manager aioboto3 returns, or whatever a client_callback returns) and
+    sends every API call through _call, so subclasses can time, record or
+    guard the calls without knowing about the underlying client.
+    """
+
+    def __init__(self, client):
+        self._client_context = client
+        self._client = None
+
+    async def __aenter__(self):
+        self._client = await self._client_context.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return await self._client_context.__aexit__(
+            exc_type, exc_val, exc_tb)
+
+    def __getattr__(self, name):
+        client = self.__dict__.get('_client')
+        if client is None:
+            client = self.__dict__['_client_context']
+        method = getattr(client, name)
+        if not inspect.iscoroutinefunction(method):
+            return method
+
+        async def call(*args, **kwargs):
+            return await self._call(name, method, args, kwargs)
+        return call
+
+    async def _call(self, operation, method, args, kwargs):
+        return await method(*args, **kwargs)
+
+
+class KeptClient(object):
+    """
+    Async context manager that opens a client on first use and keeps it open
+    across `async with` blocks, so its connection pool is reused, until
+    close() is called.
+    """
+
+    def __init__(self, factory):
+        """
+        :param factory: callable returning the client context manager, e.g.
+        the aioboto3 client
+        """
+        self._factory = factory
+        self._context = None
+        self._client = None
+        self._lock = None
+
+    async def __aenter__(self):
+        if self._client is None:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self._client is None:
+                    context = self._factory()
+                    self._client = await context.__aenter__()
+                    self._context = context
+        return self._client
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def close(self):
+        context = self._context
+        self._context = self._client = None
+        if context is not None:
+            await context.__aexit__(None, None, None)
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls to at most `rate` per second, shared by any number of
+    coroutines: each wait() returns at the next free slot.
+    """
+
+    def __init__(self, rate):
+        """
+        :param rate: calls per second
+        """
+        self.interval = 1.0 / rate
+        self._next = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
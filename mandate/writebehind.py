@@ -0,0 +1,144 @@
+"""
+Write-behind buffer for profile updates.
+
+Attribute changes sent to a ProfileWriteBuffer are held for `delay` seconds
+from the first change to a user, merged with any other change to the same
+user in that window, then written with one admin_update_user_attributes
+call. Writes to the same user stay in order. Writes that fail are raised by
+the next flush() or close(), as a ProfileWriteException holding the
+attributes that weren't written.
+
+    buffer = ProfileWriteBuffer(cog, delay=1.0)
+    buffer.update('bob', {'custom:score': '10'})
+    buffer.update('bob', {'custom:level': '2'})  # same call as the first
+    await buffer.save(user)  # a UserObj's changed attributes
+    ...
+    await buffer.close()  # writes what is still pending
+"""
+import asyncio
+
+from .exceptions import ProfileWriteException
+from .utils import dict_to_cognito
+
+
+class ProfileWriteBuffer(object):
+    """
+    Coalesces the profile updates of each user into one admin call per
+    `delay` seconds
+    """
+
+    def __init__(self, cognito, delay=0.5):
+        """
+        :param cognito: Cognito with admin rights on the user pool
+        :param delay: seconds changes to a user wait for others to merge with
+        """
+        self.cognito = cognito
+        self.delay = delay
+        # username -> [attributes, future, timer handle]
+        self._pending = {}
+        # username -> task writing its attributes
+        self._writing = {}
+        # (username, attributes, error) of the writes failed since the last
+        # flush
+        self._failures = []
+        self._closed = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    def update(self, username, attrs, attr_map=None):
+        """
+        Queues attribute changes of a user
+        :param username: User's username
+        :param attrs: Dictionary of attribute name, values
+        :param attr_map: Dictionary map from Cognito attributes to attribute
+        names we would like to show to our users
+        :return: future resolved once the changes are written, or failed
+        with the error of the call; awaiting it is optional, failures are
+        raised by flush() too
+        """
+        if self._closed:
+            raise RuntimeError('The buffer is closed')
+        changes = {attribute['Name']: attribute['Value']
+                   for attribute in dict_to_cognito(dict(attrs), attr_map)}
+        entry = self._pending.get(username)
+        if entry is None:
+            loop = asyncio.get_event_loop()
+            future = loop.create_future()
+            # flush() reports the failure if the caller doesn't
+            future.add_done_callback(
+                lambda f: f.cancelled() or f.exception())
+            entry = self._pending[username] = [
+                {}, future,
+                loop.call_later(self.delay, self._write, username)]
+        entry[0].update(changes)
+        return entry[1]
+
+    def save(self, user):
+        """
+        Queues the changed attributes of a user object, if any. They are
+        marked saved once written; until then, and if the write fails, the
+        user keeps them as changed.
+        :param user: UserObj
+        :return: future resolved once they are written
+        """
+        attrs = user.changed_attributes()
+        future = self.update(user.username, attrs, user._attr_map)
+        future.add_done_callback(
+            lambda f: f.cancelled() or f.exception() or user.mark_saved(attrs))
+        return future
+
+    def _write(self, username):
+        entry = self._pending.pop(username, None)
+        if entry is None:
+            return None
+        attrs, future, handle = entry
+        handle.cancel()
+        task = asyncio.ensure_future(
+            self._send(username, attrs, future, self._writing.get(username)))
+        self._writing[username] = task
+        task.add_done_callback(
+            lambda _: self._writing.pop(username, None)
+            if self._writing.get(username) is task else None)
+        return task
+
+    async def _send(self, username, attrs, future, previous):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self.cognito.admin_update_profile(username, attrs)
+        except Exception as e:
+            self._failures.append((username, attrs, e))
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(None)
+
+    async def flush(self):
+        """
+        Writes every pending change now and waits for all the writes
+        :raises ProfileWriteException: if writes failed since the last flush
+        """
+        for username in list(self._pending):
+            self._write(username)
+        tasks = list(self._writing.values())
+        if tasks:
+            await asyncio.wait(tasks)
+        if self._failures:
+            failures, self._failures = self._failures, []
+            raise ProfileWriteException(failures)
+
+    async def close(self):
+        """
+        Flushes the buffer; later updates are refused
+        :raises ProfileWriteException: if writes failed since the last flush
+        """
+        self._closed = True
+        await self.flush()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
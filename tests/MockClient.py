@@ -1,8 +1,11 @@
 class MockClient:
 
-    def __init__(self, *, mock_register=None, mock_get_group=None):
+    def __init__(self, *, mock_register=None, mock_get_group=None,
+                 mock_list_groups=None, mock_list_users=None):
         self.mock_register = mock_register
         self.mock_get_group = mock_get_group
+        self.mock_list_groups = mock_list_groups
+        self.mock_list_users = mock_list_users
 
     async def sign_up(self, *args, **kwargs):
         return await self.mock_register(*args, **kwargs)
@@ -10,6 +13,12 @@ class MockClient:
     async def get_group(self, *args, **kwargs):
         return await self.mock_get_group(*args, **kwargs)
 
+    async def list_groups(self, *args, **kwargs):
+        return await self.mock_list_groups(*args, **kwargs)
+
+    async def list_users(self, *args, **kwargs):
+        return await self.mock_list_users(*args, **kwargs)
+
     async def __aenter__(self):
         return self
 
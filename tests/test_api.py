@@ -1,3 +1,5 @@
+import time
+
 import asynctest
 
 from tests.MockClient import MockClient
@@ -40,3 +42,47 @@ class testApi(asynctest.TestCase):
                 }
             ]
         )
+
+
+class testWarmup(asynctest.TestCase):
+
+    async def test_warmup(self):
+        from mandate.crypto import default_backend
+        from mandate.metrics import Metrics
+        from mandate.testing import FakeCognito
+
+        fake = FakeCognito(key_bits=1024, latency=0.05)
+        runner, url = await fake.serve_jwks(latency=0.1)
+        self.addCleanup(runner.cleanup)
+        created = []
+
+        def client_callback():
+            created.append(None)
+            return fake.get_client()
+
+        metrics = Metrics()
+        cog = Cognito(fake.user_pool_id, fake.client_id, jwks_url=url,
+                      client_callback=client_callback, keep_client=True,
+                      metrics=metrics)
+        start = time.perf_counter()
+        timings = await cog.warmup()
+        elapsed = time.perf_counter() - start
+        self.assertEqual(sorted(timings),
+                         ['client', 'connect', 'jwks', 'keys', 'srp'])
+        self.assertGreaterEqual(timings['jwks'], 0.1)
+        self.assertGreaterEqual(timings['connect'], 0.05)
+        # concurrently
+        self.assertLess(elapsed, timings['jwks'] + timings['connect'])
+        self.assertEqual(cog.pool_jwk, fake.jwks)
+        backend = default_backend()
+        if hasattr(backend, 'load_key'):
+            self.assertTrue(backend._keys)
+        self.assertIn(('warmup', 'jwks'), metrics.histograms)
+        self.assertIn(('warmup', 'client'), metrics.histograms)
+
+        # the kept client is reused
+        fake.add_user('bob')
+        cog.username = 'bob'
+        await cog.admin_get_user()
+        self.assertEqual(len(created), 1)
+        await cog.close()
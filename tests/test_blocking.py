@@ -0,0 +1,62 @@
+import concurrent.futures
+import threading
+import unittest
+
+from mandate.blocking import BackgroundLoop, SyncCognito
+from mandate.testing import FakeCognito
+
+
+class testSyncCognito(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCognito(key_bits=1024)
+        cls.fake.add_user('bob', 'Passw0rd!', {'email': 'bob@example.com'})
+        cls.fake.add_user('alice', 'S3cret!')
+
+    def setUp(self):
+        self.loop = BackgroundLoop()
+        self.clients = []
+
+        def client_callback():
+            self.clients.append(threading.current_thread())
+            return self.fake.get_client()
+
+        self.cog = SyncCognito(
+            self.fake.cognito(username='bob', keep_client=True,
+                              client_callback=client_callback),
+            timeout=5, loop=self.loop)
+
+    def tearDown(self):
+        self.cog.close()
+        self.loop.close()
+
+    def test_calls(self):
+        self.cog.admin_authenticate('Passw0rd!')
+        self.assertEqual(self.cog.get_user().email, 'bob@example.com')
+        self.assertEqual(sorted(user.username
+                                for user in self.cog.iter_users()),
+                         ['alice', 'bob'])
+        self.assertEqual(self.cog.user_pool_id, self.fake.user_pool_id)
+
+        # one client, opened on the background loop and kept open
+        self.assertEqual(len(self.clients), 1)
+        self.assertIsNot(self.clients[0], threading.current_thread())
+
+    def test_threads(self):
+        self.cog.admin_authenticate('Passw0rd!')
+        token = self.cog.access_token
+
+        def verify(_):
+            return self.cog.verify_token(token, 'access_token',
+                                         'access')['username']
+
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            usernames = list(executor.map(verify, range(32)))
+        self.assertEqual(usernames, ['bob'] * 32)
+
+    def test_timeout(self):
+        self.fake.latency = 0.5
+        self.addCleanup(setattr, self.fake, 'latency', 0.0)
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            self.cog.admin_authenticate('Passw0rd!', timeout=0.05)
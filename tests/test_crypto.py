@@ -0,0 +1,136 @@
+import time
+import unittest
+
+import asynctest
+from jose import jwt
+
+from mandate import Cognito
+from mandate.crypto import BACKENDS, get_backend, precheck
+from mandate.exceptions import TokenVerificationException
+from mandate.metrics import Metrics
+from mandate.testing import FakeCognito
+
+
+def available_backends():
+    backends = []
+    for name in BACKENDS:
+        try:
+            backends.append(get_backend(name))
+        except ImportError:
+            pass
+    return backends
+
+
+class testCrypto(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCognito(key_bits=1024)
+        cls.key = cls.fake.jwks['keys'][0]
+
+    def sign(self, **claims):
+        now = int(time.time())
+        payload = {'iss': self.fake.issuer, 'aud': self.fake.client_id,
+                   'iat': now, 'exp': now + 60, 'token_use': 'id'}
+        payload.update(claims)
+        return jwt.encode(payload, self.fake.private_key, 'RS256',
+                          headers={'kid': self.fake.kid})
+
+    def assertRejected(self, backend, token, **kwargs):
+        kwargs.setdefault('audience', self.fake.client_id)
+        kwargs.setdefault('issuer', self.fake.issuer)
+        with self.assertRaises(TokenVerificationException,
+                               msg=backend.name):
+            backend.verify(token, self.key, **kwargs)
+
+    def test_valid_token(self):
+        token = self.sign(sub='bob')
+        for backend in available_backends():
+            claims = backend.verify(token, self.key,
+                                    audience=self.fake.client_id,
+                                    issuer=self.fake.issuer)
+            self.assertEqual(claims['sub'], 'bob', backend.name)
+
+    def test_claims_checks(self):
+        for backend in available_backends():
+            self.assertRejected(backend, self.sign(exp=int(time.time()) - 5))
+            self.assertRejected(backend,
+                                self.sign(nbf=int(time.time()) + 300))
+            self.assertRejected(backend, self.sign(aud='someone-else'))
+            self.assertRejected(backend, self.sign(iss='https://evil'))
+            self.assertRejected(backend, self.sign(), audience=None)
+
+    def test_bad_signature(self):
+        header, claims, signature = self.sign().split('.')
+        other_claims = self.sign(sub='mallory').split('.')[1]
+        for backend in available_backends():
+            self.assertRejected(backend,
+                                '.'.join([header, other_claims, signature]))
+            self.assertRejected(backend, 'not a token')
+            self.assertRejected(
+                backend, jwt.encode({'sub': 'x'}, 'secret', 'HS256'))
+
+    def test_default_backend_prefers_cryptography(self):
+        try:
+            import cryptography  # noqa
+        except ImportError:
+            self.assertEqual(get_backend().name, 'jose')
+        else:
+            self.assertEqual(get_backend().name, 'cryptography')
+
+
+class testPrecheck(asynctest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCognito(key_bits=1024)
+        cls.fake.add_user('bob', 'Passw0rd!')
+        cls.other = FakeCognito('eu-west-2_other', key_bits=1024)
+        cls.other.add_user('bob', 'Passw0rd!')
+
+    def test_precheck(self):
+        header = {'alg': 'RS256', 'kid': 'k'}
+        claims = {'iss': 'iss', 'aud': 'a', 'token_use': 'id',
+                  'exp': time.time() + 60}
+        self.assertIsNone(precheck(header, claims, 'iss', ['a'], 'id'))
+        self.assertEqual(precheck({'alg': 'HS256'}, claims), 'alg')
+        self.assertEqual(precheck(header, claims, issuer='other'), 'issuer')
+        self.assertEqual(precheck(header, claims, token_use='access'),
+                         'token_use')
+        self.assertEqual(precheck(header, claims, client_ids=['b']),
+                         'audience')
+        self.assertEqual(precheck(header, dict(claims, exp=1)), 'expired')
+        self.assertEqual(precheck(header, dict(claims, exp='never')),
+                         'malformed')
+
+    async def test_rejected_before_key_lookup(self):
+        metrics = Metrics()
+        cog = self.fake.cognito(metrics=metrics)
+
+        async def get_keys():
+            raise AssertionError('keys looked up')
+
+        cog.get_keys = get_keys
+        expired = jwt.encode(
+            dict(jwt.get_unverified_claims(
+                self.fake.issue_tokens('bob')['IdToken']), exp=1),
+            self.fake.private_key, 'RS256', headers={'kid': self.fake.kid})
+        rejected = [
+            ('malformed', 'not.a.token'),
+            ('issuer', self.other.issue_tokens('bob')['IdToken']),
+            ('token_use', self.fake.issue_tokens('bob')['AccessToken']),
+            ('expired', expired),
+        ]
+        for reason, token in rejected:
+            with self.assertRaises(TokenVerificationException, msg=reason):
+                await cog.verify_token(token, 'id_token', 'id')
+            self.assertEqual(metrics.counters[('rejections', reason)], 1)
+
+        other_client = Cognito(self.fake.user_pool_id, 'other',
+                               metrics=metrics)
+        with self.assertRaises(TokenVerificationException):
+            await other_client.verify_token(
+                self.fake.issue_tokens('bob')['AccessToken'],
+                'access_token', 'access')
+        self.assertEqual(metrics.counters[('rejections', 'audience')], 1)
+        self.assertNotIn(('verify_token', 'verify'), metrics.histograms)
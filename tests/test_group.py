@@ -39,3 +39,68 @@ class testGroup(asynctest.TestCase):
         self.assertEqual(group.last_modified_date, '1970-01-02')
         self.assertEqual(group.role_arn, 'Arn::eatcake')
         self.assertEqual(group.precedence, 'testing')
+
+    async def test_group_obj_keeps_input(self):
+        group_data = {'GroupName': 'Test', 'Precedence': 1, 'Extra': 'x'}
+        cog = Cognito('user_pool_id', 'client_id',
+                      user_pool_region='eu-west-2')
+
+        group = cog.get_group_obj(group_data)
+
+        self.assertEqual(group.group_name, 'Test')
+        self.assertEqual(group.precedence, 1)
+        self.assertEqual(
+            group_data, {'GroupName': 'Test', 'Precedence': 1, 'Extra': 'x'})
+        self.assertFalse(hasattr(group, '__dict__'))
+
+    async def test_get_group_index(self):
+        pages = {
+            None: {
+                'Groups': [
+                    {'GroupName': 'users', 'Precedence': 10,
+                     'RoleArn': 'arn:users'},
+                    {'GroupName': 'nobody'},
+                ],
+                'NextToken': 'page2',
+            },
+            'page2': {
+                'Groups': [
+                    {'GroupName': 'admins', 'Precedence': 1,
+                     'RoleArn': 'arn:admins'},
+                    {'GroupName': 'staff', 'Precedence': 5,
+                     'RoleArn': 'arn:users'},
+                ],
+            },
+        }
+
+        async def _fake_list_groups(UserPoolId=None, NextToken=None):
+            return pages[NextToken]
+
+        mock_client = MockClient(mock_list_groups=_fake_list_groups)
+        cog = Cognito(
+            'user_pool_id',
+            'client_id',
+            user_pool_region='eu-west-2',
+            client_callback=lambda: mock_client
+        )
+
+        index = await cog.get_group_index()
+
+        self.assertEqual(len(index), 4)
+        self.assertIn('admins', index)
+        self.assertEqual(index['staff'].precedence, 5)
+        self.assertEqual([g.group_name for g in index],
+                         ['admins', 'staff', 'users', 'nobody'])
+        self.assertEqual(
+            [g.group_name for g in index.by_role_arn('arn:users')],
+            ['staff', 'users'])
+        self.assertEqual(
+            index.effective_role_arn(['users', 'staff', 'unknown']),
+            'arn:users')
+        self.assertEqual(index.effective_group(['nobody', 'admins'])
+                         .group_name, 'admins')
+
+        index.remove('admins')
+        self.assertIsNone(index.get('admins'))
+        self.assertEqual(index.by_role_arn('arn:admins'), [])
+        self.assertEqual(index.by_precedence()[0].group_name, 'staff')
@@ -0,0 +1,41 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+from mandate.testing import FakeCognito
+
+VERIFY_ONLY = '''
+import asyncio, json, os, sys
+import mandate
+
+assert 'aioboto3' not in sys.modules, 'import mandate loaded aioboto3'
+
+cog = mandate.Cognito(os.environ['POOL_ID'], os.environ['CLIENT_ID'])
+cog.pool_jwk = json.loads(os.environ['JWKS'])
+asyncio.get_event_loop().run_until_complete(
+    cog.verify_token(os.environ['TOKEN'], 'id_token', 'id'))
+
+heavy = [name for name in ('aioboto3', 'aiobotocore', 'botocore', 'aiohttp')
+         if name in sys.modules]
+assert not heavy, 'verifying a token loaded {}'.format(heavy)
+'''
+
+
+class testImports(unittest.TestCase):
+
+    def test_verify_only_path_does_not_load_boto(self):
+        fake = FakeCognito(key_bits=1024)
+        fake.add_user('bob', 'Passw0rd!')
+        env = dict(os.environ,
+                   POOL_ID=fake.user_pool_id,
+                   CLIENT_ID=fake.client_id,
+                   JWKS=json.dumps(fake.jwks),
+                   TOKEN=fake.issue_tokens('bob')['IdToken'])
+
+        result = subprocess.run([sys.executable, '-c', VERIFY_ONLY], env=env,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+
+        self.assertEqual(result.returncode, 0, result.stderr.decode())
@@ -0,0 +1,100 @@
+import unittest
+
+import asynctest
+
+from mandate.membership import MembershipIndex
+from mandate.testing import FakeCognito
+
+
+class testMembershipIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = MembershipIndex()
+        for username, groups in [('alice', ['staff', 'eu']),
+                                 ('bob', ['staff', 'eu', 'contractors']),
+                                 ('carol', ['staff', 'us']),
+                                 ('dave', ['eu'])]:
+            for group_name in groups:
+                self.index.add(username, group_name)
+
+    def test_queries(self):
+        index = self.index
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.groups_of('bob'),
+                         ['contractors', 'eu', 'staff'])
+        self.assertEqual(index.groups_of('nobody'), [])
+        self.assertEqual(sorted(index.users_in('staff')),
+                         ['alice', 'bob', 'carol'])
+        self.assertEqual(index.query(all_of=['staff', 'eu'],
+                                     none_of=['contractors']), ['alice'])
+        self.assertEqual(sorted(index.query(any_of=['us', 'contractors'])),
+                         ['bob', 'carol'])
+        self.assertEqual(sorted(index.query(none_of=['staff'])), ['dave'])
+        self.assertEqual(index.query(all_of=['unknown']), [])
+        self.assertEqual(index.count(all_of=['eu']), 3)
+        self.assertTrue(index.is_member('carol', 'us'))
+        self.assertFalse(index.is_member('carol', 'eu'))
+
+    def test_updates(self):
+        index = self.index
+        index.remove('dave', 'eu')
+        self.assertNotIn('dave', index)
+        self.assertEqual(sorted(index.users_in('eu')), ['alice', 'bob'])
+        # the id is reused
+        index.add('erin', 'us')
+        self.assertEqual(len(index._usernames), 4)
+        self.assertEqual(sorted(index.users_in('us')), ['carol', 'erin'])
+
+        index.remove_user('bob')
+        self.assertEqual(index.users_in('contractors'), [])
+        self.assertEqual(sorted(index.users_in('staff')), ['alice', 'carol'])
+
+        index.remove_group('us')
+        self.assertNotIn('erin', index)
+        self.assertEqual(index.groups_of('carol'), ['staff'])
+        self.assertEqual(index.group_names(), ['contractors', 'eu', 'staff'])
+        index.add('frank', 'admins')
+        self.assertEqual(index.users_in('admins'), ['frank'])
+        self.assertEqual(len(index._group_names), 4)
+
+    def test_many_users(self):
+        index = MembershipIndex()
+        for i in range(10000):
+            username = 'user{}'.format(i)
+            index.add(username, 'even' if i % 2 == 0 else 'odd')
+            if i % 3 == 0:
+                index.add(username, 'three')
+        self.assertEqual(index.count(all_of=['even', 'three']), 1667)
+        self.assertEqual(index.query(all_of=['odd', 'three'])[:2],
+                         ['user3', 'user9'])
+        self.assertEqual(len(index._members[index._group_ids['even']]),
+                         10000 // 8)
+
+
+class testMembershipIndexCognito(asynctest.TestCase):
+
+    async def test_build_and_update(self):
+        fake = FakeCognito(key_bits=1024)
+        fake.add_group('staff')
+        fake.add_group('admins')
+        fake.add_group('empty')
+        for i in range(130):
+            username = 'user{}'.format(i)
+            fake.add_user(username)
+            fake.add_user_to_group(username, 'staff')
+        fake.add_user_to_group('user7', 'admins')
+
+        cog = fake.cognito()
+        index = await cog.get_membership_index(page_size=50)
+        self.assertEqual(len(index), 130)
+        self.assertEqual(index.group_names(), ['admins', 'empty', 'staff'])
+        self.assertEqual(index.query(all_of=['admins']), ['user7'])
+
+        cog.membership_index = index
+        await cog.admin_add_user_to_group('user8', 'admins')
+        await cog.admin_remove_user_from_group('user7', 'staff')
+        self.assertEqual(index.groups_of('user7'), ['admins'])
+        self.assertEqual(index.count(all_of=['staff', 'admins']), 1)
+        await cog.admin_delete_user('user8')
+        self.assertNotIn('user8', index)
+        self.assertEqual(set(fake.groups['admins'].members), {'user7'})
@@ -0,0 +1,99 @@
+import asynctest
+
+from mandate import Cognito
+from mandate.metrics import Histogram, Metrics
+from tests.MockClient import MockClient
+
+
+class ThrottledError(Exception):
+    def __init__(self):
+        self.response = {
+            'Error': {'Code': 'TooManyRequestsException'},
+            'ResponseMetadata': {'RetryAttempts': 2},
+        }
+
+
+class testMetrics(asynctest.TestCase):
+
+    def get_cognito(self, metrics, **kwargs):
+        mock_client = MockClient(**kwargs)
+        return Cognito(
+            'user_pool_id',
+            'client_id',
+            user_pool_region='eu-west-2',
+            client_callback=lambda: mock_client,
+            metrics=metrics
+        )
+
+    async def test_operations_are_timed(self):
+        async def _fake_get_group(GroupName=None, UserPoolId=None):
+            return {
+                'Group': {'GroupName': GroupName},
+                'ResponseMetadata': {'RetryAttempts': 1},
+            }
+
+        events = []
+        metrics = Metrics()
+        metrics.add_hook(lambda *event: events.append(event[:3]))
+        cog = self.get_cognito(metrics, mock_get_group=_fake_get_group)
+
+        await cog.get_group('Test')
+
+        self.assertEqual(
+            set(metrics.histograms),
+            {('get_group', 'total'), ('get_group', 'request'),
+             ('get_client', 'client')})
+        self.assertEqual(metrics.histograms[('get_group', 'total')].count, 1)
+        self.assertEqual(metrics.counters, {('retries', 'get_group'): 1})
+        self.assertIn(('timing', 'get_group', 'request'), events)
+        self.assertIn(('counter', 'get_group', 'retries'), events)
+
+    async def test_throttles_are_counted(self):
+        async def _fake_get_group(GroupName=None, UserPoolId=None):
+            raise ThrottledError()
+
+        metrics = Metrics()
+        cog = self.get_cognito(metrics, mock_get_group=_fake_get_group)
+
+        with self.assertRaises(ThrottledError):
+            await cog.get_group('Test')
+
+        self.assertEqual(metrics.counters[('throttles', 'get_group')], 1)
+        self.assertEqual(metrics.counters[('retries', 'get_group')], 2)
+        self.assertEqual(metrics.counters[('errors', 'get_group')], 1)
+
+    async def test_jwks_cache_hits(self):
+        metrics = Metrics()
+        cog = self.get_cognito(metrics)
+        cog.pool_jwk = {'keys': []}
+
+        await cog.get_keys()
+
+        self.assertEqual(metrics.counters, {('cache_hits', 'get_keys'): 1})
+
+    def test_prometheus_export(self):
+        metrics = Metrics(buckets=(0.1, 1.0))
+        metrics.observe('get_user', 'request', 0.5)
+        metrics.incr('throttles', 'get_user')
+
+        text = metrics.to_prometheus()
+
+        self.assertIn(
+            'mandate_duration_seconds_bucket{operation="get_user",'
+            'phase="request",le="0.1"} 0', text)
+        self.assertIn(
+            'mandate_duration_seconds_bucket{operation="get_user",'
+            'phase="request",le="1.0"} 1', text)
+        self.assertIn(
+            'mandate_duration_seconds_count{operation="get_user",'
+            'phase="request"} 1', text)
+        self.assertIn('mandate_throttles_total{operation="get_user"} 1', text)
+
+    def test_histogram_quantile(self):
+        histogram = Histogram(buckets=(0.01, 0.1, 1.0))
+        for value in [0.005] * 98 + [0.5, 5.0]:
+            histogram.observe(value)
+
+        self.assertEqual(histogram.quantile(0.5), 0.01)
+        self.assertEqual(histogram.quantile(0.99), 1.0)
+        self.assertEqual(histogram.quantile(1), float('inf'))
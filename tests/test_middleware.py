@@ -0,0 +1,172 @@
+import asyncio
+
+import asynctest
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from mandate.exceptions import TokenVerificationException
+from mandate.metrics import Metrics
+from mandate.middleware import (
+    CachedVerifier, CognitoAuthMiddleware, TokenCache, aiohttp_middleware,
+    bearer_token, claims_request_key
+)
+from mandate.multipool import MultiPoolVerifier
+from mandate.testing import FakeCognito
+
+
+class CountingVerifier(object):
+
+    def __init__(self, verifier):
+        self.verifier = verifier
+        self.calls = 0
+
+    async def verify_token(self, token, token_use=None):
+        self.calls += 1
+        return await self.verifier.verify_token(token, token_use)
+
+
+class testMiddleware(asynctest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCognito(key_bits=1024)
+        cls.fake.add_user('bob', 'Passw0rd!')
+
+    def setUp(self):
+        multipool = MultiPoolVerifier(
+            {self.fake.user_pool_id: self.fake.client_id})
+        multipool.jwks_cache.set_keys(self.fake.issuer, self.fake.jwks)
+        self.inner = CountingVerifier(multipool)
+        self.metrics = Metrics()
+        self.verifier = CachedVerifier(self.inner, metrics=self.metrics)
+        self.tokens = self.fake.issue_tokens('bob')
+
+    async def call_asgi(self, app, authorization=None):
+        headers = []
+        if authorization is not None:
+            headers.append((b'authorization', authorization.encode()))
+        scope = {'type': 'http', 'path': '/', 'headers': headers}
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await app(scope, None, send)
+        return scope, sent
+
+    async def test_asgi(self):
+        seen = []
+
+        async def app(scope, receive, send):
+            seen.append(scope['cognito_claims'])
+
+        middleware = CognitoAuthMiddleware(app, self.verifier)
+        bearer = 'Bearer ' + self.tokens['AccessToken']
+
+        for _ in range(3):
+            await self.call_asgi(middleware, bearer)
+        self.assertEqual([claims['username'] for claims in seen],
+                         ['bob'] * 3)
+        self.assertEqual(self.inner.calls, 1)
+
+        for _ in range(3):
+            _, sent = await self.call_asgi(middleware, 'Bearer garbage')
+            self.assertEqual(sent[0]['status'], 401)
+        self.assertEqual(self.inner.calls, 2)
+        self.assertEqual(
+            self.metrics.counters[('negative_cache_hits', 'verify_token')],
+            2)
+
+        _, sent = await self.call_asgi(middleware)
+        self.assertEqual(sent[0]['status'], 401)
+        self.assertEqual(len(seen), 3)
+
+        # id tokens aren't accepted where access tokens are expected
+        _, sent = await self.call_asgi(
+            middleware, 'Bearer ' + self.tokens['IdToken'])
+        self.assertEqual(sent[0]['status'], 401)
+
+    async def test_asgi_optional(self):
+        seen = []
+
+        async def app(scope, receive, send):
+            seen.append(scope['cognito_claims'])
+
+        middleware = CognitoAuthMiddleware(app, self.verifier,
+                                           required=False)
+        await self.call_asgi(middleware)
+        self.assertEqual(seen, [None])
+
+    async def test_aiohttp(self):
+        middleware = aiohttp_middleware(self.verifier, token_use='id')
+
+        async def handler(request):
+            return web.Response(text=request[claims_request_key()]['sub'])
+
+        request = make_mocked_request('GET', '/', headers={
+            'Authorization': 'Bearer ' + self.tokens['IdToken']})
+        response = await middleware(request, handler)
+        self.assertEqual(response.text, self.fake.users['bob'].sub)
+
+        request = make_mocked_request('GET', '/')
+        with self.assertRaises(web.HTTPUnauthorized):
+            await middleware(request, handler)
+
+    async def test_concurrent_requests_verify_once(self):
+        token = self.tokens['AccessToken']
+        results = await asyncio.gather(
+            *[self.verifier.verify_token(token, 'access')
+              for _ in range(10)])
+        self.assertEqual(len(results), 10)
+        self.assertEqual(self.inner.calls, 1)
+
+    def test_token_cache(self):
+        cache = TokenCache(max_size=2)
+        cache.set('a', {'exp': 100})
+        cache.set('b', {'exp': 200})
+        cache.set('c', {'exp': 300})
+        self.assertIsNone(cache.get('a', now=50))
+        self.assertEqual(cache.get('b', now=50), {'exp': 200})
+        self.assertIsNone(cache.get('b', now=250))
+        self.assertEqual(len(cache), 1)
+        # keyed by digest
+        cache.set('x' * 1000, {'exp': 300})
+        self.assertTrue(all(len(key) == 16 for key in cache._claims))
+        self.assertEqual(cache.get('x' * 1000, now=50), {'exp': 300})
+
+    async def test_run_in_executor(self):
+        multipool = MultiPoolVerifier(
+            {self.fake.user_pool_id: self.fake.client_id},
+            run_in_executor=True)
+        multipool.jwks_cache.set_keys(self.fake.issuer, self.fake.jwks)
+        loop = asyncio.get_event_loop()
+        run_in_executor = loop.run_in_executor
+        calls = []
+
+        def counting(executor, func, *args):
+            calls.append(func)
+            return run_in_executor(executor, func, *args)
+        loop.run_in_executor = counting
+        try:
+            claims = await CachedVerifier(multipool).verify_token(
+                self.tokens['AccessToken'], 'access')
+        finally:
+            del loop.run_in_executor
+        self.assertEqual(claims['username'], 'bob')
+        self.assertEqual(len(calls), 1)
+
+    def test_bearer_token(self):
+        self.assertEqual(bearer_token('Bearer abc'), 'abc')
+        self.assertEqual(bearer_token('bearer abc '), 'abc')
+        self.assertIsNone(bearer_token('Basic abc'))
+        self.assertIsNone(bearer_token('Bearer '))
+        self.assertIsNone(bearer_token(None))
+
+    async def test_rejection_is_not_cached_forever(self):
+        self.verifier.negative_ttl = 0.0001
+        with self.assertRaises(TokenVerificationException):
+            await self.verifier.verify_token('garbage')
+        await asyncio.sleep(0.001)
+        with self.assertRaises(TokenVerificationException):
+            await self.verifier.verify_token('garbage')
+        self.assertEqual(self.inner.calls, 2)
@@ -0,0 +1,72 @@
+import asyncio
+
+import asynctest
+
+from mandate.exceptions import TokenVerificationException
+from mandate.metrics import Metrics
+from mandate.multipool import JWKSCache, MultiPoolVerifier
+from mandate.testing import FakeCognito
+
+
+class testMultiPool(asynctest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool_a = FakeCognito('eu-west-2_poolA', 'client-a', key_bits=1024)
+        cls.pool_b = FakeCognito('us-east-1_poolB', 'client-b', key_bits=1024)
+        cls.other = FakeCognito('eu-west-2_other', 'client-a', key_bits=1024)
+        for fake in (cls.pool_a, cls.pool_b, cls.other):
+            fake.add_user('bob', 'Passw0rd!')
+
+    async def setUp(self):
+        self.runners = []
+        urls = {}
+        for fake in (self.pool_a, self.pool_b):
+            runner, url = await fake.serve_jwks()
+            self.runners.append(runner)
+            urls[fake.issuer] = url
+        self.metrics = Metrics()
+        self.verifier = MultiPoolVerifier(
+            {self.pool_a.user_pool_id: 'client-a',
+             self.pool_b.user_pool_id: ['client-b', 'client-c']},
+            metrics=self.metrics,
+            jwks_cache=JWKSCache(metrics=self.metrics,
+                                 jwks_url=urls.__getitem__))
+
+    async def tearDown(self):
+        await self.verifier.close()
+        for runner in self.runners:
+            await runner.cleanup()
+
+    async def test_routes_by_issuer(self):
+        token_a = self.pool_a.issue_tokens('bob')['IdToken']
+        token_b = self.pool_b.issue_tokens('bob')['AccessToken']
+
+        claims = await asyncio.gather(
+            *[self.verifier.verify_token(token_a, 'id') for _ in range(5)])
+        self.assertEqual(claims[0]['iss'], self.pool_a.issuer)
+        claims = await self.verifier.verify_token(token_b, 'access')
+        self.assertEqual(claims['iss'], self.pool_b.issuer)
+
+        # one download per pool, however many concurrent verifications
+        self.assertEqual(
+            self.metrics.histograms[('get_keys', 'jwks')].count, 2)
+
+    async def test_rejections(self):
+        foreign = self.other.issue_tokens('bob')['IdToken']
+        with self.assertRaises(TokenVerificationException):
+            await self.verifier.verify_token(foreign)
+        self.assertEqual(self.metrics.counters[('rejections', 'issuer')], 1)
+        self.assertNotIn(('get_keys', 'jwks'), self.metrics.histograms)
+
+        id_token = self.pool_a.issue_tokens('bob')['IdToken']
+        with self.assertRaises(TokenVerificationException):
+            await self.verifier.verify_token(id_token, 'access')
+        self.assertEqual(
+            self.metrics.counters[('rejections', 'token_use')], 1)
+
+        self.verifier.add_pool(self.pool_a.user_pool_id, 'client-z')
+        with self.assertRaises(TokenVerificationException):
+            await self.verifier.verify_token(id_token)
+        self.assertEqual(
+            self.metrics.counters[('rejections', 'audience')], 1)
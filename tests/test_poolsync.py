@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+
+import asynctest
+
+from mandate.poolsync import ADDED, CHANGED, REMOVED, UserPoolSync
+from mandate.testing import FakeCognito
+
+
+class testUserPoolSync(asynctest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCognito(key_bits=1024)
+
+    def setUp(self):
+        self.fake.users.clear()
+        for i in range(25):
+            self.fake.add_user('user{:02d}'.format(i), attributes={
+                'email': 'user{}@example.com'.format(i)})
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'users.sqlite3')
+        self.sync = UserPoolSync(self.fake.cognito(), self.path,
+                                 attr_map={'email': 'mail'}, page_size=10)
+        self.addCleanup(self.sync.close)
+
+    async def changes(self):
+        return sorted([(change.kind, change.username)
+                       async for change in self.sync.changes()])
+
+    async def test_incremental(self):
+        changes = [change async for change in self.sync.changes()]
+        self.assertEqual(len(changes), 25)
+        self.assertEqual({change.kind for change in changes}, {ADDED})
+        self.assertEqual(changes[0].user.mail, 'user0@example.com')
+        self.assertEqual(len(self.sync), 25)
+
+        self.assertEqual(await self.changes(), [])
+
+        self.fake.users['user03'].attributes['email'] = 'new@example.com'
+        self.fake.users['user04'].enabled = False
+        del self.fake.users['user05']
+        self.fake.add_user('user99')
+        self.assertEqual(await self.changes(), [
+            (ADDED, 'user99'), (CHANGED, 'user03'), (CHANGED, 'user04'),
+            (REMOVED, 'user05')])
+        self.assertEqual(await self.changes(), [])
+
+        # the snapshot survives the process
+        self.sync.close()
+        self.sync = UserPoolSync(self.fake.cognito(), self.path)
+        self.assertEqual(await self.changes(), [])
+
+    async def test_interrupted_run(self):
+        changes = self.sync.changes()
+        async for change in changes:
+            break
+        await changes.aclose()
+        self.assertEqual(len(self.sync), 0)
+        self.assertEqual(len(await self.changes()), 25)
+
+    async def test_abandoned_run(self):
+        abandoned = self.sync.changes()
+        async for change in abandoned:
+            break
+        # a new run before the abandoned one is finalized
+        self.assertEqual(len(await self.changes()), 25)
+        with self.assertRaises(RuntimeError):
+            await abandoned.__anext__()
+        # closing it doesn't undo the newer run
+        await abandoned.aclose()
+        self.assertEqual(len(self.sync), 25)
+        self.assertEqual(await self.changes(), [])
+
+    def test_other_pool(self):
+        other = FakeCognito('eu-west-2_other', key_bits=1024)
+        with self.assertRaises(ValueError):
+            UserPoolSync(other.cognito(), self.path)
@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import time
+
+import asynctest
+from botocore.exceptions import ClientError
+
+from mandate.recording import (
+    Recorder, Redactor, Replayer, TraceClient, from_shape, load_trace, shape,
+    trace_usernames,
+)
+from mandate.testing import FakeCognito
+
+
+class testRecording(asynctest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCognito(key_bits=1024)
+        cls.fake.add_user('bob', 'Passw0rd!', {'email': 'bob@example.com'})
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'trace.ndjson')
+
+    async def record(self):
+        recorder = Recorder(self.path)
+        cog = self.fake.cognito(username='bob', recorder=recorder)
+        await cog.authenticate('Passw0rd!')
+        await cog.admin_get_user()
+        with self.assertRaises(ClientError):
+            await self.fake.cognito(username='nobody',
+                                    recorder=recorder).admin_get_user()
+        recorder.close()
+        return load_trace(self.path)
+
+    async def test_record(self):
+        records = await self.record()
+        self.assertEqual([record['operation'] for record in records],
+                         ['initiate_auth', 'respond_to_auth_challenge',
+                          'admin_get_user', 'admin_get_user'])
+        with open(self.path) as f:
+            trace = f.read()
+        for secret in ['Passw0rd!', 'bob@example.com', '"bob"']:
+            self.assertNotIn(secret, trace)
+
+        auth, challenge, get_user, missing = records
+        self.assertEqual(auth['params']['AuthFlow'], 'USER_SRP_AUTH')
+        self.assertEqual(get_user['params']['UserPoolId'],
+                         self.fake.user_pool_id)
+        # the same user gets the same pseudonym
+        self.assertEqual(auth['params']['AuthParameters']['USERNAME'],
+                         get_user['params']['Username'])
+        self.assertNotEqual(get_user['params']['Username'],
+                            missing['params']['Username'])
+        self.assertEqual(get_user['response']['UserAttributes']['[]'], 2)
+        self.assertEqual(get_user['response']['UserCreateDate'], 'datetime')
+        self.assertEqual(
+            challenge['response']['AuthenticationResult']['AccessToken'],
+            'str')
+        self.assertIsNone(get_user['error'])
+        self.assertEqual(missing['error'], 'UserNotFoundException')
+        self.assertIsNone(missing['response'])
+        self.assertTrue(all(record['latency'] >= 0 for record in records))
+        self.assertEqual(records, sorted(records, key=lambda r: r['at']))
+
+    def test_redactor(self):
+        redactor = Redactor(key=b'key')
+        params = {'UserPoolId': 'pool', 'Limit': 10,
+                  'UserAttributes': [{'Name': 'email', 'Value': 'a@b.c'}]}
+        redacted = redactor.redact(params)
+        self.assertEqual(redacted['UserPoolId'], 'pool')
+        self.assertEqual(redacted['Limit'], 10)
+        self.assertEqual(redacted['UserAttributes'][0]['Name'], 'email')
+        self.assertTrue(redacted['UserAttributes'][0]['Value'].startswith('~'))
+        # stable for a key
+        self.assertEqual(Redactor(key=b'key').redact(params), redacted)
+        self.assertNotEqual(Redactor().redact(params), redacted)
+
+    def test_shape(self):
+        response = {'Users': [{'Username': 'a', 'Enabled': True}] * 3,
+                    'PaginationToken': None,
+                    'ResponseMetadata': {'HTTPStatusCode': 200}}
+        self.assertEqual(shape(response), {
+            'Users': {'[]': 3, 'item': {'Username': 'str', 'Enabled': 'bool'}},
+            'PaginationToken': 'null'})
+        self.assertEqual(from_shape(shape(response)), {
+            'Users': [{'Username': 'x', 'Enabled': False}] * 3,
+            'PaginationToken': None})
+
+    async def test_trace_client(self):
+        records = await self.record()
+        client = TraceClient(records, latency=False)
+        async with client:
+            response = await client.admin_get_user(Username='whoever')
+            self.assertEqual(len(response['UserAttributes']), 2)
+            with self.assertRaises(ClientError) as error:
+                await client.admin_get_user(Username='whoever')
+            self.assertEqual(error.exception.response['Error']['Code'],
+                             'UserNotFoundException')
+            with self.assertRaises(AttributeError):
+                client.list_users
+
+    async def test_replay(self):
+        records = [{'at': i * 0.02, 'operation': 'admin_get_user',
+                    'params': {'Username': '~user{}'.format(i % 3)},
+                    'latency': 0.02, 'response': {'Username': 'str'},
+                    'error': None} for i in range(10)]
+
+        # as fast as possible
+        start = time.monotonic()
+        metrics = await Replayer(records, speed=None).run(
+            TraceClient(records, latency=False))
+        self.assertLess(time.monotonic() - start, 0.1)
+        histogram = metrics.histograms[('admin_get_user', 'replay')]
+        self.assertEqual(histogram.count, 10)
+
+        # original pacing, the calls overlapping as they did
+        start = time.monotonic()
+        metrics = await Replayer(records).run(TraceClient(records))
+        elapsed = time.monotonic() - start
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertLess(elapsed, 0.5)
+        # twice as fast
+        start = time.monotonic()
+        await Replayer(records, speed=2).run(TraceClient(records))
+        self.assertLess(time.monotonic() - start, elapsed)
+
+    async def test_replay_against_fake(self):
+        records = await self.record()
+        fake = FakeCognito(key_bits=1024)
+        for username in trace_usernames(records):
+            fake.add_user(username)
+        cog = fake.cognito()
+        get_users = [record for record in records
+                     if record['operation'] == 'admin_get_user']
+        async with cog.get_client() as client:
+            metrics = await Replayer(get_users, speed=None).run(client)
+        self.assertEqual(
+            metrics.histograms[('admin_get_user', 'replay')].count, 2)
+        self.assertNotIn(('errors', 'admin_get_user'), metrics.counters)
@@ -0,0 +1,209 @@
+import asyncio
+
+import asynctest
+from botocore.exceptions import ClientError
+
+from mandate.exceptions import (
+    CircuitOpenException, DeadlineExceededException
+)
+from mandate.metrics import Metrics
+from mandate.resilience import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, ResiliencePolicy
+)
+from mandate.testing import FakeCognito
+
+
+def server_error(operation='AdminGetUser', code='InternalErrorException',
+                 status=500):
+    return ClientError({'Error': {'Code': code, 'Message': code},
+                        'ResponseMetadata': {'HTTPStatusCode': status}},
+                       operation)
+
+
+class StandInClient(object):
+    """
+    Client whose calls take the delays, or raise the errors, queued in
+    `script`, then answer at once
+    """
+
+    def __init__(self):
+        self.script = []
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def _answer(self, operation, kwargs):
+        self.calls.append(operation)
+        step = self.script.pop(0) if self.script else 0
+        if isinstance(step, Exception):
+            raise step
+        await asyncio.sleep(step)
+        return {'Username': kwargs.get('Username'), 'call': len(self.calls)}
+
+    async def admin_get_user(self, **kwargs):
+        return await self._answer('admin_get_user', kwargs)
+
+    async def admin_update_user_attributes(self, **kwargs):
+        return await self._answer('admin_update_user_attributes', kwargs)
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class testCircuitBreaker(asynctest.TestCase):
+
+    def test_states(self):
+        clock = Clock()
+        changes = []
+        breaker = CircuitBreaker(
+            failure_threshold=2, reset_timeout=10, clock=clock,
+            on_state_change=lambda old, new: changes.append(new))
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+
+        clock.now = 10
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        # one probe at a time
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+
+        clock.now = 20
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(changes, [OPEN, HALF_OPEN, OPEN, HALF_OPEN, CLOSED])
+
+
+class testResilientClient(asynctest.TestCase):
+
+    def setUp(self):
+        self.client = StandInClient()
+        self.metrics = Metrics()
+
+    async def call(self, policy, operation='admin_get_user', **kwargs):
+        kwargs.setdefault('Username', 'bob')
+        async with policy.wrap(self.client) as client:
+            return await getattr(client, operation)(**kwargs)
+
+    async def test_deadline(self):
+        policy = ResiliencePolicy(deadlines={'admin_get_user': 0.05},
+                                  hedged_operations=(), metrics=self.metrics)
+        self.client.script = [1.0]
+        with self.assertRaises(DeadlineExceededException):
+            await self.call(policy)
+        self.assertEqual(
+            self.metrics.counters[('deadline_exceeded', 'admin_get_user')], 1)
+        # no deadline on the other operations
+        self.client.script = [0.1]
+        await self.call(policy, 'admin_update_user_attributes')
+
+    async def test_hedged_read(self):
+        policy = ResiliencePolicy(hedge_delay=0.02, metrics=self.metrics)
+        self.client.script = [1.0, 0]
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        response = await self.call(policy)
+        self.assertLess(loop.time() - start, 0.5)
+        self.assertEqual(response['call'], 2)
+        self.assertEqual(self.metrics.counters[('hedges', 'admin_get_user')],
+                         1)
+        self.assertEqual(
+            self.metrics.counters[('hedge_wins', 'admin_get_user')], 1)
+
+        # writes are never sent twice
+        self.client.script = [0.1]
+        await self.call(policy, 'admin_update_user_attributes')
+        self.assertEqual(self.client.calls.count(
+            'admin_update_user_attributes'), 1)
+
+    async def test_hedge_after_quantile(self):
+        policy = ResiliencePolicy(hedge_delay=1, min_samples=10,
+                                  hedge_quantile=0.9)
+        self.assertEqual(policy.hedge_after('admin_get_user'), 1)
+        for latency in range(1, 11):
+            policy.observe('admin_get_user', latency / 100.0)
+        self.assertEqual(policy.hedge_after('admin_get_user'), 0.1)
+        self.assertIsNone(policy.hedge_after('admin_update_user_attributes'))
+
+    async def test_breaker(self):
+        policy = ResiliencePolicy(failure_threshold=2, reset_timeout=0.05,
+                                  metrics=self.metrics)
+        self.client.script = [server_error(), server_error()]
+        for _ in range(2):
+            with self.assertRaises(ClientError):
+                await self.call(policy)
+        self.assertEqual(policy.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenException):
+            await self.call(policy)
+        self.assertEqual(len(self.client.calls), 2)
+        self.assertEqual(
+            self.metrics.counters[('breaker_opened', 'cognito')], 1)
+        self.assertEqual(
+            self.metrics.counters[('short_circuits', 'admin_get_user')], 1)
+
+        await asyncio.sleep(0.05)
+        await self.call(policy)
+        self.assertEqual(policy.breaker.state, CLOSED)
+        self.assertEqual(policy.stats()['breaker']['state'], CLOSED)
+
+    async def test_client_errors_dont_open_the_breaker(self):
+        policy = ResiliencePolicy(failure_threshold=1)
+        self.client.script = [server_error(code='UserNotFoundException',
+                                           status=400)]
+        with self.assertRaises(ClientError):
+            await self.call(policy)
+        self.assertEqual(policy.breaker.state, CLOSED)
+
+        self.client.script = [server_error(code='TooManyRequestsException',
+                                           status=400)]
+        with self.assertRaises(ClientError):
+            await self.call(policy)
+        self.assertEqual(policy.breaker.state, OPEN)
+
+    async def test_stale_responses(self):
+        policy = ResiliencePolicy(failure_threshold=1, reset_timeout=60,
+                                  stale_ttl=60, metrics=self.metrics)
+        fresh = await self.call(policy)
+        self.client.script = [server_error()]
+        # Cognito failing: last response
+        self.assertEqual(await self.call(policy), fresh)
+        self.assertEqual(policy.breaker.state, OPEN)
+        # breaker open: last response without calling Cognito
+        self.assertEqual(await self.call(policy), fresh)
+        self.assertEqual(len(self.client.calls), 2)
+        with self.assertRaises(CircuitOpenException):
+            await self.call(policy, Username='alice')
+        self.assertEqual(
+            self.metrics.counters[('stale_responses', 'admin_get_user')], 2)
+
+
+class testResilientCognito(asynctest.TestCase):
+
+    async def test_cognito(self):
+        fake = FakeCognito(key_bits=1024, latency=0.01)
+        fake.add_user('bob', 'Passw0rd!', {'email': 'bob@example.com'})
+        policy = ResiliencePolicy(default_deadline=1)
+        cog = fake.cognito(username='bob', resilience=policy)
+        user = await cog.admin_get_user()
+        self.assertEqual(user.email, 'bob@example.com')
+
+        fake.latency = 0.2
+        policy.deadlines['admin_get_user'] = 0.05
+        with self.assertRaises(DeadlineExceededException):
+            await cog.admin_get_user()
@@ -0,0 +1,165 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import asynctest
+
+from mandate.crypto import split_token
+from mandate.exceptions import TokenVerificationException
+from mandate.middleware import CachedVerifier
+from mandate.multipool import MultiPoolVerifier
+from mandate.revocation import BloomRevocationStore, RevocationStore
+from mandate.testing import FakeCognito
+
+
+NOW = int(time.time())
+
+
+def claims(sub='sub-1', jti='jti-1', origin_jti='origin-1', iat=NOW - 1000,
+           auth_time=None, lifetime=3600):
+    return {'sub': sub, 'jti': jti, 'origin_jti': origin_jti, 'iat': iat,
+            'auth_time': iat if auth_time is None else auth_time,
+            'exp': iat + lifetime}
+
+
+class StoreTests(object):
+
+    def test_revoke_token(self):
+        self.store.revoke_token(claims(), now=NOW)
+        self.assertTrue(self.store.is_revoked(claims()))
+        # refreshed before the revocation, same authentication
+        self.assertTrue(self.store.is_revoked(
+            claims(jti='jti-2', iat=NOW - 500)))
+        # refreshed after: the refresh token wasn't revoked
+        self.assertFalse(self.store.is_revoked(
+            claims(jti='jti-3', iat=NOW + 1)))
+        self.assertFalse(self.store.is_revoked(
+            claims(jti='jti-4', origin_jti='origin-2')))
+
+    def test_revoke_subject(self):
+        self.store.revoke_subject('sub-1', cutoff=NOW)
+        self.assertTrue(self.store.is_revoked(
+            claims(jti='a', origin_jti='b', iat=NOW - 100)))
+        # refreshed after the cutoff, authenticated before
+        self.assertTrue(self.store.is_revoked(
+            claims(jti='c', origin_jti='d', iat=NOW + 100,
+                   auth_time=NOW - 100)))
+        # signed in again
+        self.assertFalse(self.store.is_revoked(
+            claims(jti='e', origin_jti='f', iat=NOW + 100)))
+        self.assertFalse(self.store.is_revoked(claims(sub='sub-2')))
+        # signed in again in the second of the revocation
+        self.assertFalse(self.store.is_revoked(
+            claims(jti='g', origin_jti='h', iat=NOW)))
+
+
+class testRevocationStore(StoreTests, unittest.TestCase):
+
+    def setUp(self):
+        self.store = RevocationStore(max_token_lifetime=3600)
+
+    def test_expiry(self):
+        now = time.time()
+        self.store.revoke_token(claims(iat=int(now) - 3590, lifetime=3600),
+                                now=now - 3590)
+        self.store.revoke_subject('sub-2', cutoff=now - 7200)
+        self.assertEqual(len(self.store), 2)
+        self.store.purge()
+        self.assertEqual(len(self.store), 1)
+        self.store.purge(now + 11)
+        self.assertEqual(len(self.store), 0)
+
+
+class testBloomRevocationStore(StoreTests, unittest.TestCase):
+
+    def setUp(self):
+        self.store = BloomRevocationStore(slots=1024)
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_shared_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'revoked')
+        writer = BloomRevocationStore(path, slots=4096, hashes=3)
+        reader = BloomRevocationStore(path)
+        self.addCleanup(writer.close)
+        self.addCleanup(reader.close)
+        self.assertEqual((reader.slots, reader.hashes), (4096, 3))
+        self.assertEqual(os.path.getsize(path), 12 + 4 * 4096)
+
+        self.assertFalse(reader.is_revoked(claims()))
+        writer.revoke_subject('sub-1', cutoff=NOW)
+        self.assertTrue(reader.is_revoked(claims()))
+
+    def test_not_a_filter(self):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, b'something else entirely')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        with self.assertRaises(ValueError):
+            BloomRevocationStore(path)
+
+
+class testRevocationVerification(asynctest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCognito(key_bits=1024)
+
+    def setUp(self):
+        self.fake.users.clear()
+        self.fake.add_user('bob', 'Passw0rd!', {'email': 'bob@example.com'})
+        self.store = RevocationStore()
+
+    async def test_logout(self):
+        cog = self.fake.cognito(username='bob',
+                                revocation_store=self.store)
+        await cog.admin_authenticate('Passw0rd!')
+        access_token = cog.access_token
+        other = self.fake.cognito(revocation_store=self.store)
+        await other.verify_token(access_token, 'access_token', 'access')
+
+        await cog.logout()
+        with self.assertRaises(TokenVerificationException):
+            await other.verify_token(access_token, 'access_token', 'access')
+
+    async def test_login_after_logout(self):
+        cog = self.fake.cognito(username='bob',
+                                revocation_store=self.store)
+        await cog.admin_authenticate('Passw0rd!')
+        old_token = cog.access_token
+        # same second, most likely: the new session is accepted
+        await cog.logout()
+        await cog.admin_authenticate('Passw0rd!')
+        _, claims, _, _ = split_token(cog.access_token)
+        self.assertFalse(self.store.is_revoked(claims))
+        await cog.verify_token(cog.access_token, 'access_token', 'access')
+        # and the old one still rejected, by its origin_jti
+        with self.assertRaises(TokenVerificationException):
+            await cog.verify_token(old_token, 'access_token', 'access')
+
+    async def test_admin_logout(self):
+        tokens = self.fake.issue_tokens('bob', issued_at=time.time() - 60)
+        cog = self.fake.cognito(revocation_store=self.store)
+        await cog.admin_logout('bob')
+        with self.assertRaises(TokenVerificationException):
+            await cog.verify_token(tokens['IdToken'], 'id_token', 'id')
+
+    async def test_cached_verifier(self):
+        multipool = MultiPoolVerifier([self.fake.user_pool_id],
+                                      revocation_store=self.store)
+        multipool.jwks_cache.set_keys(self.fake.issuer, self.fake.jwks)
+        verifier = CachedVerifier(multipool)
+        token = self.fake.issue_tokens('bob')['AccessToken']
+        claims = await verifier.verify_token(token)
+
+        self.store.revoke_token(claims)
+        with self.assertRaises(TokenVerificationException):
+            await verifier.verify_token(token)
+        self.assertIsNone(verifier.cache.get(token))
+        with self.assertRaises(TokenVerificationException):
+            await multipool.verify_token(token)
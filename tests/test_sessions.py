@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import asynctest
+
+from mandate.metrics import Metrics
+from mandate.sessions import SessionManager
+from mandate.testing import FakeCognito
+
+
+class testSessionManager(asynctest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCognito(key_bits=1024, token_validity=3)
+        for i in range(12):
+            cls.fake.add_user('service{}'.format(i), 'Passw0rd!')
+
+    async def sessions(self):
+        sessions = []
+        for i in range(12):
+            cog = self.fake.cognito(username='service{}'.format(i))
+            await cog.admin_authenticate('Passw0rd!')
+            sessions.append(cog)
+        return sessions
+
+    async def test_refreshes_ahead_of_expiry(self):
+        sessions = await self.sessions()
+        tokens = [cog.access_token for cog in sessions]
+        in_flight = []
+        peak = []
+
+        for cog in sessions:
+            renew = cog.renew_access_token
+
+            async def counting_renew(renew=renew):
+                in_flight.append(None)
+                peak.append(len(in_flight))
+                try:
+                    await asyncio.sleep(0.01)
+                    await renew()
+                finally:
+                    in_flight.pop()
+
+            cog.renew_access_token = counting_renew
+
+        metrics = Metrics()
+        async with SessionManager(refresh_margin=2.5, jitter=0.2,
+                                  concurrency=3, metrics=metrics,
+                                  max_margin_fraction=0.9) as manager:
+            for cog in sessions:
+                manager.add(cog)
+            self.assertEqual(len(manager), 12)
+            self.assertLess(manager.next_refresh(), time.time() + 1)
+            await asyncio.sleep(1.2)
+
+        self.assertTrue(all(cog.access_token != token
+                            for cog, token in zip(sessions, tokens)))
+        self.assertGreaterEqual(
+            metrics.counters[('refreshes', 'session_manager')], 12)
+        self.assertLessEqual(max(peak), 3)
+
+    async def test_short_lived_tokens(self):
+        # Cognito's shortest access tokens, under the default margin
+        fake = FakeCognito(key_bits=1024, token_validity=300)
+        manager = SessionManager()
+        now = time.time()
+        for i in range(20):
+            fake.add_user('short{}'.format(i), 'Passw0rd!')
+            cog = fake.cognito(username='short{}'.format(i))
+            await cog.admin_authenticate('Passw0rd!')
+            manager.add(cog)
+        times = [when for when, _, _ in manager._heap]
+        # not due straight away, and spread out
+        self.assertGreater(min(times), now + 60)
+        self.assertLessEqual(max(times), now + 151)
+        self.assertGreater(len(set(times)), 1)
+
+    async def test_failures_are_retried(self):
+        cog = (await self.sessions())[0]
+        cog.refresh_token = 'revoked'
+        errors = []
+        # due at once
+        manager = SessionManager(refresh_margin=10, retry_interval=0.05,
+                                 max_margin_fraction=1,
+                                 on_error=lambda cog, e: errors.append(e))
+        manager.start()
+        manager.add(cog)
+        await asyncio.sleep(0.2)
+        manager.remove(cog)
+        await manager.close()
+        self.assertGreaterEqual(len(errors), 2)
+        self.assertNotIn(cog, manager)
+        self.assertIsNone(manager.next_refresh())
@@ -0,0 +1,229 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import asynctest
+
+from mandate.exceptions import TokenVerificationException
+from mandate.metrics import Metrics
+from mandate.middleware import CachedVerifier
+from mandate.multipool import JWKSCache, MultiPoolVerifier
+from mandate.revocation import RevocationStore
+from mandate.sharedcache import SharedCache
+from mandate.testing import FakeCognito
+
+
+def _verify_in_child(path, token, claims):
+    cache = SharedCache(path)
+    cache.set(token, claims)
+    cache.close()
+
+
+class testSharedTokens(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCognito(key_bits=1024)
+        cls.fake.add_user('bob')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'cache')
+        self.token = self.fake.issue_tokens('bob')['AccessToken']
+        self.claims = {'exp': int(time.time()) + 3600}
+
+    def cache(self, **kwargs):
+        cache = SharedCache(self.path, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_shared_between_instances(self):
+        writer = self.cache(slots=64)
+        reader = self.cache()
+        self.assertEqual(reader.slots, 64)
+        self.assertIsNone(reader.get(self.token))
+        writer.set(self.token, self.claims)
+        claims = reader.get(self.token)
+        self.assertEqual(claims['username'], 'bob')
+        self.assertEqual(len(reader), 1)
+        # not valid past exp
+        self.assertIsNone(reader.get(self.token, now=self.claims['exp']))
+
+        reader.discard(self.token)
+        self.assertIsNone(writer.get(self.token))
+        self.assertEqual(len(writer), 0)
+
+    def test_shared_between_processes(self):
+        cache = self.cache()
+        child = multiprocessing.get_context('fork').Process(
+            target=_verify_in_child, args=(self.path, self.token,
+                                           self.claims))
+        child.start()
+        child.join()
+        self.assertEqual(cache.get(self.token)['username'], 'bob')
+
+    def test_eviction(self):
+        cache = self.cache(slots=8)
+        tokens = [self.fake.issue_tokens('bob')['AccessToken']
+                  for _ in range(20)]
+        for i, token in enumerate(tokens):
+            cache.set(token, {'exp': int(time.time()) + 1000 + i})
+        self.assertLessEqual(len(cache), 8)
+        # the latest token is always kept
+        self.assertIsNotNone(cache.get(tokens[-1]))
+        # expired tokens aren't stored
+        cache.set(self.token, {'exp': int(time.time()) - 1})
+        self.assertIsNone(cache.get(self.token))
+
+    def test_private(self):
+        cache = SharedCache(slots=16)
+        self.addCleanup(cache.close)
+        cache.set(self.token, self.claims)
+        self.assertIsNotNone(cache.get(self.token))
+
+    def test_not_a_cache(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'something else entirely')
+        with self.assertRaises(ValueError):
+            SharedCache(self.path)
+
+
+class testSharedJWKS(asynctest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCognito(key_bits=1024)
+        cls.fake.add_user('bob')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'cache')
+        self.fetches = 0
+
+    def cache(self, **kwargs):
+        cache = SharedCache(self.path, poll_interval=0.01, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    async def fetch(self):
+        self.fetches += 1
+        await asyncio.sleep(0.05)
+        return self.fake.jwks
+
+    async def test_single_fetch(self):
+        caches = [self.cache() for _ in range(4)]
+        results = await asyncio.gather(*[
+            cache.get_jwks(self.fake.issuer, self.fetch)
+            for cache in caches])
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(results, [self.fake.jwks] * 4)
+
+        await caches[0].get_jwks(self.fake.issuer, self.fetch)
+        self.assertEqual(self.fetches, 1)
+        await caches[0].get_jwks(self.fake.issuer, self.fetch, max_age=0)
+        self.assertEqual(self.fetches, 2)
+
+    async def test_failed_fetch(self):
+        cache = self.cache()
+
+        async def fail():
+            raise OSError('unreachable')
+        with self.assertRaises(OSError):
+            await cache.get_jwks(self.fake.issuer, fail)
+        # the lease was given up
+        self.assertEqual(
+            await asyncio.wait_for(
+                self.cache().get_jwks(self.fake.issuer, self.fetch), 1),
+            self.fake.jwks)
+
+    async def test_too_large(self):
+        cache = self.cache(jwks_size=64)
+        cache.publish_jwks(self.fake.issuer, self.fake.jwks)
+        self.assertIsNone(cache.jwks_entry(self.fake.issuer))
+        self.assertTrue(cache._take_lease(self.fake.issuer, 10))
+
+    async def test_lease_per_issuer(self):
+        caches = [self.cache() for _ in range(2)]
+        other = 'https://cognito-idp.eu-west-2.amazonaws.com/other'
+        start = time.monotonic()
+        # the two fetches run at the same time
+        results = await asyncio.gather(
+            caches[0].get_jwks(self.fake.issuer, self.fetch),
+            caches[1].get_jwks(other, self.fetch))
+        self.assertLess(time.monotonic() - start, 0.09)
+        self.assertEqual(self.fetches, 2)
+        self.assertEqual(results, [self.fake.jwks] * 2)
+
+    async def test_stale_while_refreshing(self):
+        caches = [self.cache() for _ in range(2)]
+        caches[0].publish_jwks(self.fake.issuer, {'keys': []},
+                               fetched_at=time.time() - 100)
+        refresh = asyncio.ensure_future(
+            caches[0].get_jwks(self.fake.issuer, self.fetch, max_age=10))
+        await asyncio.sleep(0.01)
+        # served the old keys without waiting
+        self.assertEqual(
+            await asyncio.wait_for(caches[1].get_jwks(
+                self.fake.issuer, self.fetch, max_age=10), 0.02),
+            {'keys': []})
+        self.assertEqual(await refresh, self.fake.jwks)
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(await caches[1].get_jwks(
+            self.fake.issuer, self.fetch, max_age=10), self.fake.jwks)
+
+    async def test_cognito(self):
+        shared = self.cache()
+        shared.publish_jwks(self.fake.issuer, self.fake.jwks)
+        metrics = Metrics()
+        cog = self.fake.cognito(shared_cache=shared, metrics=metrics,
+                                jwks_url='http://127.0.0.1:1/unused')
+        del cog.pool_jwk
+        self.assertEqual(await cog.get_keys(), self.fake.jwks)
+
+        token = self.fake.issue_tokens(
+            'bob', issued_at=time.time() - 60)['AccessToken']
+        await cog.verify_token(token, 'access_token', 'access')
+        self.assertNotIn(('cache_hits', 'verify_token'), metrics.counters)
+
+        # another process: verified without the keys
+        store = RevocationStore()
+        other = self.fake.cognito(shared_cache=self.cache(), metrics=metrics,
+                                  revocation_store=store)
+        del other.pool_jwk
+        claims = await other.verify_token(token, 'access_token', 'access')
+        self.assertEqual(claims['username'], 'bob')
+        self.assertEqual(metrics.counters[('cache_hits', 'verify_token')], 1)
+        # revocations still apply
+        store.revoke_subject(claims['sub'])
+        with self.assertRaises(TokenVerificationException):
+            await other.verify_token(token, 'access_token', 'access')
+        # and so do the other checks
+        with self.assertRaises(TokenVerificationException):
+            await other.verify_token(token, 'id_token', 'id')
+
+    async def test_cached_verifier(self):
+        token = self.fake.issue_tokens('bob')['AccessToken']
+        shared = self.cache()
+        shared.publish_jwks(self.fake.issuer, self.fake.jwks)
+
+        def verifier():
+            jwks_cache = JWKSCache(shared=self.cache(),
+                                   jwks_url=lambda issuer: 'http://unused')
+            multipool = MultiPoolVerifier([self.fake.user_pool_id],
+                                          jwks_cache=jwks_cache)
+            return CachedVerifier(multipool, cache=self.cache(),
+                                  metrics=metrics)
+
+        metrics = Metrics()
+        await verifier().verify_token(token, 'access')
+        claims = await verifier().verify_token(token, 'access')
+        self.assertEqual(claims['username'], 'bob')
+        self.assertEqual(metrics.counters[('cache_hits', 'verify_token')], 1)
+        self.assertEqual(metrics.counters[('cache_misses', 'verify_token')],
+                         1)
@@ -0,0 +1,150 @@
+import time
+
+import asynctest
+from botocore.exceptions import ClientError
+
+from mandate.metrics import Metrics
+from mandate.testing import FakeCognito
+
+
+class testFakeCognito(asynctest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCognito(key_bits=1024)
+
+    def setUp(self):
+        self.fake.users.clear()
+        self.fake.groups.clear()
+
+    async def test_sign_up_and_admin_authenticate(self):
+        cog = self.fake.cognito()
+        await cog.register(username='bob', password='Passw0rd!',
+                           email='bob@example.com', attrs={})
+        await cog.confirm_sign_up(self.fake.last_code('bob', 'sign_up'))
+
+        await cog.admin_authenticate('Passw0rd!')
+        user = await cog.get_user()
+        self.assertEqual(user.email, 'bob@example.com')
+        self.assertEqual(user.sub, self.fake.users['bob'].sub)
+
+        access_token = cog.access_token
+        await cog.logout()
+        with self.assertRaises(ClientError) as error:
+            await self.fake.get_client().get_user(AccessToken=access_token)
+        self.assertEqual(error.exception.response['Error']['Code'],
+                         'NotAuthorizedException')
+
+    async def test_srp_authenticate_and_refresh(self):
+        self.fake.add_user('alice', 'S3cret!', {'email': 'a@example.com'})
+        cog = self.fake.cognito(username='alice')
+
+        await cog.authenticate('S3cret!')
+        claims = await cog.verify_token(cog.id_token, 'id_token', 'id')
+        self.assertEqual(claims['cognito:username'], 'alice')
+
+        await cog.renew_access_token()
+        claims = await cog.verify_token(cog.access_token, 'access_token',
+                                        'access')
+        self.assertEqual(claims['username'], 'alice')
+
+        with self.assertRaises(ClientError):
+            await self.fake.cognito(username='alice').authenticate('wrong')
+
+    async def test_new_password_challenge(self):
+        cog = self.fake.cognito(username='carol')
+        await cog.admin_create_user('carol', temporary_password='Temp1234!')
+        self.assertEqual(self.fake.users['carol'].status,
+                         'FORCE_CHANGE_PASSWORD')
+
+        await cog.new_password_challenge('Temp1234!', 'N3wPassword!')
+
+        self.assertEqual(self.fake.users['carol'].status, 'CONFIRMED')
+        await cog.admin_authenticate('N3wPassword!')
+
+    async def test_remembered_device(self):
+        fake = FakeCognito(client_secret='s3cret', key_bits=1024,
+                           device_tracking=True)
+        fake.add_user('dave', 'Passw0rd!')
+        cog = fake.cognito(username='dave')
+        await cog.authenticate('Passw0rd!')
+        self.assertIsNotNone(cog.new_device_metadata)
+        await cog.confirm_device('build host')
+        device = fake.users['dave'].devices[cog.device_key]
+        self.assertEqual(device.name, 'build host')
+
+        metrics = Metrics()
+        trusted = fake.cognito(username='dave', metrics=metrics,
+                               device_key=cog.device_key,
+                               device_group_key=cog.device_group_key,
+                               device_password=cog.device_password)
+        await trusted.authenticate('Passw0rd!')
+        self.assertIsNone(trusted.new_device_metadata)
+        self.assertIn(('srp', 'process_device_challenge'), metrics.histograms)
+        await trusted.renew_access_token()
+
+        trusted.device_password = 'not the device password'
+        with self.assertRaises(ClientError):
+            await trusted.authenticate('Passw0rd!')
+        trusted.device_password = None
+        with self.assertRaises(ValueError):
+            await trusted.authenticate('Passw0rd!')
+
+    async def test_pagination(self):
+        for i in range(130):
+            self.fake.add_user('user{:03d}'.format(i))
+        for i in range(70):
+            self.fake.add_group('group{:02d}'.format(i), precedence=i)
+        cog = self.fake.cognito()
+
+        users = await cog.get_users()
+        groups = await cog.get_groups()
+
+        self.assertEqual(len(users), 130)
+        self.assertEqual(len(groups), 70)
+
+        async with self.fake.get_client() as client:
+            response = await client.list_users(
+                UserPoolId=self.fake.user_pool_id,
+                Filter='username ^= "user12"')
+        self.assertEqual([user['Username'] for user in response['Users']],
+                         ['user12{}'.format(i) for i in range(10)])
+
+    async def test_stable_pages(self):
+        for i in range(100):
+            self.fake.add_user('user{:03d}'.format(i))
+        async with self.fake.get_client() as client:
+            first = await client.list_users(
+                UserPoolId=self.fake.user_pool_id, Limit=50)
+            # users change between the two pages
+            self.fake.add_user('aaa')
+            await client.admin_delete_user(
+                UserPoolId=self.fake.user_pool_id, Username='user010')
+            second = await client.list_users(
+                UserPoolId=self.fake.user_pool_id, Limit=50,
+                PaginationToken=first['PaginationToken'])
+        usernames = [user['Username']
+                     for user in first['Users'] + second['Users']]
+        self.assertEqual(usernames,
+                         ['user{:03d}'.format(i) for i in range(100)])
+        self.assertNotIn('PaginationToken', second)
+
+    async def test_expired_tokens_are_forgotten(self):
+        fake = FakeCognito(key_bits=1024, token_validity=60,
+                           refresh_token_validity=120)
+        fake.add_user('bob', 'Passw0rd!')
+        now = time.time()
+        for _ in range(10):
+            fake.issue_tokens('bob', issued_at=now - 200)
+        tokens = fake.issue_tokens('bob')
+        self.assertEqual(len(fake._access_tokens), 1)
+        self.assertEqual(len(fake._refresh_tokens), 1)
+        self.assertEqual(fake.users['bob'].tokens,
+                         {tokens['AccessToken'], tokens['RefreshToken']})
+
+        fake.sign_out('bob')
+        self.assertEqual(fake.users['bob'].tokens, set())
+        cog = fake.cognito(username='bob')
+        cog.refresh_token = tokens['RefreshToken']
+        with self.assertRaises(ClientError):
+            await cog.renew_access_token()
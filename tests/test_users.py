@@ -0,0 +1,258 @@
+import asyncio
+
+import asynctest
+from botocore.exceptions import ClientError
+
+from mandate import Cognito
+from mandate.exceptions import ProfileWriteException
+from mandate.testing import FakeCognito
+from mandate.writebehind import ProfileWriteBuffer
+from tests.MockClient import MockClient
+
+
+class testUsers(asynctest.TestCase):
+
+    async def test_get_users_paginates(self):
+        pages = {
+            None: {
+                'Users': [
+                    {'Username': 'alice',
+                     'Attributes': [{'Name': 'email', 'Value': 'a@a.com'}]},
+                ],
+                'PaginationToken': 'page2',
+            },
+            'page2': {
+                'Users': [
+                    {'Username': 'bob',
+                     'Attributes': [{'Name': 'email', 'Value': 'b@b.com'}]},
+                ],
+            },
+        }
+        calls = []
+
+        async def _fake_list_users(UserPoolId=None, PaginationToken=None,
+                                   Limit=None):
+            calls.append((PaginationToken, Limit))
+            return pages[PaginationToken]
+
+        mock_client = MockClient(mock_list_users=_fake_list_users)
+        cog = Cognito(
+            'user_pool_id',
+            'client_id',
+            user_pool_region='eu-west-2',
+            client_callback=lambda: mock_client
+        )
+
+        users = await cog.get_users()
+        self.assertEqual([user.username for user in users], ['alice', 'bob'])
+        self.assertEqual(users[1].email, 'b@b.com')
+
+        streamed = [user.username
+                    async for user in cog.iter_users(page_size=1)]
+        self.assertEqual(streamed, ['alice', 'bob'])
+        self.assertEqual(calls[2:], [(None, 1), ('page2', 1)])
+
+    def test_user_from_claims(self):
+        cog = Cognito('user_pool_id', 'client_id',
+                      user_pool_region='eu-west-2')
+        user = cog.user_from_claims({
+            'sub': 'abc-123',
+            'cognito:username': 'alice',
+            'cognito:groups': ['admins'],
+            'email': 'a@a.com',
+            'email_verified': True,
+            'phone_number_verified': 'false',
+            'custom:team': 'blue',
+            'aud': 'client_id',
+            'token_use': 'id',
+            'iss': 'https://cognito-idp.eu-west-2.amazonaws.com/pool',
+            'exp': 2000000000,
+            'iat': 1000000000,
+            'auth_time': 1000000000,
+        }, attr_map={'custom:team': 'team'})
+        self.assertEqual(user.username, 'alice')
+        self.assertEqual(user.sub, 'abc-123')
+        self.assertEqual(user.email, 'a@a.com')
+        self.assertIs(user.email_verified, True)
+        self.assertIs(user.phone_number_verified, False)
+        self.assertEqual(user.team, 'blue')
+        self.assertEqual(user.groups, ['admins'])
+        self.assertEqual(sorted(user._data), ['email', 'team'])
+
+
+class testScanUsers(asynctest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeCognito(key_bits=1024)
+        for i in range(250):
+            cls.fake.add_user(
+                'user{:03d}'.format(i),
+                attributes={'email': 'u{}@example.com'.format(i)})
+
+    async def test_scan_users(self):
+        in_flight = []
+        peak = []
+        calls = []
+        client = self.fake.get_client()
+        list_users = client.list_users
+
+        async def counting_list_users(**kwargs):
+            calls.append(kwargs['Filter'])
+            in_flight.append(None)
+            peak.append(len(in_flight))
+            try:
+                return await list_users(**kwargs)
+            finally:
+                in_flight.pop()
+
+        client.list_users = counting_list_users
+        self.fake.latency = 0.001
+        self.addCleanup(setattr, self.fake, 'latency', 0.0)
+        cog = self.fake.cognito(client_callback=lambda: client)
+
+        users = [user async for user in cog.scan_users(concurrency=3,
+                                                       page_size=10)]
+        self.assertEqual(sorted(user.username for user in users),
+                         sorted(self.fake.users))
+        self.assertEqual(len(set(calls)), 16)
+        self.assertGreater(len(calls), 16)
+        self.assertEqual(max(peak), 3)
+
+    async def test_overlapping_shards(self):
+        cog = self.fake.cognito()
+        users = [user.username async for user in cog.scan_users(
+            shards=['username ^= "user0"', 'username ^= "user"'],
+            rate_limit=1000)]
+        self.assertEqual(sorted(users), sorted(self.fake.users))
+        # without deduplication, users matching both shards come twice
+        users = [user.username async for user in cog.scan_users(
+            shards=['username ^= "user0"', 'username ^= "user"'],
+            dedupe=False)]
+        self.assertEqual(len(users), 350)
+
+    async def test_stop_early(self):
+        cog = self.fake.cognito()
+        users = cog.scan_users(concurrency=2, page_size=5)
+        async for user in users:
+            break
+        # the 16 shards are cancelled, the queue full
+        await asyncio.wait_for(users.aclose(), 1)
+
+    async def test_errors(self):
+        cog = self.fake.cognito()
+        with self.assertRaises(ClientError):
+            async for user in cog.scan_users(shards=['username ~ "x"']):
+                pass
+
+
+class testProfileWrites(asynctest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeCognito(key_bits=1024)
+        self.fake.add_user('bob', 'Passw0rd!',
+                           {'email': 'bob@example.com', 'custom:level': '1',
+                            'custom:score': '0'})
+        self.calls = []
+
+        def client():
+            client = self.fake.get_client()
+            update = client.admin_update_user_attributes
+
+            async def admin_update_user_attributes(**kwargs):
+                self.calls.append(kwargs['UserAttributes'])
+                return await update(**kwargs)
+            client.admin_update_user_attributes = admin_update_user_attributes
+            return client
+        self.cog = self.fake.cognito(username='bob', client_callback=client)
+
+    async def test_save_sends_changed_attributes(self):
+        user = self.cog.get_user_obj(
+            'bob', attribute_list=[
+                {'Name': 'email', 'Value': 'bob@example.com'},
+                {'Name': 'custom:level', 'Value': '1'}],
+            attr_map={'custom:level': 'level'})
+        user.email = 'bob@example.com'
+        self.assertEqual(user.changed_attributes(), {})
+        await user.save(admin=True)
+        self.assertEqual(self.calls, [])
+
+        user.level = '2'
+        self.assertEqual(user.changed_attributes(), {'level': '2'})
+        await user.save(admin=True)
+        self.assertEqual(self.calls,
+                         [[{'Name': 'custom:level', 'Value': '2'}]])
+        self.assertEqual(user.changed_attributes(), {})
+        self.assertEqual(
+            self.fake.users['bob'].attributes['custom:level'], '2')
+
+    async def test_coalesces_updates(self):
+        async with ProfileWriteBuffer(self.cog, delay=0.05) as buffer:
+            first = buffer.update('bob', {'score': '10'},
+                                  attr_map={'custom:score': 'score'})
+            second = buffer.update('bob', {'custom:level': '2'})
+            self.assertIs(first, second)
+            buffer.update('bob', {'custom:score': '11'})
+            self.assertEqual(len(buffer), 1)
+            await first
+            self.assertEqual(len(self.calls), 1)
+            self.assertEqual(
+                sorted((a['Name'], a['Value']) for a in self.calls[0]),
+                [('custom:level', '2'), ('custom:score', '11')])
+
+            # a new window once the previous write started
+            await buffer.update('bob', {'custom:score': '12'})
+            self.assertEqual(len(self.calls), 2)
+        attributes = self.fake.users['bob'].attributes
+        self.assertEqual(attributes['custom:score'], '12')
+
+    async def test_flush_on_close(self):
+        buffer = ProfileWriteBuffer(self.cog, delay=60)
+        future = buffer.update('bob', {'custom:score': '5'})
+        user = self.cog.get_user_obj(
+            'bob', attribute_list=[{'Name': 'email',
+                                    'Value': 'bob@example.com'}])
+        user.email = 'robert@example.com'
+        buffer.save(user)
+        # until written
+        self.assertEqual(user.changed_attributes(),
+                         {'email': 'robert@example.com'})
+        self.assertEqual(self.calls, [])
+        await buffer.close()
+        self.assertTrue(future.done())
+        self.assertEqual(user.changed_attributes(), {})
+        self.assertEqual(len(self.calls), 1)
+        attributes = self.fake.users['bob'].attributes
+        self.assertEqual(attributes['custom:score'], '5')
+        self.assertEqual(attributes['email'], 'robert@example.com')
+        with self.assertRaises(RuntimeError):
+            buffer.update('bob', {'custom:score': '6'})
+
+    async def test_errors(self):
+        buffer = ProfileWriteBuffer(self.cog, delay=0)
+        with self.assertRaises(ClientError):
+            await buffer.update('nobody', {'custom:score': '1'})
+        with self.assertRaises(ProfileWriteException) as error:
+            await buffer.flush()
+        self.assertEqual(error.exception.failures[0][:2],
+                         ('nobody', {'custom:score': '1'}))
+        # reported once
+        await buffer.flush()
+
+    async def test_failed_write_on_close(self):
+        buffer = ProfileWriteBuffer(self.cog, delay=60)
+        user = self.cog.get_user_obj(
+            'nobody', attribute_list=[{'Name': 'email',
+                                       'Value': 'nobody@example.com'}])
+        user.email = 'somebody@example.com'
+        buffer.save(user)
+        buffer.update('bob', {'custom:score': '5'})
+        with self.assertRaises(ProfileWriteException) as error:
+            await buffer.close()
+        self.assertEqual([failure[0] for failure in error.exception.failures],
+                         ['nobody'])
+        # still to be saved
+        self.assertEqual(user.changed_attributes(),
+                         {'email': 'somebody@example.com'})
+        self.assertEqual(self.fake.users['bob'].attributes['custom:score'],
+                         '5')